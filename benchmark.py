@@ -0,0 +1,129 @@
+""" Runs the experiments against the simulated instruments in
+    instruments/simulated.py and prints how long each one takes. Nothing in
+    here will ever touch real hardware. 
+
+    python benchmark.py                  -- run every case
+    python benchmark.py iv_daqgate       -- run one case
+    python -m cProfile -s cumtime benchmark.py iv_daqgate
+    MEASUREMENTS_TIMING=1 python benchmark.py iv_daqgate  -- and a .timing summary
+
+    Data and log files are written to a temporary directory. """
+
+from __future__ import division
+import os, sys, time, tempfile
+os.environ['MEASUREMENTS_BACKEND'] = 'sim' #before any instruments are imported
+
+import keithleypair_IV_Var
+import keithleypair_fixBias_swpVar
+import daqIO_VI
+import instruments.instruments as instruments
+import instruments.keithleypair as keithleypair
+from instruments import pool, jobs
+from instruments.backend import nidaqmx
+
+def iv_daqgate():
+    exp = keithleypair_IV_Var.IV_DAQgate(filename = 'iv-DAQgate')
+    exp.run_simple([-1e-3, 1e-3, 1e-5], [-1.0, 1.0, 0.5], gateDelay = 0.1)
+
+def iv_magfield():
+    exp = keithleypair_IV_Var.IV_MagField(filename = 'iv-magField')
+    exp.run_simple([-1e-3, 1e-3, 1e-5], [0.0, 0.02, 0.01], fieldDelay = 0.5, heater_off = False)
+
+def iv_magfield_again():
+    iv_magfield() #instruments from the last run come from the pool, no heater wait
+
+def fixbias_swpgate():
+    exp = keithleypair_fixBias_swpVar.FixBias_SwpGate(filename = 'fixBias_swpGate')
+    exp.run_simple(1e-6, [-1.0, 1.0, 0.1], avg = 10, gateDelay = 0.05)
+
+def daqio_gatetest():
+    exp = daqIO_VI.DAQIO_gateTest()
+    exp.run_simple(1e-3, samples = 100, gateDelay = 0.01, filename = 'DAQIO_gateTest')
+
+def map_instruments():
+
+    """ the instruments for one point of a gate/field map, from the pool,
+        the way map_setup left them """
+
+    source = pool.acquire(keithleypair.FixedBias, "GPIB::22", timeout = 60.0)
+    mag = pool.acquire(instruments.oxford_magnet, "GPIB::20", rate = 6.0)
+    itc = pool.acquire(instruments.oxford_temp, "GPIB::24")
+    gate = pool.acquire(nidaqmx.AnalogOutputTask, 'Dev1/ao0', min_val = -10.0, max_val = 10.0)
+    return source, mag, itc, gate
+
+map_points = [(0.1*i, 0.01*i) for i in range(10)] #(gate, field)
+
+def map_sequential():
+    source, mag, itc, gate = map_instruments()
+    for g, field in map_points:
+        gate.write([g])
+        mag.go_to_field(field)
+        itc.get_temps()
+        source.get_meas()
+    pool.release(source, mag, itc, gate)
+
+def map_overlapped():
+    source, mag, itc, gate = map_instruments()
+    gate, mag, itc = jobs.Async(gate), jobs.Async(mag), jobs.Async(itc)
+    for g, field in map_points:
+        temps = itc.get_temps() #read while the gate and field are set
+        jobs.gather(gate.write([g]), mag.go_to_field(field))
+        source.get_meas()
+        temps.result()
+    pool.release(source, mag.instrument, itc.instrument, gate.instrument)
+
+def map_setup():
+
+    """ open and set up the instruments (the heater wait, the avg_crossover
+        calibration on a fresh calibration file) and go back to zero field,
+        so only the map loop is timed """
+
+    source, mag, itc, gate = map_instruments()
+    source.general_setup()
+    source.bias_setup(1e-6)
+    source.voltmeter_channel_setup(1.0, 0.1)
+    source.single_point_setup(20, 0.0)
+    source.write('outp 1')
+    mag.go_to_field(0.0)
+    pool.release(source, mag, itc, gate)
+
+map_sequential.setup = map_overlapped.setup = map_setup
+
+def fixbias_stream():
+    source = pool.acquire(keithleypair.FixedBias, "GPIB::22")
+    source.general_setup()
+    source.bias_setup(1e-6)
+    source.voltmeter_channel_setup(0.1, 0.1)
+    source.voltmeter_format_setup('sreal')
+    source.stream_setup(200)
+    source.write('outp 1')
+    for data in source.stream(10):
+        data.mean()
+    source.write('outp 0')
+    pool.release(source)
+
+cases = [iv_daqgate, fixbias_swpgate, daqio_gatetest, iv_magfield, iv_magfield_again,
+         map_sequential, map_overlapped, fixbias_stream]
+
+def run(names = None):
+
+    """ run the named cases (all of them by default) and return a
+        dictionary of wall times in seconds """
+
+    os.chdir(tempfile.mkdtemp(prefix = 'measurements-'))
+    times = {}
+    for case in cases:
+        if names and case.__name__ not in names:
+            continue
+        if hasattr(case, 'setup'): #not part of the time
+            case.setup()
+        start = time.time()
+        case()
+        times[case.__name__] = time.time() - start
+    print '\n{0:<20}{1:>10}'.format('case', 'time (s)')
+    for name, t in sorted(times.items()):
+        print '{0:<20}{1:>10.2f}'.format(name, t)
+    return times
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
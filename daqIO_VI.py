@@ -3,13 +3,13 @@
     
 from __future__ import division
 import time, os, math
-import msvcrt
 import numpy as np
-import matplotlib.pylab as plt
-import matplotlib.animation as animation
-import nidaqmx
+from instruments.backend import nidaqmx, msvcrt
+from instruments import pool, timing
 import exptools.exptools as tools
-from threading import Thread
+import exptools.datafile as datafile
+import exptools.liveplot as liveplot
+import exptools.sweep as sweep
     
 class DAQIO_gateTest():
 
@@ -22,10 +22,11 @@ class DAQIO_gateTest():
         
     def __init__(self):
     
-        """ This doesn't do much other than create the end_run variable. """
+        """ The file and the sweep of the last run. """
 
-        self.end_run = False
-        self.data = [0.0]
+        self.file = None
+        self.plan = None
+        self.live_plot = False #run() sets it, run_simple starts the plot
         
     def run_simple(self, bias, samples = 1.0, gateDelay = 0.75, field = 0.0, 
                    biasDivider = 1e-3, cvAmp = -1e-6, gateAmp = 9.1788, 
@@ -35,22 +36,18 @@ class DAQIO_gateTest():
             run() function. """
         
         tools.write_log('DAQIO_gateTest', locals(), filename+'.log.txt')
-        file = open(filename+'.dat.txt','a')
-        self.end_run = False
+        timing.start(filename+'.timing')
+        file = self.file = datafile.DataFile(filename+'.npy')
         
         #setup output channels
         bias_channel = 'Dev1/ao0'
-        bias_out = nidaqmx.AnalogOutputTask()
-        bias_out.create_voltage_channel(bias_channel, min_val = -10.0, max_val = 10.0)
+        bias_out = pool.acquire(nidaqmx.AnalogOutputTask, bias_channel, min_val = -10.0, max_val = 10.0)
         
         gate_channel = 'Dev1/ao1'
-        gate_out = nidaqmx.AnalogOutputTask()
-        gate_out.create_voltage_channel(gate_channel, min_val = -10.0, max_val = 10.0)
+        gate_out = pool.acquire(nidaqmx.AnalogOutputTask, gate_channel, min_val = -10.0, max_val = 10.0)
         
         gat = np.arange(0,10.1,0.1)
         gates = np.append(gat, [gat[::-1], -gat, -gat[::-1]])
-        self.data = np.zeros((len(gates), samples+3))
-        sample_data = np.zeros((samples,1))
         
         #setup input channel
         input_channel = 'Dev1/ai0' #if using differential mode this should be the high side
@@ -65,72 +62,40 @@ class DAQIO_gateTest():
         bias_out.write(bias/biasDivider)
         time.sleep(10.0)
 
-        #run experiment
-        exitGate = 0.0
+        #run experiment, rows of gate, current, bias/current, every sample
+        #the block starts before the gate moves, as it always has
         print 'GO!'
-        for i, gate in enumerate(gates):
-            itask.start()
-            gate_out.write(gate/gateAmp)
-            time.sleep(gateDelay)
-            sample_data = itask.read()
-            itask.wait_until_done()
-            itask.stop()
-            self.data[i,0] = gate
-            self.data[i,1] = sample_data.mean()*cvAmp
-            self.data[i,2] = bias/self.data[i,1]
-            self.data[i,3:] = sample_data.transpose()
-            np.savetxt(file, [self.data[i]], fmt = '%+.6e', delimiter = '\t')
-            if (msvcrt.kbhit() and ord(msvcrt.getch()) == 113) or self.end_run:
-                    exitGate = gate
-                    print "Program ended by user."
-                    break
+        plan = self.plan = sweep.Sweep([sweep.gate(gate_out, gates, gateAmp, settle = gateDelay)],
+                                       sweep.daq_block(itask, sample_rate, cvAmp, bias, start_early = True))
+        if self.live_plot: #closing it ends the run
+            viewer = liveplot.launch(file.filename, 'points', title = 'bias = {0:+.2e}V'.format(bias),
+                                     xlabel = 'gate (V)', ylabel = 'current (A)')
+            liveplot.when_closed(viewer, plan.stop)
+        plan.run(file, eta_every = 50)
                 
+        timing.set_phase('setup')
         bias_out.write(0.0)
-        bias_out.clear()
         gate_out.write(0.0) #turn off gate, should already be at 0
-        gate_out.clear()
-        del gate_out, bias_out #delete DAQ object so it can be reused
+        pool.release(gate_out, bias_out) #left open for the next run
+        del gate_out, bias_out
         file.close()
+        timing.finish()
         print 'Done.'
 
     def run(self, *args, **kwargs):
     
-        """ This will run the animation as the main thread and start a 
-            second thread for the measurement.
+        """ Runs self.run_simple with a live plot of current against gate
+            in a separate process, see exptools.liveplot. Closing the plot
+            ends the run, like 'q'.
             
             Takes all of the arguments and keyword arguments and passes them
             to self.run_simple """
         
-        runArgs = args
-        runKwargs = kwargs
-        
-        def update_current_gate(num, line, ax):
-            poin = np.count_nonzero(self.data[:,1])
-            line.set_data(self.data[0:poin,0], self.data[0:poin,1])
-            ax.set_xlim(np.amin(self.data[0:poin,0]), np.amax(self.data[0:poin,0]))
-            ax.set_ylim(np.amin(self.data[0:poin,1]),np.amax(self.data[0:poin,1])) 
-            return line, ax
-    
-        t = Thread(target = self.run_simple, args = runArgs, kwargs = runKwargs)
-        t.start()
-        time.sleep(5.0)
-        
-        while np.count_nonzero(self.data[:,1]) < 3: 
-            time.sleep(0.2)  #wait for at least three points to plot
-            
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        ax.grid(True)
-        title_text = plt.title('bias = {0:+.2e}V'.format(args[0]))
-        line, = ax.plot([], [],'r-o')
-        plt.xlabel('gate (V)')
-        plt.ylabel('current (A)')
-
-        line_ani = animation.FuncAnimation(fig, update_current_gate, fargs=(line, ax),
-            interval=1000, blit=False)
-            
-        plt.show()
-        self.end_run = True
+        self.live_plot = True
+        try:
+            self.run_simple(*args, **kwargs)
+        finally:
+            self.live_plot = False
         
 class DAQIO_stabilityTest():
 
@@ -146,6 +111,8 @@ class DAQIO_stabilityTest():
 
         self.end_run = False
         self.data = 0.0
+        self.file = None
+        self.live_plot = False #run() sets it, run_simple starts the plot
         
     def run_simple(self, bias, gateDelay = 1.0, measDelay = 0.75, 
                    field = 0.0, biasDivider = 1e-3, cvAmp = -1e-6, gateAmp = 9.1788, 
@@ -155,8 +122,14 @@ class DAQIO_stabilityTest():
             run() function. """
         
         tools.write_log('DAQIO_gateTest', locals(), filename+'.log.txt')
-        file = open(filename+'.dat.txt','a')
+        timing.start(filename+'.timing')
+        file = self.file = datafile.DataFile(filename+'.npy')
         self.end_run = False
+        watch = None
+        if self.live_plot: #closing it ends the run
+            viewer = liveplot.launch(file.filename, 'points', title = 'bias = {0:+.2e}V'.format(bias),
+                                     xlabel = 'gate (V)', ylabel = 'current (A)')
+            watch = liveplot.when_closed(viewer, self.stop)
         
         sample_rate = 1000
         sample_average = 1000
@@ -164,22 +137,19 @@ class DAQIO_stabilityTest():
         
         #setup output channels
         bias_channel = 'Dev1/ao0'
-        bias_out = nidaqmx.AnalogOutputTask()
-        bias_out.create_voltage_channel(bias_channel, min_val = -10.0, max_val = 10.0)
+        bias_out = pool.acquire(nidaqmx.AnalogOutputTask, bias_channel, min_val = -10.0, max_val = 10.0)
         
         gate_channel = 'Dev1/ao1'
-        gate_out = nidaqmx.AnalogOutputTask()
-        gate_out.create_voltage_channel(gate_channel, min_val = -10.0, max_val = 10.0)
+        gate_out = pool.acquire(nidaqmx.AnalogOutputTask, gate_channel, min_val = -10.0, max_val = 10.0)
         
         gates = [0.0, 1.0, 0.0, -1.0, 0.0]
-        # self.data = np.zeros((, ))
-        # sample_data = np.zeros((sample_average,1))
+        self.data = np.zeros((len(gates), 3 + sample_average)) #gate, current, bias/current, samples
         
         #setup input channel
         input_channel = 'Dev1/ai0' #if using differential mode this should be the high side
         itask = nidaqmx.AnalogInputTask()
         itask.create_voltage_channel(input_channel, terminal = 'diff', min_val = -5.0, max_val = 5.0)
-        itask.configure_timing_sample_clock(rate = sample_rate, samples_per_channel = samples, 
+        itask.configure_timing_sample_clock(rate = sample_rate, samples_per_channel = sample_average, 
                                             sample_mode = 'finite')
         itask.alter_state('commit')
         
@@ -191,68 +161,60 @@ class DAQIO_stabilityTest():
         exitGate = 0.0
         print 'GO!'
         for i, gate in enumerate(gates):
+            timing.set_phase('settle')
             gate_out.write(gate/gateAmp)
             time.sleep(gateDelay)
             for j in range(25):
+                timing.set_phase('acquire')
                 itask.start()
                 sample_data = itask.read()
+                timing.add('integrating', len(sample_data)/sample_rate)
                 itask.wait_until_done()
                 itask.stop()
                 
+                timing.set_phase('save')
                 self.data[i,0] = gate
                 self.data[i,1] = sample_data.mean()*cvAmp
                 self.data[i,2] = bias/self.data[i,1]
                 self.data[i,3:] = sample_data.transpose()
-                np.savetxt(file, [self.data[i]], fmt = '%+.6e', delimiter = '\t')
+                file.write(self.data[i])
                 if (msvcrt.kbhit() and ord(msvcrt.getch()) == 113) or self.end_run:
                         exitGate = gate
+                        self.end_run = True
                         print "Program ended by user."
                         break
+            if self.end_run:
+                break
                 
+        timing.set_phase('setup')
+        if watch is not None:
+            watch.cancel()
         bias_out.write(0.0)
-        bias_out.clear()
         gate_out.write(0.0) #turn off gate, should already be at 0
-        gate_out.clear()
-        del gate_out, bias_out #delete DAQ object so it can be reused
+        pool.release(gate_out, bias_out) #left open for the next run
+        del gate_out, bias_out
         file.close()
+        timing.finish()
         print 'Done.'
 
+    def stop(self):
+
+        """ end the run after the point being measured, from any thread """
+
+        self.end_run = True
+
     def run(self, *args, **kwargs):
     
-        """ This will run the animation as the main thread and start a 
-            second thread for the measurement.
+        """ Runs self.run_simple with a live plot of current against gate
+            in a separate process, see exptools.liveplot. The plot is cut
+            down to about 2000 points by a decimate.Pyramid. Closing it
+            ends the run, like 'q'.
             
             Takes all of the arguments and keyword arguments and passes them
             to self.run_simple """
         
-        runArgs = args
-        runKwargs = kwargs
-        
-        def update_current_gate(num, line, ax):
-            poin = np.count_nonzero(self.data[:,1])
-            line.set_data(self.data[0:poin,0], self.data[0:poin,1])
-            ax.set_xlim(np.amin(self.data[0:poin,0]), np.amax(self.data[0:poin,0]))
-            ax.set_ylim(np.amin(self.data[0:poin,1]),np.amax(self.data[0:poin,1])) 
-            return line, ax
-    
-        t = Thread(target = self.run_simple, args = runArgs, kwargs = runKwargs)
-        t.start()
-        time.sleep(4.0)
-        
-        while np.count_nonzero(self.data[:,1]) < 3: 
-            time.sleep(0.2)  #wait for at least three points to plot
-            
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        ax.grid(True)
-        title_text = plt.title('bias = {0:+.2e}V'.format(args[0]))
-        line, = ax.plot([], [],'r-o')
-        plt.xlabel('gate (V)')
-        plt.ylabel('current (A)')
-
-        line_ani = animation.FuncAnimation(fig, update_current_gate, fargs=(line, ax),
-            interval=1000, blit=False)
-            
-        plt.show()
-        self.end_run = True
-        
+        self.live_plot = True
+        try:
+            self.run_simple(*args, **kwargs)
+        finally:
+            self.live_plot = False
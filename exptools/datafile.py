@@ -0,0 +1,348 @@
+""" An append only binary data file for the experiments, so saving a point
+    doesn't mean formatting a line of text and an fsync every time.
+
+    import exptools.datafile as datafile
+
+    data = datafile.DataFile(filename+'.npy')
+    for gate in gates:
+        ...
+        data.write([gate, current, run+1])
+    data.close() #always syncs
+
+    Rows of float64 are handed to the operating system as they are written,
+    so the live plots see them and the program crashing loses nothing. They
+    are only fsynced once sync_rows rows have piled up or sync_seconds have
+    passed since the last sync, whichever is first (checked on every write),
+    so a power cut loses at most the rows of one sync interval.
+
+    The file is a .npy file, np.load reads it once it is closed. The header
+    has room for the row count to grow and is rewritten at every sync.
+    load() goes by the size of the file instead, for a file that is still
+    being written or was never closed. To get the old text format...
+
+    np.savetxt('iv.dat', datafile.load('iv.npy'), fmt = '%+.6e', delimiter = '\t')
+
+    Every DataFile also keeps the rows written to it in memory, in feed, for
+    the live plots, which only take the rows that are new since their last
+    frame instead of reading the whole file again.
+
+    Maps (IV curves against gate or field) go in a Map instead, which is
+    preallocated from the sweep axes and filled in place...
+
+    iv = datafile.Map.create(filename+'.map', [('gate', gates), ('curve', range(ivAvg)),
+                                               ('bias', bias)])
+    for j, gate in enumerate(gates):
+        ...
+        iv.write(j, curves) #ivAvg x bias
+    iv.close()
+
+    and read back a piece at a time without loading the rest...
+
+    iv = datafile.Map('iv-DAQgate.map')
+    axes, curves = iv.region(gate = 0.5) #every curve at the gate closest to 0.5V
+    axes, cut = iv.region(bias = 1e-3, gate = (0.0, 1.0)) """
+
+import os, time, json, struct, threading
+from collections import OrderedDict
+import numpy as np
+
+magic = b'\x93NUMPY\x01\x00'
+header_size = 128 #bytes, magic included, room for any row count
+
+def header(rows, columns, size = header_size):
+
+    """ .npy version 1.0 header for a (rows, columns) float64 array, padded
+        to size bytes """
+
+    text = "{{'descr': '<f8', 'fortran_order': False, 'shape': ({0}, {1}), }}".format(rows, columns)
+    text = text.ljust(size - len(magic) - 3) + '\n'
+    return magic + struct.pack('<H', len(text)) + text
+
+def read_header(f):
+
+    """ (columns, offset of the data) of the open .npy file f """
+
+    f.seek(0)
+    np.lib.format.read_magic(f)
+    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    if len(shape) != 2 or fortran_order or dtype != np.dtype('<f8'):
+        raise ValueError('{} is not a file of float64 rows'.format(f.name))
+    return shape[1], f.tell()
+
+def load(filename):
+
+    """ every complete row in filename as a 2d array, also while it is
+        being written """
+
+    if not os.path.exists(filename) or os.path.getsize(filename) < header_size:
+        return np.zeros((0, 0)) #nothing written yet
+    with open(filename, 'rb') as f:
+        columns, offset = read_header(f)
+        rows = (os.fstat(f.fileno()).st_size - offset)//(8*columns)
+        return np.fromfile(f, dtype = '<f8', count = rows*columns).reshape(rows, columns)
+
+class Feed(object):
+
+    """ rows appended by the measurement thread, read by the plot. the
+        plot keeps the number of rows it has seen and asks for the rest...
+
+        rows, seen = feed.since(seen)
+
+        the rows handed out are views that never change, appending only
+        copies when the space runs out (it doubles). """
+
+    def __init__(self, capacity = 256):
+        self.capacity = capacity
+        self.lock = threading.Condition()
+        self.data = None
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, rows):
+        rows = np.atleast_2d(rows)
+        with self.lock:
+            if self.data is None:
+                self.data = np.empty((max(self.capacity, len(rows)), rows.shape[1]))
+            elif self.rows + len(rows) > len(self.data):
+                grown = np.empty((max(2*len(self.data), self.rows + len(rows)), self.data.shape[1]))
+                grown[:self.rows] = self.data[:self.rows]
+                self.data = grown
+            self.data[self.rows:self.rows + len(rows)] = rows
+            self.rows += len(rows)
+            self.lock.notify_all()
+
+    def since(self, start):
+
+        """ (the rows after the first start, the number of rows now) """
+
+        with self.lock:
+            if self.data is None:
+                return np.zeros((0, 0)), 0
+            return self.data[start:self.rows], self.rows
+
+    def wait(self, rows, timeout = None):
+
+        """ block until there are at least rows rows, False if timeout
+            seconds pass first """
+
+        end = None if timeout is None else time.time() + timeout
+        with self.lock:
+            while self.rows < rows:
+                if end is not None and time.time() >= end:
+                    return False
+                self.lock.wait(None if end is None else end - time.time())
+            return True
+
+class DataFile(object):
+
+    """ float64 rows appended to a .npy file, see the module docstring.
+        an existing file is added to, like open(filename, 'a') did. the
+        number of columns is taken from the first row if not given. only
+        the rows written by this DataFile are in feed. """
+
+    def __init__(self, filename, columns = None, sync_rows = 1000, sync_seconds = 10.0):
+        self.filename = filename
+        self.columns = columns
+        self.sync_rows = sync_rows
+        self.sync_seconds = sync_seconds
+        self.rows = 0 #rows written to the file
+        self.synced = 0 #rows in the header and on disk
+        self.file = None
+        self.offset = header_size
+        self.last_sync = time.time()
+        self.feed = Feed()
+        if os.path.exists(filename) and os.path.getsize(filename):
+            self.file = open(filename, 'r+b')
+            columns, self.offset = read_header(self.file)
+            if self.columns not in (None, columns):
+                raise ValueError('{0} has {1} columns, not {2}'.format(filename, columns, self.columns))
+            self.columns = columns
+            self.rows = self.synced = (os.path.getsize(filename) - self.offset)//(8*columns)
+            self.file.truncate(self.offset + 8*self.rows*columns) #a row cut off by a crash
+            self.file.seek(0, 2)
+        elif columns is not None:
+            self._create()
+
+    def _create(self):
+        self.file = open(self.filename, 'w+b')
+        self.file.write(header(0, self.columns))
+        self.file.flush()
+
+    def __len__(self):
+        return self.rows
+
+    def write(self, rows):
+
+        """ append one row, or a 2d array of them """
+
+        rows = np.atleast_2d(np.asarray(rows, dtype = '<f8'))
+        if self.file is None:
+            self.columns = rows.shape[1]
+            self._create()
+        if rows.shape[1] != self.columns:
+            raise ValueError('rows of {0} values, {1} has {2} columns'.format(rows.shape[1], self.filename,
+                                                                             self.columns))
+        self.file.write(rows.tostring())
+        self.file.flush()
+        self.feed.append(rows)
+        self.rows += len(rows)
+        if self.rows - self.synced >= self.sync_rows or time.time() - self.last_sync >= self.sync_seconds:
+            self.sync()
+
+    def sync(self):
+
+        """ flush the rows written so far to disk and update the header """
+
+        if self.file is None:
+            return
+        self.file.seek(0)
+        self.file.write(header(self.rows, self.columns, self.offset))
+        self.file.seek(0, 2)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.synced = self.rows
+        self.last_sync = time.time()
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+class Map(object):
+
+    """ an N dimensional dataset over the axes of a sweep, in a directory of
+        memory-mapped .npy files:
+
+        data.npy -- the values, NaN until written
+        mask.npy -- True for the rows (everything but the last axis) written
+        journal.npy -- the number of rows written, then the flat index of
+                       each row in the order they were written
+        axes.json -- the names and values of the axes
+
+        open an existing one with Map(filename), mode = 'r+' to write to
+        it. other processes can open it while it is being written, since()
+        gives them the rows that are new. """
+
+    def __init__(self, filename, mode = 'r', sync_seconds = 10.0):
+        self.filename = filename
+        self.sync_seconds = sync_seconds
+        self.last_sync = time.time()
+        with open(os.path.join(filename, 'axes.json')) as f:
+            self.axes = OrderedDict((str(name), np.array(values)) for name, values in json.load(f))
+        self.data = np.lib.format.open_memmap(os.path.join(filename, 'data.npy'), mode = mode)
+        self.mask = np.lib.format.open_memmap(os.path.join(filename, 'mask.npy'), mode = mode)
+        self.journal = np.lib.format.open_memmap(os.path.join(filename, 'journal.npy'), mode = mode)
+        self.rows = np.arange(self.mask.size).reshape(self.mask.shape) #flat index of each row
+
+    @classmethod
+    def create(cls, filename, axes, sync_seconds = 10.0):
+
+        """ a new, empty Map for axes, [(name, values)] with the outermost
+            axis first. if filename is taken a number is added to it, see
+            the filename of the Map returned. """
+
+        base, ext = os.path.splitext(filename)
+        n = 1
+        while os.path.exists(filename):
+            filename = '{0}-{1}{2}'.format(base, n, ext)
+            n += 1
+        os.makedirs(filename)
+        axes = [(name, [float(x) for x in values]) for name, values in axes]
+        shape = tuple(len(values) for name, values in axes)
+        data = np.lib.format.open_memmap(os.path.join(filename, 'data.npy'), mode = 'w+',
+                                         dtype = '<f8', shape = shape)
+        data[...] = np.nan
+        mask = np.lib.format.open_memmap(os.path.join(filename, 'mask.npy'), mode = 'w+',
+                                         dtype = np.bool_, shape = shape[:-1])
+        journal = np.lib.format.open_memmap(os.path.join(filename, 'journal.npy'), mode = 'w+',
+                                            dtype = '<i8', shape = (mask.size + 1,))
+        del data, mask, journal #written out when closed
+        with open(os.path.join(filename, 'axes.json'), 'w') as f:
+            json.dump(axes, f)
+        return cls(filename, 'r+', sync_seconds)
+
+    def __len__(self):
+
+        """ the number of rows written """
+
+        return int(self.journal[0])
+
+    def write(self, index, values):
+
+        """ fill the rows at index (over every axis but the last) with
+            values. each row can only be written once. """
+
+        rows = np.ravel(self.rows[index])
+        if self.mask.flat[rows].any():
+            raise ValueError('{0} already has data at {1}'.format(self.filename, index))
+        done = int(self.journal[0])
+        self.data[index] = values
+        self.mask.flat[rows] = True
+        self.journal[done + 1:done + 1 + len(rows)] = rows
+        self.journal[0] = done + len(rows) #last, readers trust everything before it
+        if time.time() - self.last_sync >= self.sync_seconds:
+            self.sync()
+
+    def since(self, start):
+
+        """ ([index of each row written after the first start], the number
+            of rows written now) """
+
+        done = int(self.journal[0])
+        rows = np.unravel_index(self.journal[start + 1:done + 1], self.mask.shape)
+        return zip(*rows), done
+
+    def wait(self, rows, timeout = None, interval = 0.1):
+
+        """ block until there are at least rows rows, False if timeout
+            seconds pass first. polls, the writer may be another process. """
+
+        end = None if timeout is None else time.time() + timeout
+        while len(self) < rows:
+            if end is not None and time.time() >= end:
+                return False
+            time.sleep(interval)
+        return True
+
+    def region(self, **limits):
+
+        """ (axes, data) for part of the map. a limit is either a value,
+            which takes the closest point and drops the axis, or (low, high).
+            only that part is read from the file. """
+
+        index, axes = [], OrderedDict()
+        for name, values in self.axes.items():
+            limit = limits.pop(name, None)
+            if limit is None:
+                index.append(slice(None))
+                axes[name] = values
+            elif np.isscalar(limit):
+                index.append(int(np.argmin(np.abs(values - limit))))
+            else:
+                inside = np.flatnonzero((values >= min(limit)) & (values <= max(limit)))
+                part = slice(inside[0], inside[-1] + 1) if len(inside) else slice(0, 0)
+                index.append(part)
+                axes[name] = values[part]
+        if limits:
+            raise ValueError('{0} has no axis {1}'.format(self.filename, ', '.join(limits)))
+        return axes, np.array(self.data[tuple(index)])
+
+    def sync(self):
+
+        """ flush everything written so far to disk """
+
+        self.data.flush()
+        self.mask.flush()
+        self.journal.flush()
+        self.last_sync = time.time()
+
+    def close(self):
+
+        """ sync and go back to reading only, the arrays stay usable """
+
+        self.sync()
+        for name in ('data', 'mask', 'journal'):
+            setattr(self, name, np.lib.format.open_memmap(os.path.join(self.filename, name+'.npy'), mode = 'r'))
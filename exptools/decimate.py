@@ -0,0 +1,145 @@
+""" Cutting long data down to what a plot can show, so drawing an overnight
+    run costs the same as drawing the first minute of it.
+
+    minmax -- the smallest and largest value of each bucket, keeps peaks
+    minmax_xy -- the same for a line, the points stay in order
+    lttb -- largest triangle three buckets, keeps the shape of a line
+    Pyramid -- min/max levels of a growing line, built as the points arrive
+
+    pyramid = Pyramid()
+    pyramid.extend(t, current) #whenever there are new points
+    line.set_data(*pyramid.view(2000)) #at most about 2000 points """
+
+from __future__ import division
+import numpy as np
+
+def minmax(values, buckets, axis = -1):
+
+    """ values cut down to 2*buckets along axis, the smallest and the
+        largest value of each bucket, so peaks survive. NaNs are ignored. """
+
+    values = np.moveaxis(values, axis, -1)
+    edges = np.linspace(0, values.shape[-1], buckets + 1).astype(int)[:-1]
+    both = np.stack([np.fmin.reduceat(values, edges, axis = -1),
+                     np.fmax.reduceat(values, edges, axis = -1)], axis = -1)
+    return np.moveaxis(both.reshape(values.shape[:-1] + (2*buckets,)), -1, axis)
+
+def minmax_index(y, size):
+
+    """ indices of the smallest and largest y in each block of size points,
+        in the order they come in. the last block can be shorter. """
+
+    blocks = -(-len(y)//size)
+    padded = np.full(blocks*size, np.nan)
+    padded[:len(y)] = y
+    padded = padded.reshape(blocks, size)
+    filled = np.where(np.isnan(padded), np.inf, padded)
+    low = np.argmin(filled, axis = 1)
+    high = np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis = 1)
+    index = np.sort(np.stack([low, high], axis = 1), axis = 1) + size*np.arange(blocks)[:,None]
+    return index.ravel()
+
+def minmax_xy(x, y, points):
+
+    """ (x, y) cut down to about points points, the smallest and largest y
+        of each bucket """
+
+    if len(y) <= points:
+        return x, y
+    index = minmax_index(np.asarray(y, dtype = float), -(-2*len(y)//points))
+    return np.asarray(x)[index], np.asarray(y)[index]
+
+def lttb(x, y, points):
+
+    """ (x, y) cut down to points points by largest triangle three buckets:
+        the first and last point, and from each bucket in between the point
+        making the largest triangle with the one kept from the bucket before
+        and the mean of the bucket after. """
+
+    x, y = np.asarray(x, dtype = float), np.asarray(y, dtype = float)
+    if len(x) <= points or points < 3:
+        return x, y
+    edges = np.linspace(1, len(x) - 1, points - 1).astype(int)
+    kept = np.empty(points, dtype = int)
+    kept[0], kept[-1] = 0, len(x) - 1
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        after = slice(stop, edges[i + 2] if i + 2 < len(edges) else len(x))
+        ax, ay = x[kept[i]], y[kept[i]]
+        cx, cy = x[after].mean(), y[after].mean()
+        area = np.abs((ax - cx)*(y[start:stop] - ay) - (ax - x[start:stop])*(cy - ay))
+        kept[i + 1] = start + np.argmax(area)
+    return x[kept], y[kept]
+
+class Pyramid(object):
+
+    """ a growing line and min/max versions of it. every level holds two
+        points (the smallest and the largest y) per block of the level
+        below, so adding points only ever touches the new ones. the blocks
+        are factor points of the line and 2*factor points of a level above
+        it, so level 1 is factor/2 times shorter than the line and every
+        level after that factor times shorter than the one below. """
+
+    def __init__(self, factor = 4, capacity = 1024):
+        self.factor = factor
+        self.capacity = capacity
+        self.levels = [] #[x, y, points] per level, the arrays grow by doubling
+        self.done = [] #points of each level already summed up in the next
+
+    def __len__(self):
+        return self.levels[0][2] if self.levels else 0
+
+    def _append(self, level, x, y):
+        if level == len(self.levels):
+            self.levels.append([np.empty(self.capacity), np.empty(self.capacity), 0])
+            self.done.append(0)
+        arrays = self.levels[level]
+        n = arrays[2]
+        if n + len(x) > len(arrays[0]):
+            size = max(2*len(arrays[0]), n + len(x))
+            for k in (0, 1):
+                grown = np.empty(size)
+                grown[:n] = arrays[k][:n]
+                arrays[k] = grown
+        arrays[0][n:n + len(x)] = x
+        arrays[1][n:n + len(x)] = y
+        arrays[2] = n + len(x)
+
+    def extend(self, x, y):
+
+        """ add points, and the blocks they complete to the levels above """
+
+        self._append(0, np.ravel(x), np.ravel(y))
+        level = 0
+        while level < len(self.levels):
+            size = self.factor if level == 0 else 2*self.factor
+            x, y, n = self.levels[level]
+            complete = (n - self.done[level])//size*size
+            if complete:
+                part = slice(self.done[level], self.done[level] + complete)
+                index = minmax_index(y[part], size) + self.done[level]
+                self.done[level] += complete
+                self._append(level + 1, x[index], y[index])
+            level += 1
+
+    def view(self, points = 2000):
+
+        """ (x, y) of the whole line in at most about points points: the
+            lowest level that is short enough, then the newest points that
+            aren't in it yet from the levels below, and the newest point """
+
+        if not self.levels:
+            return np.zeros(0), np.zeros(0)
+        top = 0
+        while top < len(self.levels) - 1 and self.levels[top][2] > points:
+            top += 1
+        xs, ys = [self.levels[top][0][:self.levels[top][2]]], [self.levels[top][1][:self.levels[top][2]]]
+        for level in range(top - 1, -1, -1):
+            x, y, n = self.levels[level]
+            xs.append(x[self.done[level]:n])
+            ys.append(y[self.done[level]:n])
+        x, y, n = self.levels[0]
+        if top and self.done[0] == n: #the newest point always shows
+            xs.append(x[n - 1:n])
+            ys.append(y[n - 1:n])
+        return np.concatenate(xs), np.concatenate(ys)
@@ -3,6 +3,7 @@
 
 import time
 import math
+import numpy as np
     
 def write_log(func, arguments, filename):
     
@@ -34,25 +35,128 @@ def get_buffer_size(start, stop, step):
         
     buffer_size = abs((start - stop)/step)
     if float(buffer_size % 1) >= 0.5:
-        return math.floor(buffer_size)+2
+        return int(math.floor(buffer_size))+2
     else:
-        return math.floor(buffer_size)+1
+        return int(math.floor(buffer_size))+1
         
-def buffer_split(points):
-    
-    """ The buffer on the 2182 nanovoltmeter is limited to 
-        1024 points. This function splits an arbitrary number
-        of points into appropriately sized chunks. It returns
-        the number of chunks and their length. """
-    
-    i = 1024
-    if points < 1025:
-        return (1, int(points))
-    else: 
-        while (i > 99) and (not points%i == 0):
-            i-=1
-        if i != 99:
-            return (int(points/i), int(i))
-        else:
-             raise RuntimeError('There are no factors of {} < 1024 and > 99'
-                                   .format(points))
+def sweep_points(start, stop, step):
+
+    """ the number of points in a 6220 sweep from start to stop. the
+        values are rounded to what '{0:e}' sends to the instrument, then
+        it counts every whole step that fits. unlike get_buffer_size this
+        matches ':sour:swe:poin?'. """
+
+    start, stop, step = [float('{0:e}'.format(x)) for x in (start, stop, step)]
+    if step == 0.0:
+        return 1
+    return int(math.floor(abs((stop - start)/step) + 1e-9)) + 1
+
+class SweepPlan(object):
+
+    """ A sweep split into chunks that fit in the 2182 buffer.
+
+        points -- total number of points
+        chunks -- list of chunk lengths
+        segments -- (start, stop, points) for each chunk
+        time -- predicted time for the whole sweep in seconds """
+
+    def __init__(self, start, step, chunks, time = 0.0):
+        self.start = start
+        self.step = step
+        self.chunks = list(chunks)
+        self.points = sum(self.chunks)
+        self.time = time
+        self.segments, first = [], 0
+        for size in self.chunks:
+            self.segments.append((start + first*step, start + (first + size - 1)*step, size))
+            first += size
+
+    def values(self):
+
+        """ the source value at every point of the sweep """
+
+        return self.start + self.step*np.arange(self.points)
+
+def sweep_cost(chunks, dwell, restart, readout, overlap = True):
+
+    """ predicted time for a sweep run in chunks. each chunk takes restart
+        seconds to start and dwell per point to run, reading it back takes
+        readout[0] + readout[1]*points. with overlap the read happens while
+        the next chunk runs, only the last read adds to the total. """
+
+    read = lambda size: readout[0] + readout[1]*size
+    if not overlap:
+        return sum(restart + size*dwell + read(size) for size in chunks)
+    total = restart + chunks[0]*dwell
+    for size, following in zip(chunks, chunks[1:]):
+        total += max(read(size), restart + following*dwell)
+    return total + read(chunks[-1])
+
+def plan_sweep(start, stop, step, dwell = 0.0, restart = 0.0, readout = (0.0, 0.0),
+               limit = 1024, overlap = True):
+
+    """ Split a sweep into chunks of at most limit points (the 2182
+        buffer) that take the least time according to sweep_cost. The
+        candidates are near-equal chunks and, with overlap, chunks of one
+        size with a short one at the end. Ties go to fewer chunks.
+        Returns a SweepPlan, step takes the sign of stop - start. """
+
+    points = sweep_points(start, stop, step)
+    step = abs(step) if stop >= start else -abs(step)
+    runs = int(math.ceil(points/float(limit)))
+    size, extra = divmod(points, runs)
+    candidates = [[size+1 if i < extra else size for i in range(runs)]]
+    sizes = range(2, min(points, limit) + 1) if overlap else [] #more chunks only help with overlap
+    for size in sizes:
+        full, short = divmod(points, size)
+        if short != 1: #the 2182 buffer holds at least 2
+            candidates.append([size]*full + ([short] if short else []))
+    cost = lambda c: sweep_cost(c, dwell, restart, readout, overlap)
+    best = min(candidates, key = lambda c: (cost(c), len(c)))
+    return SweepPlan(start, step, best, cost(best))
+
+def format_duration(seconds):
+
+    """ seconds as h:mm:ss """
+
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{0:d}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+
+class ETA(object):
+
+    """ Keeps track of how long the steps of a run take and says when it
+        will be done. Until the first step is done the predicted step time
+        is used. Should look something like this...
+
+        eta = ETA(len(gates), step_time)
+        for gate in gates:
+            ...
+            eta.step() #prints '3/41 done, 0:01:15 left, done at 14:02' """
+
+    def __init__(self, steps, step_time = 0.0):
+        self.steps = steps
+        self.step_time = step_time
+        self.done = 0
+        self.start_time = time.time()
+
+    def mean_step(self):
+
+        """ measured time per step, the prediction before there is one """
+
+        if not self.done:
+            return self.step_time
+        return (time.time() - self.start_time)/self.done
+
+    def remaining(self):
+        return self.mean_step()*(self.steps - self.done)
+
+    def step(self, quiet = False):
+
+        """ call after every step """
+
+        self.done += 1
+        if not quiet:
+            left = self.remaining()
+            print '{0}/{1} done, {2} left, done at {3}'.format(self.done, self.steps, format_duration(left),
+                                                               time.strftime('%H:%M', time.localtime(time.time() + left)))
@@ -0,0 +1,297 @@
+""" Live plots in a process of their own, so drawing never competes with the
+    measurement for the interpreter. The viewer reads what the experiment
+    writes: a datafile.Map is memory-mapped and a DataFile is read from the
+    page cache, so both processes share the same memory without copies
+    through a pipe. The Map journal (or the DataFile size) is the sequence
+    counter that says what is new. Only the lines are redrawn each frame
+    (blitting), the axes only when their limits have to change.
+
+    python -m exptools.liveplot iv-DAQgate.map             -- the newest IV curve
+    python -m exptools.liveplot iv-DAQgate.map --view map  -- the whole map as an image
+    python -m exptools.liveplot fixBias_swpGate.npy        -- column 1 against column 0
+
+    A viewer can be started and closed at any time during a run without
+    the experiment noticing. The run() methods of the experiments launch
+    one with launch(). The room temperature tests end the run when their
+    plot is closed, with when_closed(). """
+
+from __future__ import absolute_import
+import os, sys, time, argparse, subprocess, threading
+import numpy as np
+import matplotlib.pyplot as plt
+import exptools.datafile as datafile
+from exptools.decimate import minmax, Pyramid
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) #for the viewer's imports
+
+def launch(path, view = None, **options):
+
+    """ start a viewer process for path and return it (a subprocess.Popen).
+        options are the command line options without the dashes, xlabel =
+        'bias' for --xlabel bias. """
+
+    command = [sys.executable, '-m', 'exptools.liveplot', path]
+    if view is not None:
+        command += ['--view', view]
+    for key, value in sorted(options.items()):
+        command += ['--'+key, str(value)]
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([root] + filter(None, [os.environ.get('PYTHONPATH')])))
+    return subprocess.Popen(command, env = env)
+
+class Watch(object):
+
+    """ calls action() from a thread of its own when the viewer process
+        exits, unless cancel() came first. the thread only waits on the
+        process, it takes nothing from the measurement. """
+
+    def __init__(self, viewer, action):
+        self.viewer = viewer
+        self.action = action
+        self.cancelled = False
+        thread = threading.Thread(target = self.watch, name = 'liveplot watch')
+        thread.daemon = True
+        thread.start()
+
+    def watch(self):
+        self.viewer.wait()
+        if not self.cancelled:
+            self.action()
+
+    def cancel(self):
+
+        """ the run is over, closing the viewer does nothing from now on """
+
+        self.cancelled = True
+
+def when_closed(viewer, action):
+
+    """ call action(), e.g. a Sweep's stop(), once the viewer (from
+        launch()) is closed. returns the Watch. """
+
+    return Watch(viewer, action)
+
+class MapSource(object):
+
+    """ the rows of a datafile.Map written since the last poll() """
+
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        self.seen = 0
+
+    def poll(self):
+        if self.map is None:
+            if not os.path.exists(os.path.join(self.path, 'axes.json')): #written last by Map.create
+                return []
+            self.map = datafile.Map(self.path)
+        rows, self.seen = self.map.since(self.seen)
+        return rows
+
+class RowSource(object):
+
+    """ the rows of a DataFile written since the last poll() """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def poll(self):
+        if self.file is None:
+            if not os.path.exists(self.path) or os.path.getsize(self.path) < datafile.header_size:
+                return np.zeros((0, 0))
+            self.file = open(self.path, 'rb')
+            self.columns, self.offset = datafile.read_header(self.file)
+        rows = (os.fstat(self.file.fileno()).st_size - self.offset)//(8*self.columns)
+        if not rows:
+            return np.zeros((0, self.columns))
+        self.file.seek(self.offset)
+        data = np.fromfile(self.file, dtype = '<f8', count = rows*self.columns).reshape(rows, self.columns)
+        self.offset += 8*rows*self.columns
+        return data
+
+class Viewer(object):
+
+    """ one axes whose artists are blitted. the background (axes, ticks,
+        labels) is only drawn again when fit() changes the limits or the
+        window changes. """
+
+    def __init__(self, title = '', xlabel = '', ylabel = ''):
+        self.fig = plt.figure()
+        self.ax = self.fig.add_subplot(111)
+        self.ax.set_title(title)
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+        self.artists = []
+        self.limits = None
+        self.background = None
+        self.label = self.add(self.ax.text(0.02, 0.95, '', transform = self.ax.transAxes))
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+        plt.show(block = False)
+
+    def add(self, artist):
+        artist.set_animated(True) #left out of full draws, see blit
+        self.artists.append(artist)
+        return artist
+
+    def is_open(self):
+        return plt.fignum_exists(self.fig.number)
+
+    def fit(self, x, y, shrink = False):
+
+        """ make room for the points x, y. the limits only grow unless
+            shrink is true. """
+
+        x, y = np.asarray(x), np.asarray(y)
+        x, y = x[np.isfinite(x)], y[np.isfinite(y)]
+        if not len(x) or not len(y):
+            return
+        limits = [np.amin(x), np.amax(x), np.amin(y), np.amax(y)]
+        if self.limits is not None and not shrink:
+            limits = [min(limits[0], self.limits[0]), max(limits[1], self.limits[1]),
+                      min(limits[2], self.limits[2]), max(limits[3], self.limits[3])]
+        if limits == self.limits:
+            return
+        self.limits = limits
+        xpad, ypad = 0.05*(limits[1] - limits[0]) or 1e-12, 0.05*(limits[3] - limits[2]) or 1e-12
+        self.ax.set_xlim(limits[0] - xpad, limits[1] + xpad)
+        self.ax.set_ylim(limits[2] - ypad, limits[3] + ypad)
+        self.background = None
+
+    def on_draw(self, event):
+        self.background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+        self.fig.canvas.blit(self.ax.bbox)
+
+    def update(self):
+
+        """ show the artists as they are now """
+
+        if self.background is None:
+            self.fig.canvas.draw() #calls on_draw
+        else:
+            self.fig.canvas.restore_region(self.background)
+            self.draw_artists()
+
+    def wait(self, seconds):
+
+        """ handle window events for seconds """
+
+        self.fig.canvas.flush_events()
+        time.sleep(seconds)
+
+def show_curve(path, interval = 0.5, **labels):
+
+    """ the newest row of a datafile.Map against its last axis """
+
+    source = MapSource(path)
+    viewer = Viewer(**labels)
+    line = viewer.add(viewer.ax.plot([], [], 'r-')[0])
+    while viewer.is_open():
+        rows = source.poll()
+        if len(rows):
+            names = source.map.axes.keys()
+            x, y = source.map.axes[names[-1]], np.array(source.map.data[rows[-1]])
+            line.set_data(x, y)
+            viewer.label.set_text('{0} = {1:g}'.format(names[0], source.map.axes[names[0]][rows[-1][0]]))
+            viewer.fit(x, y, shrink = True)
+            viewer.update()
+        viewer.wait(interval)
+
+def show_points(path, interval = 0.5, points = 2000, **labels):
+
+    """ column 1 of a DataFile against column 0, cut down to about points
+        points by a decimate.Pyramid once there are more """
+
+    source = RowSource(path)
+    viewer = Viewer(**labels)
+    line = viewer.add(viewer.ax.plot([], [], 'r-o')[0])
+    pyramid = Pyramid()
+    while viewer.is_open():
+        rows = source.poll()
+        if len(rows):
+            pyramid.extend(rows[:,0], rows[:,1])
+            line.set_data(*pyramid.view(points))
+            line.set_marker('o' if len(pyramid) <= points else '') #markers on every pixel help no one
+            viewer.fit(rows[:,0], rows[:,1]) #the old points are already inside
+            viewer.update()
+        viewer.wait(interval)
+
+class MapImage(object):
+
+    """ the image of a map, outer axis against last axis (averaged over
+        any in between), preallocated and filled in one row at a time. a
+        map bigger than pixels along an axis is cut down to it by minmax. """
+
+    def __init__(self, shape, pixels = 1000):
+        self.shape = shape
+        self.column_buckets = pixels//2 if shape[-1] > pixels else None
+        self.row_buckets = pixels//2 if shape[0] > pixels else None
+        rows = 2*self.row_buckets if self.row_buckets else shape[0]
+        columns = 2*self.column_buckets if self.column_buckets else shape[-1]
+        self.image = np.full((rows, columns), np.nan)
+
+    def add(self, index, curves):
+
+        """ put in the curves (everything at outer index) and return the
+            new image row(s) """
+
+        row = np.nanmean(np.reshape(curves, (-1, self.shape[-1])), axis = 0)
+        if self.column_buckets:
+            row = minmax(row, self.column_buckets)
+        if not self.row_buckets:
+            self.image[index] = row
+            return self.image[index:index + 1]
+        b = 2*(index*self.row_buckets//self.shape[0])
+        self.image[b] = np.fmin(self.image[b], row)
+        self.image[b + 1] = np.fmax(self.image[b + 1], row)
+        return self.image[b:b + 2]
+
+def show_map(path, interval = 0.5, pixels = 1000, **labels):
+
+    """ a datafile.Map as an image, only the rows that are new are worked
+        on each frame """
+
+    source = MapSource(path)
+    viewer = Viewer(**labels)
+    image, limits = None, [np.inf, -np.inf]
+    while viewer.is_open():
+        rows = source.poll()
+        if len(rows) and image is None:
+            axes = source.map.axes.values()
+            image = MapImage(source.map.data.shape, pixels)
+            picture = viewer.add(viewer.ax.imshow(image.image, aspect = 'auto', origin = 'lower',
+                                                  interpolation = 'nearest',
+                                                  extent = [axes[-1][0], axes[-1][-1], axes[0][0], axes[0][-1]]))
+            viewer.fig.colorbar(picture, ax = viewer.ax) #imshow set the limits
+        for index in sorted(set(row[0] for row in rows)):
+            new = image.add(index, source.map.data[index])
+            if np.isfinite(new).any() and (np.nanmin(new) < limits[0] or np.nanmax(new) > limits[1]):
+                limits = [min(limits[0], np.nanmin(new)), max(limits[1], np.nanmax(new))]
+                picture.set_clim(*limits)
+                viewer.background = None #the colorbar changed
+        if len(rows):
+            picture.set_data(image.image)
+            viewer.label.set_text('{0} = {1:g}'.format(source.map.axes.keys()[0], axes[0][rows[-1][0]]))
+            viewer.update()
+        viewer.wait(interval)
+
+views = {'curve' : show_curve, 'points' : show_points, 'map' : show_map}
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = 'live plot of a running experiment')
+    parser.add_argument('path', help = 'a .map directory or a .npy DataFile')
+    parser.add_argument('--view', choices = sorted(views), help = 'curve for maps, points for DataFiles by default')
+    parser.add_argument('--interval', type = float, default = 0.5, help = 'seconds between looks at the data')
+    parser.add_argument('--title', default = '')
+    parser.add_argument('--xlabel', default = '')
+    parser.add_argument('--ylabel', default = '')
+    args = parser.parse_args(args)
+    view = args.view or ('curve' if args.path.rstrip('/\\').endswith('.map') else 'points')
+    views[view](args.path, args.interval, title = args.title, xlabel = args.xlabel, ylabel = args.ylabel)
+
+if __name__ == "__main__":
+    main()
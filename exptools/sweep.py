@@ -0,0 +1,291 @@
+""" The loop every experiment runs (set the outer variables, let them settle,
+    acquire, save, check for 'q'), written once. An experiment is a list of
+    outer axes and the acquisition made at every point of them...
+
+    import exptools.sweep as sweep
+
+    plan = sweep.Sweep([sweep.field(mag, fields, settle = 2.0),
+                        sweep.gate(daqGate, gates, gateAmp, settle = 1.0)],
+                       sweep.iv_curves(source, ivAvg, bias, cvAmp))
+    data = datafile.Map.create(filename+'.map', plan.map_axes())
+    plan.run(data, step_time = step)
+    data.close()
+
+    Outer axes: gate (DAQ output), field (IPS120), temperature (ITC503) and
+    bias (6220 current). Any other Axis is a name, its values and a function
+    that starts the change to a value. The first axis is the outermost, an
+    axis only changes when its value does.
+
+    Acquisitions: iv_curves (an IVmax1024/IVunlim sweep), point (one
+    FixedBias.get_meas) and daq_block (a finite DAQ analog input block).
+    Those with axes of their own (the curve and bias of an IV) go in a
+    datafile.Map, the others in a datafile.DataFile, one row per point.
+
+    The steps are pipelined. The change to the next point is started right
+    after the acquisition, so the field ramps and the gate settles while the
+    readout (for acquisitions that have one) and the save of the last point
+    happen. The save is done by a thread of its own, the next point only
+    waits for it if the one before is still being written. """
+
+from __future__ import absolute_import, division
+import time, itertools
+import numpy as np
+import exptools.exptools as tools
+import exptools.datafile as datafile
+from instruments import jobs, timing
+from instruments.backend import msvcrt
+
+class Axis(object):
+
+    """ an outer variable of a sweep.
+
+        set(value) starts the change and returns right away, whatever it
+        returns is handed to wait() (if given), which blocks until the
+        value is there. settle seconds are then waited, counted from the
+        set() if there is no wait(). snake = True sweeps every other pass
+        backwards, so the value never jumps back to the start. """
+
+    def __init__(self, name, values, set = None, wait = None, settle = 0.0, snake = False):
+        self.name = name
+        self.values = np.asarray(values, dtype = float)
+        self.set = set
+        self.wait = wait
+        self.settle = settle
+        self.snake = snake
+
+    def __len__(self):
+        return len(self.values)
+
+    def start(self, value):
+
+        """ start the change to value, returns what finish() needs """
+
+        handle = self.set(value) if self.set is not None else None
+        return handle, time.time()
+
+    def finish(self, started):
+
+        """ block until the change start() returned started is done, True
+            if it wasn't done yet """
+
+        handle, start_time = started
+        entered = time.time()
+        if self.wait is not None:
+            self.wait(handle)
+            start_time = time.time()
+        left = self.settle - (time.time() - start_time)
+        time.sleep(max(left, 0.0))
+        return left > 0.0 or time.time() - entered > 0.01
+
+def gate(task, values, gain = 9.1788, settle = 1.0, name = 'gate', **options):
+
+    """ a DAQ output (nidaqmx.AnalogOutputTask) through an amplifier of
+        gain. the values are the amplified voltages. """
+
+    return Axis(name, values, lambda value: task.write([value/gain]), settle = settle, **options)
+
+def field(magnet, values, settle = 2.0, name = 'field', **options):
+
+    """ the field of an oxford_magnet, settle seconds after arrival """
+
+    return Axis(name, values, magnet.ramp_to_field, lambda ramp: ramp.wait(), settle, **options)
+
+def temperature(itc, values, settle = 60.0, tolerance = 0.05, sensor = 1, name = 'temperature', **options):
+
+    """ the set point of an oxford_temp, settle seconds after sensor is
+        within tolerance of it """
+
+    def wait(value):
+        itc.wait_for_temp(value, tolerance, sensor)
+    def set(value):
+        itc.set_temp(value)
+        return value
+    return Axis(name, values, set, wait, settle, **options)
+
+def bias(source, values, cvResistor = 1.0, settle = 0.0, name = 'bias', **options):
+
+    """ the output of the 6220. the values are the bias, cvResistor times
+        the current. """
+
+    def set(value):
+        source.write(':sour:curr {0:.15f}'.format(value/cvResistor))
+    return Axis(name, values, set, settle = settle, **options)
+
+def repeat(runs, name = 'run'):
+
+    """ an axis that only counts, 1 to runs """
+
+    return Axis(name, range(1, runs + 1))
+
+class Acquisition(object):
+
+    """ what is measured at every point.
+
+        measure() is called once the outer axes are set and settled. if
+        there is a readout(), it gets what measure() returned and returns
+        the data, and it runs while the axes move to the next point. if
+        there is a prepare(), it is called right before the axes start
+        moving to a point. axes is [(name, values)] for the shape of the
+        data, empty for a row of values. """
+
+    def __init__(self, measure, readout = None, axes = (), prepare = None):
+        self.measure = measure
+        self.readout = readout
+        self.axes = list(axes)
+        self.prepare = prepare
+
+def iv_curves(source, ivAvg, bias, cvAmp = 1.0, timeout = 120.0, overlap = True):
+
+    """ ivAvg IV curves from an IVmax1024 (or IVunlim) that is already set
+        up and armed, times cvAmp. bias is the value of each point. with
+        overlap the buffer of the last curve is read while the axes move
+        (run_sweep, then read_sweep), otherwise before they do. """
+
+    def measure():
+        return source.run_sweep(ivAvg, timeout)
+    def readout(sweep):
+        return np.array(source.read_sweep(sweep), dtype = np.floating)*cvAmp
+    axes = [('curve', range(ivAvg)), ('bias', bias)]
+    if not overlap:
+        return Acquisition(lambda: readout(measure()), axes = axes)
+    return Acquisition(measure, readout, axes)
+
+def point(source, cvAmp = 1.0):
+
+    """ one FixedBias.get_meas, times cvAmp """
+
+    return Acquisition(lambda: [source.get_meas()*cvAmp])
+
+def daq_block(itask, sample_rate, cvAmp = 1.0, bias = None, start_early = False):
+
+    """ one block of a finite nidaqmx.AnalogInputTask: the mean times
+        cvAmp, bias over it if bias is given, then every sample. with
+        start_early the task is started before the axes move to the point,
+        so the block begins with the step instead of after the settle. """
+
+    def measure():
+        if not start_early:
+            itask.start()
+        samples = itask.read()
+        timing.add('integrating', len(samples)/sample_rate)
+        itask.wait_until_done()
+        itask.stop()
+        current = samples.mean()*cvAmp
+        return np.concatenate([[current], [bias/current] if bias is not None else [], np.ravel(samples)])
+    return Acquisition(measure, prepare = itask.start if start_early else None)
+
+class Sweep(object):
+
+    """ the outer axes (outermost first) and the acquisition, see the
+        module docstring. after run(), done is the number of points
+        measured, acquired the seconds spent in measure() and readout()
+        and saved the seconds of readout and save that were done while
+        the axes moved, which one point after the other would add. """
+
+    def __init__(self, axes, acquisition):
+        self.axes = list(axes)
+        self.acquisition = acquisition
+        self.done = 0
+        self.acquired = 0.0
+        self.saved = 0.0
+        self.stopped = False
+
+    def __len__(self):
+        return int(np.prod([len(axis) for axis in self.axes]))
+
+    def map_axes(self):
+
+        """ [(name, values)] for datafile.Map.create """
+
+        return [(axis.name, axis.values) for axis in self.axes] + self.acquisition.axes
+
+    def points(self):
+
+        """ [index] of every point in the order they are measured """
+
+        points = []
+        shape = [len(axis) for axis in self.axes]
+        for nominal in itertools.product(*[range(n) for n in shape]):
+            index = list(nominal)
+            for k, axis in enumerate(self.axes):
+                passes = int(np.ravel_multi_index(nominal[:k], shape[:k])) if k else 0 #of this axis so far
+                if axis.snake and passes % 2:
+                    index[k] = len(axis) - 1 - index[k]
+            points.append(tuple(index))
+        return points
+
+    def stop(self):
+
+        """ end the run after the point being measured, from any thread """
+
+        self.stopped = True
+
+    def _start(self, last, index):
+        if self.acquisition.prepare is not None:
+            self.acquisition.prepare()
+        return [(axis, axis.start(axis.values[i])) for k, (axis, i) in enumerate(zip(self.axes, index))
+                if last is None or last[k] != i]
+
+    def _save(self, store, index, data):
+        if isinstance(store, datafile.Map):
+            store.write(index, data)
+        else: #innermost axis, the data, the other axes going out
+            values = [axis.values[i] for axis, i in zip(self.axes, index)]
+            store.write(np.concatenate([values[-1:], np.ravel(data), values[-2::-1]]))
+
+    def run(self, store, step_time = 0.0, eta_every = 1):
+
+        """ measure every point and write it to store, a datafile.Map (from
+            map_axes()) or a DataFile. step_time is the predicted time per
+            point for the ETA, printed every eta_every points. ends early
+            with 'q' or stop(). """
+
+        points = self.points()
+        self.done, self.acquired, self.saved, self.stopped = 0, 0.0, 0.0, False
+        writer = jobs.Worker('sweep writer')
+        writing = None
+        try:
+            timing.set_phase('settle')
+            moving = self._start(None, points[0])
+            for axis, started in moving: #the first point isn't a step, keeps it out of the ETA
+                axis.finish(started)
+            moving, moved = [], 0.0
+            eta = tools.ETA(len(points), step_time)
+            for n, index in enumerate(points):
+                timing.set_phase('settle')
+                meanwhile = time.time() - moved #readout and save since the axes started
+                if any([axis.finish(started) for axis, started in moving]): #every axis finishes
+                    self.saved += meanwhile
+                elif moving: #done before we looked, it took at least the settle time
+                    self.saved += min(meanwhile, max(axis.settle for axis, started in moving))
+                timing.set_phase('acquire')
+                start_time = time.time()
+                data = self.acquisition.measure()
+                self.acquired += time.time() - start_time
+                if msvcrt.kbhit() and ord(msvcrt.getch()) == 113: #press 'q' to exit anytime
+                    print "Program ended by user.\n"
+                    self.stopped = True
+                if n + 1 < len(points) and not self.stopped:
+                    with timing.phase('settle'):
+                        moving = self._start(index, points[n + 1]) #moves during the readout and save
+                    moved = time.time()
+                if self.acquisition.readout is not None:
+                    timing.set_phase('readout')
+                    start_time = time.time()
+                    data = self.acquisition.readout(data)
+                    self.acquired += time.time() - start_time
+                timing.set_phase('save')
+                if writing is not None:
+                    writing.result() #one point in the writer at a time
+                writing = writer.submit(self._save, store, index, data)
+                self.done += 1
+                eta.step(quiet = self.done % eta_every != 0 and self.done != len(points))
+                if self.stopped:
+                    break
+            timing.set_phase('save')
+            if writing is not None:
+                writing.result()
+            if self.saved:
+                print 'readout and save while the axes moved: {0:.1f}s saved'.format(self.saved)
+        finally:
+            writer.stop()
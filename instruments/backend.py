@@ -0,0 +1,26 @@
+""" Picks the libraries that talk to the hardware. instruments.py and the
+    experiment modules import visa, nidaqmx and msvcrt from here instead of
+    importing them directly.
+
+    Set the environment variable MEASUREMENTS_BACKEND=sim to swap in the
+    simulated instruments from simulated.py. Anything else (or nothing)
+    uses PyVISA and pylibnidaqmx. """
+
+import os
+
+SIMULATED = os.environ.get('MEASUREMENTS_BACKEND', '').lower() == 'sim'
+
+if SIMULATED:
+    import simulated as visa
+    import simulated as nidaqmx
+else:
+    import visa
+    try:
+        import nidaqmx
+    except ImportError: # not every computer has a DAQ card
+        nidaqmx = None
+
+try:
+    import msvcrt
+except ImportError: # windows only, use the stand-in for the keyboard
+    import simulated as msvcrt
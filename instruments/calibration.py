@@ -0,0 +1,86 @@
+""" Settings that are measured on the instruments instead of guessed, kept
+    in a file so they are only measured once per instrument configuration.
+
+    The first one is where averaging in the 2182A buffer gets faster than
+    averaging single reads, see FixedBias.single_point_setup and
+    SinglePoint.single_point_setup. The experiments also keep the
+    overhead per reading they measured, for the next estimate(). Delete
+    the file, or pass recalibrate = True, after anything changes that the
+    keys don't cover (a new cable, a different baud rate...).
+
+    Set the environment variable MEASUREMENTS_CALIBRATION to keep the file
+    somewhere other than the home directory. """
+
+import os, json, time, threading
+from backend import SIMULATED
+
+calibration_file = os.environ.get('MEASUREMENTS_CALIBRATION',
+                                  os.path.join(os.path.expanduser('~'), '.measurements_calibration.json'))
+_lock = threading.Lock()
+
+def load():
+
+    """ everything in calibration_file as a dictionary """
+
+    try:
+        with open(calibration_file) as f:
+            return json.load(f)
+    except (IOError, ValueError): #no file yet, or a broken one
+        return {}
+
+def value(key, default = None):
+
+    """ the value stored under key, default if there is none. the
+        simulated instruments keep their own values. """
+
+    with _lock:
+        return load().get(('sim ' if SIMULATED else '') + key, default)
+
+def store(key, value):
+
+    """ store value under key, replacing the last one """
+
+    with _lock:
+        values = load()
+        values[('sim ' if SIMULATED else '') + key] = value
+        with open(calibration_file, 'w') as f:
+            json.dump(values, f, indent = 1, sort_keys = True)
+
+def lookup(key, measure, recalibrate = False):
+
+    """ the value stored under key, or measure() if there is none yet (or
+        recalibrate is true), which is then stored. """
+
+    stored = value(key)
+    if stored is not None and not recalibrate:
+        return stored
+    stored = measure()
+    store(key, stored)
+    return stored
+
+def avg_crossover(setup, get_meas, counts = (2, 16), repeat = 3):
+
+    """ time get_meas() after setup(avg, buffered) for each avg in counts,
+        with and without the buffer, and return the smallest avg for which
+        the buffer is faster. each path is taken to be a fixed time plus a
+        time per reading, fit to the first and last of counts. """
+
+    times = {}
+    for buffered in (False, True):
+        for avg in (counts[0], counts[-1]):
+            setup(avg, buffered)
+            get_meas() #the first one after setup waits for :init
+            start_time = time.time()
+            for _ in range(repeat):
+                get_meas()
+            times[buffered, avg] = (time.time() - start_time)/repeat
+    span = counts[-1] - counts[0]
+    fixed, per_reading = {}, {}
+    for buffered in (False, True):
+        per_reading[buffered] = (times[buffered, counts[-1]] - times[buffered, counts[0]])/span
+        fixed[buffered] = times[buffered, counts[0]] - counts[0]*per_reading[buffered]
+    if fixed[True] <= fixed[False]:
+        return 1
+    if per_reading[True] >= per_reading[False]:
+        return 1025 #never, the buffer only holds 1024
+    return int((fixed[True] - fixed[False])/(per_reading[False] - per_reading[True])) + 1
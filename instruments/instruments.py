@@ -21,8 +21,10 @@
                      this is necessary to handle the strange read/write requirements
                      of that instrument. """
 
-import visa
-import time, math
+from backend import visa
+import time, math, itertools
+import numpy as np
+from contextlib import contextmanager
 
 class K6220_2182A(visa.GpibInstrument):
 
@@ -30,26 +32,138 @@ class K6220_2182A(visa.GpibInstrument):
     the visa.GpibInstrument class and adds some additional fucntionality for the
     serial port connection. """
 
+    data_format = 'asc' #how the 2182A sends its buffer, see voltmeter_format_setup
+    byte_order = 'swap'
+    serial_chunk = 256 #bytes returned by one :syst:comm:ser:ent?
+    serial_queries = 8 #most :syst:comm:ser:ent? queries sent in one message
+    serial_timeout = 2.0 #seconds to wait for the 2182A to answer
+    serial_poll = 0.005 #seconds between :syst:comm:ser:ent? that came back empty
+    serial_baud = 19200 #RS-232 rate between the 6220 and the 2182A
+    serial_sent = 0.0 #when the last message passed on will have reached the 2182A
+    armed = False #2182A initiated with an infinite trigger count, see track_armed
+    gpib_buffer = 512 #longest message sent to the 6220 in one batch
+    serial_buffer = 200 #longest message sent on to the 2182A in one batch
+    _batch = None
+    line_frequency = 60.0
+    nplc = 1.0 #the rest are remembered by the setup functions to predict timing
+    filter_count = 1
+    sweep_points = 0
+    source_delay = 0.0
+    _shadow = {} #settings written to each 6220/2182A pair since the last reset, by address
+
+    def __init__(self, gpib_identifier, **keyw):
+        super(K6220_2182A, self).__init__(gpib_identifier, **keyw)
+        self.read_log = [] #(points, bytes, round trips, seconds) for every buffer read
+
     def nanovoltmeter_check(self):
         if int(self.ask(":sour:dcon:nvpr?")):
             print "2182A connected"
         else:
             raise RuntimeError('nanovoltmeter not found')
 
-    def write_serial(self,message):
+    def healthy(self):
+
+        """ quick check used by the session pool: the 6220 answers and still
+            sees the 2182A """
+
+        return bool(int(self.ask(":sour:dcon:nvpr?")))
+
+    def write(self, message):
+
+        """ write to the 6220. inside batch() commands are queued instead,
+            queries flush the queue and go out right away. """
+
+        if '?' not in message:
+            self.invalidate(message, 'gpib')
+        if self._batch is not None and '?' not in message:
+            self._batch.append(('gpib', message))
+        else:
+            self.flush_batch()
+            self._write(message)
+
+    def _write(self, message):
+
+        # nothing is known about the settings after a failed transfer
+        try:
+            super(K6220_2182A, self).write(message)
+        except visa.VisaIOError:
+            self.invalidate()
+            raise
+
+    def write_serial(self, message, sync = True):
 
         """Sends a message to Keithley current source that is passed to
-           voltmeter through a serial connection """
+           voltmeter through a serial connection. Inside batch() the message
+           is queued instead. Otherwise wait for the 2182A to finish with it
+           (*OPC?) so the next message can't overrun its input buffer.
+           sync = False skips the *OPC?, needed while a reply is still
+           coming in from the 2182A. It is skipped anyway while the 2182A
+           is armed (see track_armed), it would never come back. """
+
+        if '?' not in message:
+            self.invalidate(message, 'serial')
+        if self._batch is not None and '?' not in message:
+            self._batch.append(('serial', message))
+        else:
+            self.flush_batch()
+            self._send_serial(message, sync = sync and '?' not in message)
+
+    def _send_serial(self, message, sync = True):
+
+        # *OPC? does not return while an :init is running with an infinite
+        # trigger count, messages go out without it while armed
+        self.track_armed(message)
+        sync = sync and not self.armed
+        sent = len(message) + 1 + (len(';*OPC?') if sync else 0)
+        self.serial_sent = max(time.time(), self.serial_sent) + sent*10.0/self.serial_baud
+        if sync:
+            self._write(":SYST:COMM:SER:SEND \"{};*OPC?\"".format(message))
+            self.read_serial()
+        else:
+            self._write(":SYST:COMM:SER:SEND \"{}\"".format(message))
 
-        self.write(":SYST:COMM:SER:SEND \"{}\"".format(message))
-        time.sleep(0.1)
+    def track_armed(self, message):
 
-    def read_serial(self):
+        """ follow whether the 2182A is initiated with an infinite trigger
+            count: :init sets it, *RST and :abor clear it. a trigger count
+            the shadow state doesn't know counts as infinite. """
 
-        """Reads data from 2182A through 6220"""
+        for header in scpi_headers(message):
+            if header == '*rst' or header.startswith('abor'):
+                self.armed = False
+            elif header in ('init', 'init:imm'):
+                count = self.shadow_state('serial').get('trig:coun', 'inf')
+                self.armed = count.lower().startswith('inf')
+
+    def read_serial(self):
 
-        self.write(":SYST:COMM:SER:ENT?")
-        return self.read()
+        """Reads data from 2182A through 6220. Waits up to serial_timeout
+           for the 2182A to answer, then drains the serial link and raises
+           RuntimeError. A late answer left in the 6220 would otherwise be
+           taken as the reply to the next query (or *OPC?)."""
+
+        start_time = time.time()
+        while True:
+            self.write(":SYST:COMM:SER:ENT?")
+            data = self.read()
+            if data:
+                return data
+            if (time.time() - start_time) > self.serial_timeout:
+                self.invalidate(port = 'serial') #lost track of the 2182A
+                self.drain_serial()
+                raise RuntimeError('2182A did not answer in {:.1f}s'.format(self.serial_timeout))
+            time.sleep(self.serial_poll)
+
+    def drain_serial(self):
+
+        """ throw away everything the 2182A sends through the 6220 for the
+            next serial_timeout seconds """
+
+        start_time = time.time()
+        while (time.time() - start_time) < self.serial_timeout:
+            self.write(":SYST:COMM:SER:ENT?")
+            if not self.read():
+                time.sleep(self.serial_poll)
 
     def ask_serial(self,message):
 
@@ -57,8 +171,161 @@ class K6220_2182A(visa.GpibInstrument):
            specific to Keithley current source and voltmeter"""
 
         self.write_serial(message)
-        self.write(":SYST:COMM:SER:ENT?")
-        return self.read()
+        return self.read_serial()
+
+    @contextmanager
+    def batch(self):
+
+        """ send every write() and write_serial() inside the block as a few
+            ';' joined messages, each no longer than gpib_buffer (6220) or
+            serial_buffer (2182A), then wait for both instruments to finish
+            with *OPC?. the commands go out in the order they were given,
+            only the ones in a row for the same instrument are joined.
+            queries inside the block flush what is queued so far.
+
+            with source.batch():
+                source.voltmeter_channel_setup(nplc, vRange)
+                source.voltmeter_trig_setup() """
+
+        if self._batch is not None: #already inside a batch
+            yield
+            return
+        self._batch = []
+        try:
+            yield
+            self.flush_batch()
+        except:
+            self.forget_batch(self._batch) #never sent, the shadow can't keep them
+            raise
+        finally:
+            self._batch = None
+
+    def flush_batch(self):
+
+        """ send everything queued by batch() """
+
+        if not self._batch:
+            return
+        queued, self._batch = self._batch, []
+        try:
+            for port, run in itertools.groupby(queued, lambda item: item[0]):
+                commands = [message for port, message in run]
+                if port == 'gpib':
+                    for message in join_commands(commands, self.gpib_buffer):
+                        self._write(message)
+                    self.ask('*OPC?')
+                else:
+                    for message in join_commands(commands, self.serial_buffer - len(';*OPC?')):
+                        self._send_serial(message)
+        except:
+            self.forget_batch(queued) #some of them may not have made it
+            raise
+
+    def forget_batch(self, queued):
+
+        """ invalidate() every (port, message) queued by batch() """
+
+        for port, message in queued:
+            self.invalidate(message, port)
+
+    def reset_pair(self):
+
+        """ abort, reset and clear the 6220 and the 2182A:
+
+            ':sour:swe:abor' -- abort previous sweep
+            '*RST;*CLS' -- reset and clear 6220
+            '*RST;*CLS;:abor' -- reset, clear, abort previous 2182
+
+            if the shadow state is still good from the last reset by the same
+            class, only the aborts and *CLS go out. the setup functions then
+            only send the settings that changed. """
+
+        if self.shadow_valid():
+            with self.batch():
+                self.write(':sour:swe:abor')
+                self.write('*CLS')
+                self.write_serial('*CLS;:abor')
+            serial = self.shadow_state('serial')
+            self.data_format = serial.get('form:data', 'asc')[:3].lower()
+            self.byte_order = serial.get('form:bord', 'swap')[:4].lower()
+            return
+        with self.batch():
+            self.write(':sour:swe:abor')
+            self.write('*RST;*CLS')
+        self.nanovoltmeter_check()
+        with self.batch():
+            self.write_serial('*RST;*CLS;:abor')
+        self.data_format = 'asc' #*RST sets the 2182A back to ascii
+        self.shadow_reset()
+
+    def configure(self, header, value):
+
+        """ write 'header value' to the 6220 unless the shadow copy says it
+            is already set that way. value is the string that would be sent,
+            so pass it formatted. """
+
+        self._configure(header, value, 'gpib', self.write)
+
+    def configure_serial(self, header, value):
+
+        """ configure() for the 2182A """
+
+        self._configure(header, value, 'serial', self.write_serial)
+
+    def _configure(self, header, value, port, write):
+        key = scpi_key(header)
+        if self.shadow_state(port).get(key) != value:
+            write('{0} {1}'.format(header, value))
+            self.shadow_state(port)[key] = value
+
+    def shadow_state(self, port = None):
+
+        """ the settings written to this 6220 ('gpib') or its 2182A ('serial')
+            since general_setup last reset them. kept by address, so a new
+            object for the same instruments picks up where the last one
+            left off. """
+
+        state = self._shadow.setdefault(self.resource_name,
+                                        {'owner' : None, 'gpib' : {}, 'serial' : {}})
+        return state if port is None else state[port]
+
+    def shadow_valid(self):
+
+        """ true if the instruments were reset by general_setup of this class
+            and nothing has been lost track of since """
+
+        return self.shadow_state()['owner'] == type(self).__name__
+
+    def shadow_reset(self):
+
+        """ call after both instruments have been reset """
+
+        self._shadow[self.resource_name] = {'owner' : type(self).__name__,
+                                            'gpib' : {}, 'serial' : {}}
+
+    def invalidate(self, message = None, port = None):
+
+        """ forget the settings a message could have changed. with no
+            message, forget everything so the next general_setup resets.
+            switching ...:auto on or off changes the value it is the auto
+            of (rang:auto and rang), so that one is forgotten too. """
+
+        if message is None:
+            if port is None:
+                self._shadow.pop(self.resource_name, None)
+            else:
+                self.shadow_state()['owner'] = None
+                self.shadow_state(port).clear()
+            return
+        state = self.shadow_state(port)
+        for header in scpi_headers(message):
+            if header == '*rst':
+                self.shadow_state()['owner'] = None
+                state.clear()
+            coupled = header[:-len(':auto')] if header.endswith(':auto') else None
+            for key in state.keys():
+                if key in (header, coupled) or key.startswith(header + ':'):
+                    del state[key]
 
     def test_command(self, instrument, command, compare):
 
@@ -134,25 +401,151 @@ class K6220_2182A(visa.GpibInstrument):
             
             if you are sweeping over a large range, the digital filtering
             is very likely to ruin your day."""
-        if vRange == 'auto':
-            self.write_serial(':sens1:volt:rang:auto 1')
-        else:
-            self.write_serial(':sens1:volt:rang:auto 0')
-            self.write_serial(':sens1:volt:rang {}'.format(vRange))
-            self.write_serial(':sens1:volt:lpas {0:d}'.format(lp_filter))
-        self.write_serial(':sens1:volt:nplc {}'.format(nplc))
-        if digital_filter:
-            self.write_serial(":sens1:volt:dfil {0:d}".format(digital_filter))
-            self.write_serial(":sens1:volt:dfil:tcon {0}; coun {1:d}; wind {2:.2f}"
-                                         .format(filter_type, int(filter_count), filter_window))
-        else:
-            self.write_serial(":sens1:volt:dfil {0:d}".format(digital_filter))
-        time.sleep(0.25)
+        self.nplc = nplc
+        self.filter_count = int(filter_count) if digital_filter else 1
+        with self.batch():
+            if vRange == 'auto':
+                self.configure_serial(':sens1:volt:rang:auto', '1')
+            else:
+                self.configure_serial(':sens1:volt:rang:auto', '0')
+                self.configure_serial(':sens1:volt:rang', '{}'.format(vRange))
+                self.configure_serial(':sens1:volt:lpas', '{0:d}'.format(lp_filter))
+            self.configure_serial(':sens1:volt:nplc', '{}'.format(nplc))
+            if digital_filter:
+                self.configure_serial(":sens1:volt:dfil", "{0:d}".format(digital_filter))
+                self.configure_serial(":sens1:volt:dfil:tcon", filter_type)
+                self.configure_serial(":sens1:volt:dfil:coun", "{0:d}".format(int(filter_count)))
+                self.configure_serial(":sens1:volt:dfil:wind", "{0:.2f}".format(filter_window))
+            else:
+                self.configure_serial(":sens1:volt:dfil", "{0:d}".format(digital_filter))
+
+    def voltmeter_format_setup(self, data_format = 'sreal', byte_order = 'swap'):
+
+        """ choose how the 2182A sends the contents of its buffer:
+
+            ':form:data {}' -- ascii (16 bytes/point), sreal (4 byte float) or
+                               dreal (8 byte float)
+            ':form:bord {}' -- norm (big endian) or swap (little endian) for
+                               the binary formats
+
+            the binary formats cut the number of bytes that have to go through
+            the slow serial link and skip the string parsing. *RST puts the
+            2182A back to ascii, so call this after general_setup. """
+
+        with self.batch():
+            self.configure_serial(':form:data', data_format)
+            self.configure_serial(':form:bord', byte_order)
+        self.data_format = data_format[:3].lower()
+        self.byte_order = byte_order[:4].lower()
+
+    def read_serial_bulk(self, size, complete, binary = False, exact = False):
+
+        """ read one long response from the 2182A through the 6220 with as few
+            GPIB round trips as possible. each message carries enough
+            ':syst:comm:ser:ent?' queries (up to serial_queries) to cover the
+            bytes still expected, and the replies come back joined by ';'.
+            with exact = True size is the length of the whole response, which
+            is how binary replies are split (see split_chunks).
+
+            reading stops when complete(data) is true, a short chunk only
+            means the 6220 had nothing more at the time. raises RuntimeError
+            if a round trip brings nothing. returns the data and the number of
+            round trips. """
+
+        data, trips = '', 0
+        while True:
+            remaining = max(size - len(data), 1)
+            queries = min(self.serial_queries, int(math.ceil(remaining/float(self.serial_chunk))))
+            self.write(';'.join([':syst:comm:ser:ent?']*queries))
+            chunks = split_chunks(self.read_raw()[:-1], queries, self.serial_chunk, binary,
+                                  block = size - len(data) if exact else None)
+            received = ''.join(chunks)
+            data += received
+            trips += 1
+            if complete(data):
+                return data, trips
+            if not received:
+                raise RuntimeError('2182A reply ended after {0} of {1} bytes'.format(len(data), size))
+
+    def integration_time(self):
+
+        """ time the 2182A spends integrating for one reading """
+
+        return self.nplc/self.line_frequency*self.filter_count
+
+    def reading_time(self):
+
+        """ predicted time for one 2182A reading with the current settings """
+
+        return self.integration_time() + 0.003
+
+    def readout_cost(self):
+
+        """ (seconds per buffer read, seconds per point) for reading the 2182A
+            buffer with the current data format. fit to the recent reads in
+            read_log, estimated from serial_baud until there are reads of two
+            different lengths. """
+
+        width = {'asc' : 16, 'sre' : 4, 'dre' : 8}[self.data_format]
+        log = [(points, seconds) for points, size, trips, seconds in self.read_log[-20:]]
+        if len(set(points for points, seconds in log)) > 1:
+            per_point, per_read = np.polyfit(*zip(*log), deg = 1)
+            return max(per_read, 0.0), max(per_point, 0.0)
+        per_point = width*10.0/self.serial_baud
+        per_read = max([seconds - points*per_point for points, seconds in log] + [0.0])
+        return per_read, per_point
+
+    def predict_sweep_time(self):
+
+        """ predicted length of the sweep set up by source_sweep_setup """
+
+        return self.sweep_points*(self.source_delay + self.reading_time())
+
+    def wait_for_buffer(self, timeout = 10.0, predicted = 0.0):
+
+        """ wait until the 2182A reports a full buffer (B9 of the measurement
+            event register). the 2182A's SRQ doesn't make it through the
+            serial port, so this sleeps through the predicted fill time and
+            then polls at a limited rate. """
+
+        wait_for(lambda: self.voltmeter_chk_meas_evnt_reg()[9], timeout, predicted)
+
+    def enable_sweep_srq(self):
+
+        """ assert SRQ when a sweep is done or aborted:
+
+            ':stat:oper:enab 6' -- sweep done (B1) and aborted (B2) bits
+            '*SRE 128' -- operation summary bit of the status byte """
+
+        with self.batch():
+            self.configure(':stat:oper:enab', '6')
+            self.configure('*SRE', '128')
+
+    def wait_for_sweep(self, timeout = 75.0, srq = True):
+
+        """ wait for a sweep started with 'syst:key 13' to finish and return
+            the [sweep done, sweep aborted, sweeping] bits of the operation
+            event register.
+
+            with srq = True this blocks on the SRQ set up by enable_sweep_srq,
+            which leaves the bus free for the other instruments. otherwise
+            it sleeps through the predicted sweep time and polls. """
+
+        state = [0, 0, 0]
+        def check():
+            state[:] = self.source_chk_op_evnt_reg()[1:4]
+            return state[0] or state[1]
+        try:
+            wait_for(check, timeout, self.predict_sweep_time(), srq = self if srq else None)
+        except RuntimeError:
+            pass #the caller decides what a timeout means
+        return state
 
     def read_2182A_buffer(self, ignore = False):
 
         """ reads the voltmeter buffer after checking that it is not empty
-            returns a list of strings as read from the voltmeter """
+            returns a numpy array of the values in the buffer. the time it
+            took is appended to self.read_log. """
 
         if self.voltmeter_chk_meas_evnt_reg()[9] or ignore:
             pass
@@ -160,20 +553,262 @@ class K6220_2182A(visa.GpibInstrument):
             filled = self.ask_serial(':trac:free?').split(',')[1]
             raise RuntimeError('buffer not full. points = {}'.format(float(filled)/18))
         buffer_points = int(self.ask_serial(":trac:points?"))
-        loop_num = int(math.ceil(buffer_points*16.0/256.0))
+        return self.collect_2182A_buffer(self.request_2182A_buffer(buffer_points))
+
+    def request_2182A_buffer(self, buffer_points, exact = True):
+
+        """ ask for the contents of the 2182A buffer without waiting for them.
+            the 2182A puts the whole reply together as soon as it reads the
+            query, so the buffer can be cleared and filled again while the
+            reply is still on its way. nothing that waits for an answer from
+            the 2182A can be sent until collect_2182A_buffer is done with it.
+
+            with exact = False the buffer is still filling and buffer_points
+            is only the least that will come back.
+
+            returns what collect_2182A_buffer needs to read the reply """
+
         self.write_serial(":trac:data?")
-        data = ''.join([self.ask(":syst:comm:ser:ent?") for _ in range(loop_num)])
-        return data.split(',')
+        return buffer_points, exact, time.time()
+
+    def collect_2182A_buffer(self, request):
+
+        """ read the reply to request_2182A_buffer, returns a numpy array """
+
+        buffer_points, exact, start_time = request
+        if self.data_format == 'asc':
+            size = 16*buffer_points #15 characters and a comma per point
+            data, trips = self.read_serial_bulk(size, lambda d: d.endswith('\n'))
+            values = np.array(data.strip().split(','), dtype = np.float64)
+        else:
+            width = 4 if self.data_format == 'sre' else 8
+            size = buffer_points*width + 3 #'#0' and LF
+            if exact:
+                data, trips = self.read_serial_bulk(size, lambda d: len(d) >= size,
+                                                    binary = True, exact = True)
+            else: #ends with the LF after the last whole value
+                ended = lambda d: len(d) >= size and d.endswith('\n') and (len(d) - 3) % width == 0
+                data, trips = self.read_serial_bulk(size, ended, binary = True)
+                buffer_points = (len(data) - 3)//width
+            values = decode_binary(data, buffer_points, self.data_format, self.byte_order)
+        self.read_log.append((len(values), len(data), trips, time.time() - start_time))
+        return values
 
 #    def fixed_bias(self, bias):
 #
 #        """ sets the 6220 to output a fixed bias """
 
+def wait_for(check, timeout, predicted = 0.0, interval = 0.05, srq = None):
+
+    """ wait until check() returns something true instead of hammering the
+        bus with queries.
+
+        if srq is an instrument that will assert a service request, block on
+        that first. otherwise sleep through most of the predicted time. after
+        that check() is polled no more than once every interval seconds.
+        raises RuntimeError after timeout seconds. """
+
+    start_time = time.time()
+    if srq is not None:
+        try:
+            srq.wait_for_srq(timeout)
+        except (visa.VisaIOError, AttributeError): #no SRQ, fall back to polling
+            pass
+    elif predicted > 0.0:
+        time.sleep(min(0.95*predicted, timeout))
+    while not check():
+        if (time.time() - start_time) > timeout:
+            raise RuntimeError('timed out after {:.1f}s'.format(timeout))
+        time.sleep(interval)
+
+def scpi_key(header):
+
+    """ lower case header without the leading ':', used to look it up in the
+        shadow state """
+
+    return header.strip().lstrip(':').lower()
+
+def scpi_headers(message):
+
+    """ absolute headers of every command in a ';' joined message. a header
+        without a leading ':' after the first command is relative to the
+        path of the one before it, as the instruments read it. """
+
+    headers, path = [], []
+    for i, command in enumerate(message.split(';')):
+        command = command.strip()
+        if not command:
+            continue
+        header = command.split()[0]
+        if header.startswith('*'):
+            headers.append(header.lower())
+            continue
+        nodes = scpi_key(header).split(':')
+        if i and not header.startswith(':'):
+            nodes = path + nodes
+        path = nodes[:-1]
+        headers.append(':'.join(nodes))
+    return headers
+
+def join_commands(commands, limit):
+
+    """ join SCPI commands with ';' into as few messages as possible with
+        none longer than limit. every command is made absolute (leading ':')
+        so it does not pick up the path of the one before it. """
+
+    messages, current = [], ''
+    for command in commands:
+        command = command.strip()
+        if not command.startswith((':', '*')):
+            command = ':' + command
+        if current and len(current) + len(command) + 1 > limit:
+            messages.append(current)
+            current = command
+        else:
+            current = current + ';' + command if current else command
+    if current:
+        messages.append(current)
+    return messages
+
+def split_chunks(data, queries, chunk, binary = False, block = None):
+
+    """ split the reply to several ':syst:comm:ser:ent?' queries sent in one
+        message. ascii data never contains ';' so it is split on that. binary
+        data can, so it is cut by length: chunks are full until the block
+        (the bytes of the binary block still to come, if known) is in, and
+        the queries after that come back empty. a chunk that is cut short
+        anyway ends at the next ';'. """
+
+    if not binary:
+        return data.split(';')
+    chunks = []
+    for _ in range(queries-1):
+        size = chunk if block is None else max(min(chunk, block), 0)
+        if len(data) <= size or data[size] != ';': #short chunk
+            size = data.find(';')
+            if size < 0:
+                break
+        chunks.append(data[:size])
+        data = data[size+1:]
+        if block is not None:
+            block -= size
+    chunks.append(data)
+    return chunks
+
+def decode_binary(data, points, data_format = 'sre', byte_order = 'swap'):
+
+    """ turn a binary block from the 2182A ('#0' followed by 4 or 8 byte
+        floats) into a numpy array of length points """
+
+    start = data.find('#0')
+    if start < 0:
+        raise RuntimeError('no binary block in voltmeter data')
+    dtype = np.dtype('f4' if data_format == 'sre' else 'f8')
+    dtype = dtype.newbyteorder('>' if byte_order == 'norm' else '<')
+    block = data[start+2:start+2+points*dtype.itemsize]
+    if len(block) != points*dtype.itemsize:
+        raise RuntimeError('binary block too short: {0} of {1} bytes'
+                           .format(len(block), points*dtype.itemsize))
+    return np.frombuffer(block, dtype = dtype).astype(np.float64)
+
 class K2182(visa.GpibInstrument):
 
     """ This class handles the input/output from the Keithley 2182(A) nanovoltmeter
         when it is connected directly through GPIB """
 
+    line_frequency = 60.0
+    nplc = 1.0
+    channel_settings = '' #as set by channel_setup, for calibration keys
+    _shadow = {} #settings written to each 2182A since the last reset, by address
+
+    def integration_time(self):
+
+        """ time spent integrating for one reading """
+
+        return self.nplc/self.line_frequency
+
+    def healthy(self):
+
+        """ quick check used by the session pool. *OPC? would not come
+            back while a run with an infinite trigger count is going. """
+
+        return int(self.ask('*STB?')) >= 0
+
+    def write(self, message):
+
+        # nothing is known about the settings after a failed transfer
+        if '?' not in message:
+            self.invalidate(message)
+        try:
+            super(K2182, self).write(message)
+        except visa.VisaIOError:
+            self.invalidate()
+            raise
+
+    def reset_voltmeter(self):
+
+        """ abort, reset and clear the 2182A, then wait for it (*OPC?):
+
+            '*RST;*CLS;:abor' -- reset, clear, abort
+
+            if the shadow state is still good from the last reset by the same
+            class, only *CLS and the abort go out, see K6220_2182A.reset_pair """
+
+        if self.shadow_valid():
+            self.write('*CLS;:abor')
+        else:
+            self.write('*RST;*CLS;:abor')
+            self.shadow_reset()
+        self.ask('*OPC?')
+
+    def configure(self, header, value):
+
+        """ write 'header value' unless the shadow copy says it is already
+            set that way. value is the string that would be sent. """
+
+        key = scpi_key(header)
+        if self.shadow_state().get(key) != value:
+            self.write('{0} {1}'.format(header, value))
+            self.shadow_state()[key] = value
+
+    def shadow_state(self):
+
+        """ the settings written to this 2182A since reset_voltmeter, kept
+            by address like K6220_2182A.shadow_state """
+
+        return self._shadow.setdefault(self.resource_name, {'owner' : None, 'settings' : {}})['settings']
+
+    def shadow_valid(self):
+
+        """ true if the 2182A was reset by this class and nothing has been
+            lost track of since """
+
+        return self._shadow.get(self.resource_name, {}).get('owner') == type(self).__name__
+
+    def shadow_reset(self):
+
+        """ call after the 2182A has been reset """
+
+        self._shadow[self.resource_name] = {'owner' : type(self).__name__, 'settings' : {}}
+
+    def invalidate(self, message = None):
+
+        """ forget the settings a message could have changed, everything
+            with no message or a *RST. see K6220_2182A.invalidate """
+
+        if message is None:
+            self._shadow.pop(self.resource_name, None)
+            return
+        state = self.shadow_state()
+        for header in scpi_headers(message):
+            if header == '*rst':
+                self._shadow.pop(self.resource_name, None)
+                return
+            coupled = header[:-len(':auto')] if header.endswith(':auto') else None
+            for key in state.keys():
+                if key in (header, coupled) or key.startswith(header + ':'):
+                    del state[key]
+
     def chk_meas_evnt_reg(self):
 
         """ Checks the measurement event register on the Keithley 2182
@@ -194,6 +829,26 @@ class K2182(visa.GpibInstrument):
         state.reverse()
         return [int(x) for x in state]
 
+    def wait_for_buffer(self, timeout = 10.0, predicted = 0.0, srq = True):
+
+        """ wait for the buffer to fill. with srq = True the 2182A asserts SRQ
+            when the buffer is full and this blocks on it instead of polling:
+
+            ':stat:meas:even?' -- clear the event latched by the last fill
+            ':stat:meas:enab 512' -- buffer full bit (B9)
+            '*SRE 1' -- measurement summary bit of the status byte
+
+            the event register only latches when the buffer becomes full,
+            so a buffer that is already full is caught by the check first. """
+
+        if srq:
+            self.ask(':stat:meas:even?') #reading clears it, the buffer refills later
+            self.write(':stat:meas:enab 512;*SRE 1')
+            if self.chk_meas_evnt_reg()[9]:
+                return
+        wait_for(lambda: self.chk_meas_evnt_reg()[9], timeout, predicted,
+                 srq = self if srq else None)
+
     def read_buffer(self):
 
         """ Reads the buffer and returns a list of strings.
@@ -217,20 +872,21 @@ class K2182(visa.GpibInstrument):
             ':sens1:volt:dfil {}' -- digital filter on/off
             ':sens1:volt:dfil:tcon {}; coun {}; wind {}' -- filter type/count/window """
 
-        self.write(":sens1:volt:nplc {0:f}".format(nplc))
+        self.nplc = nplc
+        self.channel_settings = 'nplc={0} rang={1} lpas={2:d} dfil={3}'.format(
+            nplc, vRange, lp_filter, (filter_type, filter_count, filter_window) if digital_filter else 0)
+        self.configure(":sens1:volt:nplc", "{0:f}".format(nplc))
         if vRange == 'auto':
-            self.write(":sens1:volt:range:auto 1")
+            self.configure(":sens1:volt:rang:auto", "1")
         else:
-            self.write(":sens1:volt:rang:auto 0")
-            self.write(":sens1:volt:rang {}".format(vRange))
-        self.write(":sens1:volt:lpas {0:d}".format(lp_filter))
+            self.configure(":sens1:volt:rang:auto", "0")
+            self.configure(":sens1:volt:rang", "{}".format(vRange))
+        self.configure(":sens1:volt:lpas", "{0:d}".format(lp_filter))
+        self.configure(":sens1:volt:dfil", "{0:d}".format(digital_filter))
         if digital_filter:
-            self.write(":sens1:volt:dfil {0:d}".format(digital_filter))
-            self.write(":sens1:volt:dfil:tcon {0}; coun {1:d}; wind {2:.2f}"
-                                         .format(filter_type, filter_count, filter_window))
-        else:
-            self.write(":sens1:volt:dfil {0:d}".format(digital_filter))
-        time.sleep(0.25)
+            self.configure(":sens1:volt:dfil:tcon", filter_type)
+            self.configure(":sens1:volt:dfil:coun", "{0:d}".format(filter_count))
+            self.configure(":sens1:volt:dfil:wind", "{0:.2f}".format(filter_window))
 
 #class K2182(visa.GpibInstrument):
 
@@ -242,6 +898,7 @@ class oxford_magnet(visa.GpibInstrument):
         More functions will be added as soon as I figure out what I need. """
 
     err = 1e-6
+    heater_wait = 30.0
         
     def __init__(self, gpib_identifier, rate = 0.2, **keyw):
 
@@ -252,29 +909,78 @@ class oxford_magnet(visa.GpibInstrument):
            C3 -- set operation mode to remote with unlocked panel
            Q4 -- extended resolution mode
            M9 -- display field in Tesla
-           H1 -- turn on switch heater and wait
+           X -- check the switch heater and activity
+           H1 -- turn on switch heater and wait, unless it is already on
            T{rate} -- set sweep rate
            A0 -- unclamp the power supply by going to hold and wait """
 
         super(oxford_magnet, self).__init__(gpib_identifier, **keyw)
         self.term_chars = b"\r"
+        self.rate = rate
         self.write("Q4")
         self.write("C3")
         self.read() #C
         self.write("M9")
         self.read() #M
+        status = self.get_status()
+        self.heater = status['heater']
+        self.heater_on()
+        self.set_rate(rate)
+        if status['heater'] != 1 or status['activity'] != 0:
+            print 'Turning on hold...'
+            time.sleep(0.5)
+            self.write("A0") #A0 returns 'A'
+            self.read() #A
+            time.sleep(2.0)
+        print 'Magnet is ready to use.'
+
+    def healthy(self):
+
+        """ quick check used by the session pool: still in remote control.
+            a magnet left with the switch heater off is kept, the heater
+            goes back on with the first ramp that needs it. """
+
+        status = self.get_status()
+        self.heater = status['heater']
+        return status['control'] in (1, 3)
+
+    def heater_on(self):
+
+        """ turn on the switch heater and wait for it, unless it is already
+            on. a persistent magnet gets its output matched to R18 first:
+
+            H1 -- turn on switch heater
+            R18 -- persistent field """
+
+        if self.heater == 1:
+            print 'Switch heater is already on.'
+            return
+        if self.heater == 2: #persistent, match the leads to the magnet first
+            persistent = float(self.ask('R18')[1:])
+            if abs(self.get_field() - persistent) > self.err:
+                print 'Matching output to persistent field ({}T)...'.format(persistent)
+                self.set_rate(self.rate)
+                self._ramp(persistent).wait()
         self.write("H1")
         self.read() #H
-        print 'Waiting for switch heater (30s)...'
-        time.sleep(30.0)
-        self.write("T{:.5f}".format(rate)) #T... returns 'T'
-        self.read() #T
-        print 'Turning on hold...'
-        time.sleep(0.5)
-        self.write("A0") #A0 returns 'A'
-        self.read() #A
-        time.sleep(2.0)
-        print 'Magnet is ready to use.'
+        print 'Waiting for switch heater ({:.0f}s)...'.format(self.heater_wait)
+        time.sleep(self.heater_wait)
+        self.heater = 1
+
+    def get_status(self):
+
+        """ read the X status string, XmnAnCnHnMmnPmn, and return the
+            activity (A), control (C), switch heater (H) and sweep (M) state.
+
+            heater: 0 -- off, magnet at zero
+                    1 -- on
+                    2 -- off, magnet persistent at field """
+
+        status = self.ask('X')
+        return {'activity' : int(status[status.index('A')+1]),
+                'control' : int(status[status.index('C')+1]),
+                'heater' : int(status[status.index('H')+1]),
+                'sweep' : int(status[status.index('M')+2])}
         
     def set_rate(self, rate):
     
@@ -282,7 +988,39 @@ class oxford_magnet(visa.GpibInstrument):
         
         self.write('T{:.5f}'.format(rate))
         self.read() #T
-        
+        self.rate = rate
+
+    def get_field(self):
+
+        """ output field in Tesla (R7) """
+
+        return float(self.ask('R7')[1:])
+
+    def ramp_to_field(self, field):
+
+        """ Choose a set point and start sweeping the field to that value.
+            Returns a FieldRamp right away, so other work can be done
+            while the magnet moves. Call wait() on it before measuring.
+
+            The switch heater is turned on first if the ramp needs it. """
+
+        return self._ramp(field, heater = True)
+
+    def _ramp(self, field, heater = False):
+        if heater and self.heater == 2: #persistent, R7 is the leads, not the magnet
+            self.heater_on()
+        ramp = FieldRamp(self, field)
+        if not ramp.done():
+            if heater and self.heater != 1:
+                self.heater_on()
+                ramp = FieldRamp(self, field) #timed from after the heater wait
+            self.write('J{0:.5f}'.format(field))
+            ramp.started() #already moving if it was left on A1
+            self.read() #J
+            self.write('A1')
+            self.read() #A
+        return ramp
+
     def go_to_field(self, field, delay = 0.0):
 
         """ Choose a set point and sweep the field to that value.
@@ -290,24 +1028,17 @@ class oxford_magnet(visa.GpibInstrument):
            
             Resolution is 1e-5T. """
            
-        if abs(float(self.ask('R7')[1:]) - field) <= self.err: 
-            time.sleep(delay) #if it is already set, do nothing
-        else:
-            self.write('J{0:.5f}'.format(field))
-            self.read() #J
-            self.write('A1')
-            self.read() #A
-            while abs(float(self.ask('R7')[1:]) - field) >= self.err: pass
-            time.sleep(delay)
+        self.ramp_to_field(field).wait(delay)
             
-    def end_at_zero(self):
+    def end_at_zero(self, heater_off = True):
         
         """ Sweep the field value back to 0T. Place magnet in hold
             position. 
             
             set field to zero
             set mode to Hold
-            Turn off switch heater
+            Turn off switch heater (unless heater_off = False, which saves
+            the heater wait before the next ramp)
             
             Useful to place at the end of an experiment. """
             
@@ -315,8 +1046,72 @@ class oxford_magnet(visa.GpibInstrument):
         time.sleep(2.0)
         self.write('A0')
         self.read() #A
-        self.write('H0')
-        self.read() #H
+        if heater_off:
+            self.write('H0')
+            self.read() #H
+            self.heater = 0
+
+class FieldRamp(object):
+
+    """ handle for a field ramp started by oxford_magnet.ramp_to_field.
+
+        eta is the predicted arrival time from the sweep rate. the output
+        field is only checked once per interval, which is half of the
+        predicted time left (up to max_interval), so the bus isn't tied up
+        with R7 queries for the whole ramp. within 2*min_interval of the
+        set point the next check is right at the eta. """
+
+    min_interval = 0.1
+    max_interval = 5.0
+
+    def __init__(self, magnet, field):
+        self.magnet = magnet
+        self.target = field
+        self.field = magnet.get_field()
+        self.start_time = self.last_check = time.time()
+        self.eta = self.start_time + self.time_left()
+        self.reached = abs(self.field - field) <= magnet.err
+
+    def time_left(self):
+
+        """ predicted seconds to the set point from the last field read """
+
+        return abs(self.target - self.field)/self.magnet.rate*60.0
+
+    def interval(self):
+        left = self.time_left()
+        if left < 2*self.min_interval: #nearly there
+            return max(left + 0.01, 0.25*self.min_interval)
+        return min(0.5*left, self.max_interval)
+
+    def started(self):
+
+        """ the set point has just been sent, count from now """
+
+        self.last_check = time.time()
+        self.eta = self.last_check + self.time_left()
+
+    def done(self):
+
+        """ check the field if enough time has passed since the last look.
+            never blocks for longer than one R7 query. """
+
+        if not self.reached and time.time() - self.last_check >= self.interval():
+            self.field = self.magnet.get_field()
+            self.last_check = time.time()
+            self.eta = self.last_check + self.time_left()
+            self.reached = abs(self.field - self.target) <= self.magnet.err
+        return self.reached
+
+    def wait(self, delay = 0.0, timeout = None):
+
+        """ block until the set point is reached, then sleep for delay """
+
+        while not self.done():
+            if timeout is not None and (time.time() - self.start_time) > timeout:
+                raise RuntimeError('field not reached in {:.1f}s'.format(timeout))
+            time.sleep(max(self.last_check + self.interval() - time.time(), 0.0))
+        time.sleep(delay)
 
 class oxford_temp(visa.GpibInstrument):
 
@@ -337,10 +1132,39 @@ class oxford_temp(visa.GpibInstrument):
        self.write("C3")
        self.read() #because write("C3") returns a 'C'
 
+    def healthy(self):
+
+        """ quick check used by the session pool """
+
+        return self.ask("R1").startswith('R')
+
     def get_temps(self):
         """ get temperature readings in array """
         return [self.ask("R1")[1:], self.ask("R2")[1:], self.ask("R3")[1:]]
 
+    def get_temp(self, sensor = 1):
+
+        """ temperature of one sensor (1-3) in Kelvin """
+
+        return float(self.ask("R{:d}".format(sensor))[1:])
+
+    def set_temp(self, temp):
+
+        """ change the set point, returns right away. see wait_for_temp """
+
+        self.write("T{:.3f}".format(temp))
+        self.read() #T
+
+    def wait_for_temp(self, temp, tolerance = 0.05, sensor = 1, interval = 1.0, timeout = None):
+
+        """ block until sensor is within tolerance of temp """
+
+        start_time = time.time()
+        while abs(self.get_temp(sensor) - temp) > tolerance:
+            if timeout is not None and (time.time() - start_time) > timeout:
+                raise RuntimeError('{0}K not reached in {1:.1f}s'.format(temp, timeout))
+            time.sleep(interval)
+
 # To use the DAQ board there is no need yet for an additional class.
 # See the pylibnidaqmx documentation for more. Here is a simple output example...
 
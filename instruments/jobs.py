@@ -0,0 +1,138 @@
+""" Run instrument calls in the background so independent instruments can
+    work at the same time. Each instrument gets one worker thread, so calls
+    to the same instrument still happen one after the other in the order
+    they were made, the way its session expects.
+
+    from instruments import jobs
+
+    mag = jobs.Async(instruments.oxford_magnet("GPIB::20"))
+    itc = jobs.Async(instruments.oxford_temp("GPIB::24"))
+    ramp = mag.go_to_field(0.5)   #returns right away
+    temps = itc.get_temps()
+    data = source.execute_sweep() #meanwhile, in this thread
+    ramp.result(); print temps.result()
+
+    or, for a handful of calls at once,
+
+    field, temps = jobs.gather(mag.get_field(), itc.get_temps())
+
+    The wrapped object is still there as .instrument for the usual blocking
+    calls. Don't mix the two on the same instrument from different threads. """
+
+import sys, threading, weakref, atexit
+from Queue import Queue
+
+class Job(object):
+
+    """ the result of a call that was handed to a worker """
+
+    def __init__(self, name = ''):
+        self.name = name
+        self.finished = threading.Event()
+        self.value = None
+        self.error = None
+
+    def done(self):
+        return self.finished.is_set()
+
+    def result(self, timeout = None):
+
+        """ wait for the call to finish and return what it returned, or
+            raise what it raised """
+
+        if not self.finished.wait(timeout):
+            raise RuntimeError('{} did not finish in {:.1f}s'.format(self.name, timeout))
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+    def run(self, function, args, keyw):
+        try:
+            self.value = function(*args, **keyw)
+        except Exception:
+            self.error = sys.exc_info()
+        self.finished.set()
+
+class Worker(object):
+
+    """ a thread that runs the calls for one instrument in order """
+
+    def __init__(self, name = 'worker'):
+        self.queue = Queue()
+        self.thread = threading.Thread(target = self.loop, name = name)
+        self.thread.daemon = True #don't hold up the interpreter on exit
+        self.thread.start()
+
+    def submit(self, function, *args, **keyw):
+        job = Job(getattr(function, '__name__', str(function)))
+        self.queue.put((job, function, args, keyw))
+        return job
+
+    def loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            job, function, args, keyw = item
+            job.run(function, args, keyw)
+            del item, job, function, args, keyw #don't keep the instrument alive
+
+    def stop(self):
+        self.queue.put(None)
+
+_workers = weakref.WeakKeyDictionary() #one per instrument
+_workers_lock = threading.Lock()
+
+def worker(instrument):
+
+    """ the worker that runs the calls for instrument """
+
+    with _workers_lock:
+        if instrument not in _workers:
+            w = Worker(type(instrument).__name__)
+            w.ref = weakref.ref(instrument, lambda ref: w.stop()) #stop with the instrument
+            _workers[instrument] = w
+        return _workers[instrument]
+
+def submit(instrument, function, *args, **keyw):
+
+    """ run function(*args, **keyw) on the worker of instrument """
+
+    return worker(instrument).submit(function, *args, **keyw)
+
+class Async(object):
+
+    """ wraps an instrument (or DAQ task). every method call goes to the
+        instrument's worker and returns a Job instead of waiting. """
+
+    def __init__(self, instrument):
+        self.instrument = instrument
+
+    def __getattr__(self, name):
+        attribute = getattr(self.instrument, name)
+        if not callable(attribute):
+            return attribute
+        def call(*args, **keyw):
+            return submit(self.instrument, attribute, *args, **keyw)
+        call.__name__ = name
+        return call
+
+def gather(*jobs, **keyw):
+
+    """ wait for every job and return their results in order. timeout
+        (seconds, keyword only) applies to each job. """
+
+    timeout = keyw.get('timeout', None)
+    return [job.result(timeout) for job in jobs]
+
+@atexit.register
+def stop_all():
+
+    """ let the workers finish before the interpreter shuts down """
+
+    with _workers_lock:
+        workers = _workers.values()
+    for w in workers:
+        w.stop()
+    for w in workers:
+        w.thread.join(1.0)
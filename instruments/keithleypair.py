@@ -5,8 +5,10 @@
 
 from __future__ import division
 import time
+import numpy as np
 import instruments #creates the source object
-from exptools.exptools import buffer_split
+import calibration, timing
+from exptools.exptools import plan_sweep
 
 class IVmax1024(instruments.K6220_2182A):
 
@@ -16,7 +18,11 @@ class IVmax1024(instruments.K6220_2182A):
     actual experiment scripts.
 
     Note: These IV curves are limited to 1024 points """
-    
+
+    segment_size = 1024 #2182A buffer
+    segment_restart = 0.0 #seconds to start the next segment, measured by IVunlim
+    overlap_readout = False #the buffer is read after the sweep
+
     def general_setup(self, beep = False, display = True):
 
         """ reset and general commands to run before sweep setup:
@@ -25,18 +31,17 @@ class IVmax1024(instruments.K6220_2182A):
             'RST;*CLS' -- reset and clear 6220
             '*RST;*CLS;:abor' -- reset, clear, abort previous 2182
             ':syst:beep:stat {}' -- turn off/on beep 6220+2182
-            ':disp:enab {}' -- turn off/on the display 6220+2182 """
-
-        self.write(':sour:swe:abor')
-        self.write('*RST;*CLS')
-        time.sleep(1.0)
-        self.nanovoltmeter_check()
-        self.write_serial('*RST;*CLS;:abor')
-        time.sleep(1.0)
-        self.write(":syst:beep:stat {0:d}".format(beep))
-        self.write_serial(":syst:beep:stat {0:d}".format(beep))
-        self.write(":disp:enab {0:d}".format(display))
-        self.write_serial(":disp:enab {0:d}".format(display))
+            ':disp:enab {}' -- turn off/on the display 6220+2182
+
+            the resets are skipped if nothing has changed since the last
+            general_setup, see reset_pair """
+
+        self.reset_pair()
+        with self.batch():
+            self.configure(":syst:beep:stat", "{0:d}".format(beep))
+            self.configure(":disp:enab", "{0:d}".format(display))
+            self.configure_serial(":syst:beep:stat", "{0:d}".format(beep)) #one message for each port
+            self.configure_serial(":disp:enab", "{0:d}".format(display))
 
     def source_sweep_setup(self, start, stop, step, delay, count = 1.0,
                            compliance = 100.0, compliance_abort = False):
@@ -51,20 +56,37 @@ class IVmax1024(instruments.K6220_2182A):
             
         #ranges = [2e-9, 2e-8, 2e-7, 2e-6, 2e-5, 2e-4, 0.002, 0.02, 0.1]
         
-        self.write(':sour:swe:spac lin')
-        #large = max(abs(stop), abs(start))
-        #self.write(":sour:curr:rang {0:e}".format(filter(lambda range: range > large, ranges)[0]))
-        self.write(':sour:swe:rang {0}'.format('best'))
-        self.write(':sour:swe:coun {0:f}'.format(count))
-        if start > stop:
-            step = -step
-        self.write(":sour:curr:start {0:e}; stop {1:e}; step {2:e}"
-                             .format(start, stop, step))
-        self.write(":sour:curr:comp {0:f}".format(compliance))
-        self.write(":sour:swe:cab {0:d}".format(compliance_abort))
-        self.write(":sour:del {0:.3f}".format(delay))
+        self.source_delay = delay
+        self.plan = self.plan_sweep(start, stop, step)
+        if len(self.plan.chunks) > 1:
+            raise RuntimeError('sweep does not fit in the 2182A buffer: {}'.format(self.plan.points))
+        self.sweep_points = self.plan.points
+        with self.batch():
+            self.configure(':sour:swe:spac', 'lin')
+            #large = max(abs(stop), abs(start))
+            #self.write(":sour:curr:rang {0:e}".format(filter(lambda range: range > large, ranges)[0]))
+            self.configure(':sour:swe:rang', 'best')
+            self.configure(':sour:swe:coun', '{0:f}'.format(count))
+            if start > stop:
+                step = -step
+            self.configure(":sour:curr:start", "{0:e}".format(start))
+            self.configure(":sour:curr:stop", "{0:e}".format(stop))
+            self.configure(":sour:curr:step", "{0:e}".format(step))
+            self.configure(":sour:curr:comp", "{0:f}".format(compliance))
+            self.configure(":sour:swe:cab", "{0:d}".format(compliance_abort))
+            self.configure(":sour:del", "{0:.3f}".format(delay))
         #self.write(':sour:curr:filt:stat 1')
 
+    def plan_sweep(self, start, stop, step):
+
+        """ split the sweep into segments that take the least time with the
+            current source delay, 2182A settings and measured read times.
+            returns an exptools.SweepPlan """
+
+        return plan_sweep(start, stop, step, dwell = self.source_delay + self.reading_time(),
+                          restart = self.segment_restart, readout = self.readout_cost(),
+                          limit = self.segment_size, overlap = self.overlap_readout)
+
     def source_arm_setup(self):
 
         """ setup commands for the current source arm layer:
@@ -74,10 +96,11 @@ class IVmax1024(instruments.K6220_2182A):
             ':arm:olin 2' -- output trigger from arm layer to pin 2
             ':arm:outp none' -- do not send output trigger from arm layer """
 
-        self.write(':arm:dir acc') #sour or acc
-        self.write(':arm:sour imm') #bus or imm
-        self.write(':arm:olin 2') #output line 2 goes to the nvm
-        self.write(':arm:outp none') #none, tex, or tent
+        with self.batch():
+            self.configure(':arm:dir', 'acc') #sour or acc
+            self.configure(':arm:sour', 'imm') #bus or imm
+            self.configure(':arm:olin', '2') #output line 2 goes to the nvm
+            self.configure(':arm:outp', 'none') #none, tex, or tent
         
     def source_trig_setup(self):
 
@@ -88,10 +111,12 @@ class IVmax1024(instruments.K6220_2182A):
             ':trig:ilin 1; olin 2' -- set trigger link in/out pins
             ':trig:output del -- output trigger after source delay """
             
-        self.write(':trig:sour tlin')
-        self.write(':trig:dir sour')
-        self.write(':trig:ilin 1; olin 2')
-        self.write(':trig:outp del')
+        with self.batch():
+            self.configure(':trig:sour', 'tlin')
+            self.configure(':trig:dir', 'sour')
+            self.configure(':trig:ilin', '1')
+            self.configure(':trig:olin', '2')
+            self.configure(':trig:outp', 'del')
 
     def voltmeter_trig_setup(self, trigCoun = 'inf'):
 
@@ -102,11 +127,11 @@ class IVmax1024(instruments.K6220_2182A):
             ':trig:del:auto on' -- turn on trigger auto delay, based on range
             delay time can also be specified manually """
 
-        self.write_serial(':trig:sour ext')
-        #self.write_serial(':samp:coun {}'.format(sampCoun))
-        self.write_serial(':trig:coun {}'.format(trigCoun))
-        self.write_serial(':trig:del:auto on')
-        time.sleep(0.25)
+        with self.batch():
+            self.configure_serial(':trig:sour', 'ext')
+            #self.write_serial(':samp:coun {}'.format(sampCoun))
+            self.configure_serial(':trig:coun', '{}'.format(trigCoun))
+            self.configure_serial(':trig:del:auto', 'on')
 
     def voltmeter_buffer_setup(self, buffer_size):
 
@@ -115,181 +140,232 @@ class IVmax1024(instruments.K6220_2182A):
             ':trac:cle' -- clear buffer
             ':trac:feed sens1; poin {}' -- buffer to read channel 1/set size """
         
-        self.write_serial(":trac:cle") 
-        self.write_serial(":trac:feed sens1; poin {0:.0f}".format(buffer_size))
-        time.sleep(0.25)
+        with self.batch():
+            self.write_serial(":trac:cle") 
+            self.configure_serial(":trac:feed", "sens1")
+            self.configure_serial(":trac:poin", "{0:.0f}".format(buffer_size))
 
     def execute_sweep(self, ivAvg = 1, timeout = 75.0):
 
         """ this program will restart the buffer, trigger the sweep,
             and return the measured data for a given number of runs """
 
+        return self.read_sweep(self.run_sweep(ivAvg, timeout))
+
+    def run_sweep(self, ivAvg = 1, timeout = 75.0):
+
+        """ the sweeps of execute_sweep, with every buffer read but the
+            last. every reading is in the buffer once this returns, so the
+            field or gate can move while read_sweep transfers the rest. """
+
         data = []
         for iv in xrange(ivAvg):
-            sweep_state = [0, 0, 1]
             self.write_serial(':trac:feed:cont next')
-            time.sleep(0.25)
+            self.enable_sweep_srq()
             self.write('syst:key 13')
-            time.sleep(0.2)
             start_time = time.time()
-            while ((time.time() - start_time) < timeout) and \
-                  (not sweep_state[0]) and (not sweep_state[1]):
-                sweep_state = self.source_chk_op_evnt_reg()[1:4]
+            sweep_state = self.wait_for_sweep(timeout)
             if (sweep_state[0]):
                 print "{0}, execution time: {1:.2f}s".format(iv, time.time() - start_time)
+                timing.add('integrating', self.sweep_points*self.integration_time())
             elif sweep_state[1]:
                 raise RuntimeError('sweep aborted!')
             elif (time.time() - start_time) > timeout:
                 raise RuntimeError('sweep timeout!')
             else:
                 raise RuntimeError('sweep stopped for unknown reason?')
-                
-            time.sleep(1.0) #buffer fill delay
-            data.append(self.read_2182A_buffer()) #this is not great
+            with timing.phase('readout'):
+                self.wait_for_buffer() #last readings can trail the sweep done bit
+            if iv + 1 < ivAvg: #the next sweep refills the buffer
+                self.read_sweep(data)
+        return data
+
+    def read_sweep(self, data):
+
+        """ read the buffer of the last sweep run_sweep made, returns the
+            data of every sweep """
+
+        with timing.phase('readout'):
+            data.append(self.read_2182A_buffer(ignore = True))
+        points, size, trips, seconds = self.read_log[-1]
+        print "   read time: {0:.2f}s ({1} bytes, {2} round trips)".format(seconds, size, trips)
         return data
         
     # see keithleypair_IV_Var for usage examples
         
-class IVunlim(instruments.K6220_2182A):
+class IVunlim(IVmax1024):
 
     """ A class of functions to setup and execute single IV curves.
 
     These function are meant to be called from your
     actual experiment scripts. Should be totally interchangable
-    with IVmax1024. Might have to change the number of triggers
-    from the 2182A to 'inf'
+    with IVmax1024, setup and usage are the same.
 
-    Note: These IV curves are unlimited in length, but slightly 
-          slower than the 1024 point option. """
-          
-    def general_setup(self, beep = False, display = True):
+    Note: These IV curves are unlimited in length. The sweep is split
+          into segments that fit in the 2182A buffer. Each segment is
+          timed by the trigger link like IVmax1024, and the next one
+          runs while the data from the last one is read. The segment
+          lengths come from plan_sweep. """
 
-        """ reset and general commands to run before sweep setup:
+    segment_restart = 0.05
+    overlap_readout = True
+    bias_level = 0.0 #6220 output between curves, as after *RST
 
-            ':sour:swe:abor' -- abort previous sweep
-            'RST;*CLS' -- reset and clear 6220
-            '*RST;*CLS;:abor' -- reset, clear, abort previous 2182
-            ':syst:beep:stat {}' -- turn off/on beep 6220+2182
-            ':disp:enab {}' -- turn off/on the display 6220+2182 """
-
-        self.write(":sour:swe:abor")
-        self.write("*RST;*CLS")
-        time.sleep(1.0)
-        self.nanovoltmeter_check()
-        self.write_serial("*RST;*CLS;:abor")
-        time.sleep(1.0)
-        self.write(":syst:beep:stat {0:d}".format(beep))
-        self.write_serial(":syst:beep:stat {0:d}".format(beep))
-        self.write(":disp:enab {0:d}".format(display))
-        self.write_serial(":disp:enab {0:d}".format(display))
+    def source_arm_setup(self):
+
+        """ setup commands for the current source arm layer:
+
+            ':arm:dir sour' -- control arm source bypaqss
+            ':arm:sour imm' -- arm right away
+            ':arm:olin 2' -- output trigger from arm layer to pin 2
+            ':arm:outp none' -- do not send output trigger from arm layer
+
+            the trigger layer is IVmax1024's, the 2182A is triggered after
+            every source delay. """
+
+        with self.batch():
+            self.configure(':arm:dir', 'sour') #sour or acc
+            self.configure(':arm:sour', 'imm') #bus or imm
+            self.configure(':arm:olin', '2') #output line 2 goes to the nvm
+            self.configure(':arm:outp', 'none') #none, tex, or tent
 
     def source_sweep_setup(self, start, stop, step, delay, count = 1.0,
                            compliance = 100.0, compliance_abort = False):
 
         """ setup commands for the current source sweep:
 
-            ':sour:swe:spac lin; rang {}; coun 1' -- spacing, range, number of sweeps
-            ':sour:curr:start {}; stop {}; step {}' -- start, stop, step
+            ':sour:swe:spac lin; rang fix; coun 1' -- spacing, range, number of sweeps
+            ':sour:curr:rang {}' -- one range for every segment
+            ':sour:curr:start {}; stop {}; step {}' -- start, stop, step of the first segment
             ':sour:del {}' -- source delay in seconds
             ':sour:curr:comp {0:f}' -- compliance voltage
-            ':sour:swe:cab {0:d}' -- abort if compliance voltage is reached """
-            
-        ranges = [2e-9, 2e-8, 2e-7, 2e-6, 2e-5, 2e-4, 0.002, 0.02, 0.1]
-        
-        self.write(':sour:swe:spac lin')
-        large = max(abs(stop), abs(start))
-        self.write(":sour:curr:rang {0:e}".format(filter(lambda range: range > large, ranges)[0]))
-        self.write(':sour:swe:rang {0}'.format('fix'))
-        self.write(':sour:swe:coun {0:f}'.format(count))
-        if start > stop:
-            step = -step
-        self.write(":sour:curr:start {0:e}; stop {1:e}; step {2:e}"
-                             .format(start, stop, step))
-        self.write(":sour:del {0:.3f}".format(delay))
-        self.write(":sour:curr:comp {0:f}".format(compliance))
-        self.write(":sour:swe:cab {0:d}".format(compliance_abort))
-        self.write(':sour:curr:filt:stat 1') #makes no noticable time difference
-        time.sleep(0.5)
+            ':sour:swe:cab {0:d}' -- abort if compliance voltage is reached
 
-    def source_arm_setup(self):
-
-        """ setup commands for the current source arm layer:
+            each segment is swept once, count is ignored. use ivAvg. """
 
-            ':arm:dir sour' -- control arm source bypaqss
-            ':arm:sour bus' -- arm source set to serial bus
-            ':arm:olin 2' -- output trigger from arm layer to pin 2
-            ':arm:outp none' -- do not send output trigger from arm layer """
-
-        self.write(':arm:dir sour') #sour or acc
-        self.write(':arm:sour imm') #bus or imm
-        self.write(':arm:olin 2') #output line 2 goes to the nvm
-        self.write(':arm:outp none') #none, tex, or tent
-        time.sleep(0.5)
+        ranges = [2e-9, 2e-8, 2e-7, 2e-6, 2e-5, 2e-4, 0.002, 0.02, 0.1]
 
-    def source_trig_setup(self):
+        self.source_delay = delay
+        self.sweep_args = (start, stop, step)
+        self.plan = self.plan_sweep(start, stop, step)
+        self.segments = self.plan.segments
+        self.sweep_points = self.segments[0][2]
+        if start > stop:
+            step = -step
+        with self.batch():
+            self.configure(':sour:swe:spac', 'lin')
+            large = max(abs(stop), abs(start))
+            self.configure(":sour:curr:rang", "{0:e}".format(filter(lambda range: range > large, ranges)[0]))
+            self.configure(':sour:swe:rang', 'fix')
+            self.configure(':sour:swe:coun', '{0:f}'.format(1))
+            self.configure(":sour:curr:start", "{0:e}".format(self.segments[0][0]))
+            self.configure(":sour:curr:stop", "{0:e}".format(self.segments[0][1]))
+            self.configure(":sour:curr:step", "{0:e}".format(step))
+            self.configure(":sour:del", "{0:.3f}".format(delay))
+            self.configure(":sour:curr:comp", "{0:f}".format(compliance))
+            self.configure(":sour:swe:cab", "{0:d}".format(compliance_abort))
+            self.configure(':sour:curr:filt:stat', '1') #makes no noticable time difference
 
-        """ setup commands for the current source trigger layer:
+    def voltmeter_buffer_setup(self, buffer_size):
 
-            ':trig:dir sour" -- source or acceptor, crucial!
-            ':trig:sour tlin' -- set trigger source to trigger link cable
-            ':trig:ilin 1; olin 2' -- set trigger link in/out pins
-            ':trig:output del -- output trigger after source delay """
+        """ setup commands for the nanovoltmeter buffer layer:
 
-        self.write(":trig:dir sour")
-        self.write(":trig:sour tlin")
-        self.write(":trig:ilin 1; olin 2")
-        self.write(":trig:outp none")
-        time.sleep(0.5)
+            ':trac:cle' -- clear buffer
+            ':trac:feed sens1; poin {}' -- buffer to read channel 1/set size
+
+            the buffer is sized for the first segment, call this after
+            source_sweep_setup. the segments are planned again here, now
+            that the 2182A settings are known. """
+
+        if buffer_size != self.plan.points:
+            raise RuntimeError('buffer size does not match the sweep: {}'.format(buffer_size))
+        self.plan = self.plan_sweep(*self.sweep_args)
+        self.segments = self.plan.segments
+        start, stop, self.sweep_points = self.segments[0]
+        with self.batch():
+            self.configure(":sour:curr:start", "{0:e}".format(start))
+            self.configure(":sour:curr:stop", "{0:e}".format(stop))
+            IVmax1024.voltmeter_buffer_setup(self, self.sweep_points)
+
+    def start_segment(self, k):
+
+        """ empty the 2182A buffer, set it up for segment k and start the
+            sweep of that segment. doesn't wait for an answer from the 2182A,
+            so it can be called while a buffer is still being read.
+
+            the 6220 goes to its bias level (:sour:curr) when a sweep is
+            done or aborted. while a curve runs that is the start of the
+            segment, so between segments the output stays inside the curve
+            instead of stepping to 0 A. run_sweep puts bias_level back. """
+
+        begin = time.time()
+        start, stop, points = self.segments[k]
+        self.write_serial(':trac:cle;:trac:poin {0:d};:trac:feed:cont next'.format(points),
+                          sync = False)
+        self.sweep_points = points
+        with self.batch():
+            if len(self.segments) > 1:
+                self.write(':sour:curr {0:e}'.format(start))
+            self.write(':sour:swe:abor')
+            self.configure(":sour:curr:start", "{0:e}".format(start))
+            self.configure(":sour:curr:stop", "{0:e}".format(stop))
+            self.write(':sour:swe:arm')
+        #the 2182A has to be listening before the first trigger
+        time.sleep(max(self.serial_sent + 0.005 - time.time(), 0.0))
+        self.write('syst:key 13')
+        self.segment_restart = time.time() - begin
 
-    def voltmeter_trig_setup(self, trigCoun = 'inf'):
+    def execute_sweep(self, ivAvg = 1, timeout = 75.0):
 
-        """ setup commands for the nanovoltmeter trigger layer:
+        """ this program will run every segment of the sweep and return the
+            measured data for a given number of runs. the next segment is
+            started before the buffer of the last one is read. """
 
-            ':trig:sour ext' -- external trigger
-            ':trig:coun inf' -- infinite number of output triggers
-            ':trig:del:auto on' -- turn on trigger auto delay, based on range
-            delay time can also be specified manually """
+        return self.read_sweep(self.run_sweep(ivAvg, timeout))
 
-        self.write_serial(':trig:sour bus')
-        #self.write_serial(':samp:coun {}'.format(sampCoun))
-        self.write_serial(':trig:coun {}'.format(trigCoun))
-        self.write_serial(':trig:del:auto on')
-        self.write_serial(':init:imm')
+    def run_sweep(self, ivAvg = 1, timeout = 75.0):
 
-    def voltmeter_buffer_setup(self, buffer_size):
+        """ every segment of execute_sweep, read_sweep gets the reply for
+            the last one. see IVmax1024.run_sweep """
 
-        """ setup commands for the nanovoltmeter buffer layer:
+        runs = [(iv, k) for iv in xrange(ivAvg) for k in range(len(self.segments))]
+        data = [[] for _ in xrange(ivAvg)]
+        self.enable_sweep_srq()
+        start_time = time.time()
+        self.start_segment(0)
+        for i, (iv, k) in enumerate(runs):
+            sweep_state = self.wait_for_sweep(timeout)
+            if sweep_state[1]:
+                raise RuntimeError('sweep aborted!')
+            elif not sweep_state[0]:
+                raise RuntimeError('sweep timeout!')
+            timing.add('integrating', self.segments[k][2]*self.integration_time())
+            self.wait_for_buffer() #last readings can trail the sweep done bit
+            request = self.request_2182A_buffer(self.segments[k][2])
+            if i+1 == len(runs):
+                if len(self.segments) > 1: #back from the start of the last segment
+                    self.write(':sour:curr {0:e}'.format(self.bias_level))
+                return data, request, start_time
+            self.start_segment(runs[i+1][1])
+            with timing.phase('readout'):
+                data[iv].append(self.collect_2182A_buffer(request))
+            if k == len(self.segments) - 1:
+                print "{0}, execution time: {1:.2f}s".format(iv, time.time() - start_time)
+                start_time = time.time()
 
-            ':trac:cle' -- clear buffer
-            ':trac:feed sens1; poin {}' -- buffer to read channel 1/set size """
+    def read_sweep(self, sweep):
 
-        self.write_serial(":trac:cle") 
-        self.bufferRuns, self.bufferSize = buffer_split(buffer_size)
-        self.write_serial(":trac:feed sens1; poin {0:.0f}".format(self.bufferSize))
-        time.sleep(0.25)
+        """ collect the last segment run_sweep asked for, returns the data
+            of every sweep """
 
-    def execute_sweep(self, ivAvg = 1, delay = 0.2, timeout = 75.0):
-                      
-        """ this program will restart the buffer, trigger the sweep,
-            and return the measured data for a given number of runs """
+        data, request, start_time = sweep
+        with timing.phase('readout'):
+            data[-1].append(self.collect_2182A_buffer(request))
+        print "{0}, execution time: {1:.2f}s".format(len(data) - 1, time.time() - start_time)
+        return [np.concatenate(d) for d in data]
 
-        data = []
-        ivData = [0.0 for _ in range(self.bufferRuns*self.bufferSize)]
-        for iv in range(ivAvg):
-            start_time = time.time()
-            self.write(':init:imm')
-            for run in range(self.bufferRuns):
-                self.write_serial(':trac:feed:cont next')
-                for i in range(self.bufferSize):
-                    time.sleep(delay)
-                    self.write_serial('*TRG')
+    # see keithleypair_IV_Var for usage examples
         
-                time.sleep(1.0) #buffer fill delay
-                ivData[run:(run+1)*self.bufferSize] = self.read_2182A_buffer()
-            print "{0}, execution time: {1:.2f}s".format(iv, time.time() - start_time)
-            data.append(ivData) #this is not great
-        return data
-
 class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
 
     """ A class of functions to setup the 6220/2182A to output a
@@ -312,18 +388,17 @@ class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
             'RST;*CLS' -- reset and clear 6220
             '*RST;*CLS;:abor' -- reset, clear, abort previous 2182
             ':syst:beep:stat {}' -- turn off/on beep 6220+2182
-            ':disp:enab {}' -- turn off/on the display 6220+2182 """
+            ':disp:enab {}' -- turn off/on the display 6220+2182
+
+            the resets are skipped if nothing has changed since the last
+            general_setup, see reset_pair """
             
-        self.write(":sour:swe:abor")
-        self.write("*RST;*CLS")
-        self.nanovoltmeter_check()
-        time.sleep(1.0)
-        self.write_serial("*RST;*CLS;:abor")
-        time.sleep(1.0)
-        self.write(":syst:beep:stat {0:d}".format(beep))
-        self.write_serial(":syst:beep:stat {0:d}".format(beep))
-        self.write(":disp:enab {0:d}".format(display))
-        self.write_serial(":disp:enab {0:d}".format(display))
+        self.reset_pair()
+        with self.batch():
+            self.configure(":syst:beep:stat", "{0:d}".format(beep))
+            self.configure(":disp:enab", "{0:d}".format(display))
+            self.configure_serial(":syst:beep:stat", "{0:d}".format(beep)) #one message for each port
+            self.configure_serial(":disp:enab", "{0:d}".format(display))
         
     def bias_setup(self, bias, autoRange = False,
                    compliance = 100.0, compliance_abort = False, 
@@ -336,16 +411,17 @@ class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
             ':sour:curr {0.15f}' -- set bias 
             ':sour:curr:comp {0:e}' -- set compliance voltage
             ':sour:curr:filt:stat {0:d}' -- abort on compliance? """
-        if autoRange:
-            self.write('sour:curr:range:auto on')
-        else:
-            ranges = [2e-9, 2e-8, 2e-7, 2e-6, 2e-5, 2e-4, 0.002, 0.02, 0.1]
-            self.write(":sour:curr:rang:auto off")
-            self.write(":sour:curr:rang {0:e}".format(filter(lambda range: range > abs(bias), ranges)[0]))
+        with self.batch():
+            if autoRange:
+                self.configure(':sour:curr:rang:auto', 'on')
+            else:
+                ranges = [2e-9, 2e-8, 2e-7, 2e-6, 2e-5, 2e-4, 0.002, 0.02, 0.1]
+                self.configure(":sour:curr:rang:auto", "off")
+                self.configure(":sour:curr:rang", "{0:e}".format(filter(lambda range: range > abs(bias), ranges)[0]))
             
-        self.write(":sour:curr {0:.15f}".format(bias))
-        self.write(":sour:curr:comp {0:e}".format(compliance))
-        self.write(":sour:curr:filt:stat {0:d}".format(analogFilt))
+            self.configure(":sour:curr", "{0:.15f}".format(bias))
+            self.configure(":sour:curr:comp", "{0:e}".format(compliance))
+            self.configure(":sour:curr:filt:stat", "{0:d}".format(analogFilt))
         
     def voltmeter_trig_setup(self, trigSour, trigCoun, delay = 'auto'):
 
@@ -357,13 +433,14 @@ class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
             delay time can also be specified manually 
             ':init:imm' -- initiate trigger layer """
 
-        self.write_serial(':trig:sour {}'.format(trigSour))
-        self.write_serial(':trig:coun {}'.format(trigCoun))
-        if delay == 'auto':
-            self.write_serial(':trig:del:auto on')
-        else:
-            self.write_serial(':trig:del:auto off')
-            self.write_serial(':trig:del {0:.3f}'.format(delay))
+        with self.batch():
+            self.configure_serial(':trig:sour', '{}'.format(trigSour))
+            self.configure_serial(':trig:coun', '{}'.format(trigCoun))
+            if delay == 'auto':
+                self.configure_serial(':trig:del:auto', 'on')
+            else:
+                self.configure_serial(':trig:del:auto', 'off')
+                self.configure_serial(':trig:del', '{0:.3f}'.format(delay))
             
     def voltmeter_buffer_setup(self, bufferSize):
 
@@ -372,10 +449,10 @@ class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
             ':trac:cle' -- clear buffer
             ':trac:feed sens1; poin {}' -- buffer to read channel 1/set size """
 
-        self.write_serial(":trac:cle") #clear buffer
-        self.write_serial(':trac:feed sens1')
-        self.write_serial('trac:poin {0:.0f}'.format(bufferSize))
-        time.sleep(0.25)
+        with self.batch():
+            self.write_serial(":trac:cle") #clear buffer
+            self.configure_serial(':trac:feed', 'sens1')
+            self.configure_serial(':trac:poin', '{0:.0f}'.format(bufferSize))
         
     def bus_trig_setup(self, bufferSize):
     
@@ -393,10 +470,11 @@ class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
                 write_serial('*TRG')
             data = read_2182A_buffer() """
             
-        self.voltmeter_trig_setup('bus', 'inf')
-        self.voltmeter_buffer_setup(bufferSize)
-        self.write_serial('trac:feed:cont next')
-        self.write_serial(':init:imm')
+        with self.batch():
+            self.voltmeter_trig_setup('bus', 'inf')
+            self.voltmeter_buffer_setup(bufferSize)
+            self.write_serial('trac:feed:cont next')
+            self.write_serial(':init:imm')
     
     def get_avg_single(self):
     
@@ -407,6 +485,7 @@ class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
         for _ in range(self.avg):
             time.sleep(self.delay)
             data.append(float(self.ask_serial('sens:data?')))
+        timing.add('integrating', self.avg*self.integration_time())
         return sum(data)/len(data)
             
     def get_avg_buffer(self):
@@ -415,11 +494,72 @@ class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
             definition to define get_meas() """
             
         self.write_serial('trac:feed:cont next') #this works
-        while not self.voltmeter_chk_meas_evnt_reg()[9]: pass
+        self.wait_for_buffer(predicted = self.avg*(self.delay + self.reading_time()))
         self.write_serial('calc2:imm?')
         time.sleep(0.01)
+        timing.add('integrating', self.avg*self.integration_time())
         return float(self.read_serial())
     
+    def stream_setup(self, block):
+
+        """ sets up the voltmeter to take readings continuously into a buffer
+            of 2*block points, which stream() reads a block at a time. the
+            other half is room for the readings that come in meanwhile.
+            a usage example follows...
+
+            general_setup()
+            bias_setup(bias)
+            voltmeter_channel_setup(*args)
+            voltmeter_format_setup('sreal')
+            stream_setup(block)
+            write('outp 1')
+
+            for data in stream():
+                ... """
+
+        if not 2 <= block <= 512:
+            raise RuntimeError('block has to fit in half of the buffer: {}'.format(block))
+        self.block = int(block)
+        with self.batch():
+            self.voltmeter_trig_setup('imm', 'inf')
+            self.voltmeter_buffer_setup(2*self.block)
+            self.configure_serial(':calc2:stat', 'off')
+        self.write_serial('init:imm')
+
+    def stream(self, blocks = None, timeout = 10.0):
+
+        """ generator that yields numpy arrays of block readings until
+            blocks of them have been read (forever with blocks = None).
+
+            the buffer is read as soon as the 2182A says it is half full
+            (B8) and started again right after the query, so every reading
+            goes over the serial port once and the buffer fills while the
+            last one is read. readings are only lost in the moment between
+            the query and the restart.
+
+            the read has to keep up with the readings: at 19200 baud that is
+            about 2ms per reading with 'sreal' and 8ms with 'asc'. """
+
+        half = self.block*self.reading_time()
+        self.write_serial(':trac:feed:cont next', sync = False) #initiated, *OPC? would never return
+        restarted = time.time()
+        pending = np.zeros(0)
+        count = 0
+        while blocks is None or count < blocks:
+            filling = half - (time.time() - restarted) #it filled during the last read
+            instruments.wait_for(lambda: self.voltmeter_chk_meas_evnt_reg()[8], timeout, filling,
+                                 interval = min(0.05, self.reading_time()))
+            request = self.request_2182A_buffer(self.block, exact = False)
+            self.write_serial(':trac:feed:cont next', sync = False) #fill the buffer again right away
+            restarted = time.time()
+            readings = self.collect_2182A_buffer(request)
+            timing.add('integrating', len(readings)*self.integration_time())
+            pending = np.concatenate([pending, readings])
+            while len(pending) >= self.block and (blocks is None or count < blocks):
+                yield pending[:self.block]
+                pending = pending[self.block:]
+                count += 1
+
     def single_point_setup(self, avg, delay):
     
         """ gets one measurement at a time, tries to optimize usage of the
@@ -436,25 +576,49 @@ class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
                 data[i] = get_meas()    
                 
             make sure to call get_meas() not either of the get_avg_
-            functions. """
+            functions. single reads or the buffer, whichever is faster
+            for this avg, see avg_crossover. """
         
-        if avg < 6: #this cutoff is pretty accurate, based on a quick test
-            self.voltmeter_trig_setup('imm', 'inf')
-            self.avg = int(avg)
-            self.delay = delay
-            self.get_meas = self.get_avg_single
-            
-        elif avg > 1024:
+        if avg > 1024:
             print 'don\'t be ridiculous.'
             raise RuntimeError('buffer is not that big!')
-        
-        else:
-            self.voltmeter_trig_setup('imm', 'inf', delay)
-            self.voltmeter_buffer_setup(avg)
-            self.write_serial(':calc2:form mean')
-            self.write_serial(':calc2:stat on')
-            self.get_meas = self.get_avg_buffer
-        self.write_serial('init:imm')
+
+        self.avg_setup(avg, delay, avg >= self.avg_crossover(delay))
+
+    def avg_setup(self, avg, delay, buffered):
+
+        """ set up get_meas() to average avg single reads, or avg readings
+            in the buffer with buffered = True. use single_point_setup
+            unless you want to force one of them. """
+
+        self.avg = int(avg)
+        self.delay = delay
+        with self.batch():
+            if not buffered:
+                self.voltmeter_trig_setup('imm', 'inf')
+                self.get_meas = self.get_avg_single
+            else:
+                self.voltmeter_trig_setup('imm', 'inf', delay)
+                self.voltmeter_buffer_setup(avg)
+                self.configure_serial(':calc2:form', 'mean')
+                self.configure_serial(':calc2:stat', 'on')
+                self.get_meas = self.get_avg_buffer
+            self.write_serial('init:imm')
+
+    def avg_crossover(self, delay, recalibrate = False):
+
+        """ the smallest avg for which averaging in the buffer is faster than
+            averaging single reads, for the channel settings of the 2182A and
+            this delay. it is timed the first time (a few seconds) and kept
+            in calibration.calibration_file after that. """
+
+        channel = sorted((key, value) for key, value in self.shadow_state('serial').items()
+                         if key.startswith('sens'))
+        key = '{0} {1} delay={2:.3f} {3}'.format(type(self).__name__, self.resource_name, delay,
+                                                 ' '.join('{0}={1}'.format(*c) for c in channel))
+        measure = lambda: calibration.avg_crossover(lambda avg, buffered: self.avg_setup(avg, delay, buffered),
+                                                    lambda: self.get_meas())
+        return calibration.lookup(key, measure, recalibrate)
         
     # def _test_(source, bias, nplc = 1.0, nvmRange = 0.1)
        
@@ -466,7 +630,7 @@ class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
         # daqGate.create_analog_voltage_channel('Dev1/ao0', min_val = -10.0, max_val = 10.0)
         
         # gateBuffer = tools.get_buffer_size(gateLim[0], gateLim[1], gateLim[2])
-        # fill, points = tools.buffer_split(gateBuffer) #important if gateBuffer>1024
+        # plan = tools.plan_sweep(gateLim[0], gateLim[1], gateLim[2]) #important if gateBuffer>1024
         # gates = np.linspace(gateLim[0], gateLim[1], gateBuffer)
         
         # FixedBias.general_setup(source)
@@ -477,14 +641,14 @@ class FixedBias(instruments.K6220_2182A): #takes a gpib address as an argument
         # source.write(":outp 1")
         
         # data = np.zeros(gateBuffer)
-        # gates = gates.reshape(fill, points) #resize if multiple reads are needed
+        # gates = np.split(gates, np.cumsum(plan.chunks)[:-1]) #split if multiple reads are needed
         # for i, row in enumerate(gates):
             # source.write_serial(":trac:feed:cont next")
             # for gate in row:
                 # daqGate.write(gate/gateAmp)
                 # time.sleep(gateDelay)
                 # source.write_serial("*TRG")
-            # data[i*points:(i+1)*points] = np.array(source.read_2182A_buffer())
+            # data[plan.chunks[0]*i:plan.chunks[0]*i+len(row)] = np.array(source.read_2182A_buffer())
         # np.savetxt(file, [np.insert(data, 0, run+1)], fmt = '%+.6e', delimiter = '\t')
         
 if __name__ == "__main__":
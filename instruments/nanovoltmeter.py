@@ -5,6 +5,7 @@
 from __future__ import division
 import time
 import instruments #creates the source object
+import calibration, timing
     
 class SinglePoint(instruments.K2182): #takes the gpib address as an argument
 
@@ -28,12 +29,14 @@ class SinglePoint(instruments.K2182): #takes the gpib address as an argument
             'RST;*CLS' -- reset and clear 6220
             '*RST;*CLS;:abor' -- reset, clear, abort previous 2182
             ':syst:beep:stat {}' -- turn off/on beep 6220+2182
-            ':disp:enab {}' -- turn off/on the display 6220+2182 """
+            ':disp:enab {}' -- turn off/on the display 6220+2182
+
+            the reset is skipped if nothing has changed since the last
+            general_setup, see reset_voltmeter """
             
-        self.write("*RST;*CLS;:abor")
-        time.sleep(1.0)
-        self.write(":syst:beep:stat {0:d}".format(beep))
-        self.write(":disp:enab {0:d}".format(display))
+        self.reset_voltmeter()
+        self.configure(":syst:beep:stat", "{0:d}".format(beep))
+        self.configure(":disp:enab", "{0:d}".format(display))
         
     def trig_setup(self, trigSour, trigCoun, delay = 'auto'):
 
@@ -45,13 +48,13 @@ class SinglePoint(instruments.K2182): #takes the gpib address as an argument
             delay time can also be specified manually 
             ':init:imm' -- initiate trigger layer """
 
-        self.write(':trig:sour {}'.format(trigSour))
-        self.write(':trig:coun {}'.format(trigCoun))
+        self.configure(':trig:sour', '{}'.format(trigSour))
+        self.configure(':trig:coun', '{}'.format(trigCoun))
         if delay == 'auto':
-            self.write(':trig:del:auto on')
+            self.configure(':trig:del:auto', 'on')
         else:
-            self.write(':trig:del:auto off')
-            self.write(':trig:del {0:.3f}'.format(delay))
+            self.configure(':trig:del:auto', 'off')
+            self.configure(':trig:del', '{0:.3f}'.format(delay))
             
     def buffer_setup(self, bufferSize):
 
@@ -61,9 +64,8 @@ class SinglePoint(instruments.K2182): #takes the gpib address as an argument
             ':trac:feed sens1; poin {}' -- buffer to read channel 1/set size """
 
         self.write(":trac:cle") #clear buffer
-        self.write(':trac:feed sens1')
-        self.write('trac:poin {0:.0f}'.format(bufferSize))
-        time.sleep(0.25)
+        self.configure(':trac:feed', 'sens1')
+        self.configure(':trac:poin', '{0:.0f}'.format(bufferSize))
         
     def bus_trig_setup(self, bufferSize):
     
@@ -94,6 +96,7 @@ class SinglePoint(instruments.K2182): #takes the gpib address as an argument
         for _ in range(self.avg):
             time.sleep(self.delay)
             data.append(float(self.ask('sens:data?')))
+        timing.add('integrating', self.avg*self.integration_time())
         return sum(data)/len(data)
             
     def get_avg_buffer(self):
@@ -102,7 +105,8 @@ class SinglePoint(instruments.K2182): #takes the gpib address as an argument
             definition to define get_meas() """
             
         self.write('trac:feed:cont next') #this works
-        while not self.chk_meas_evnt_reg()[9]: pass
+        self.wait_for_buffer(predicted = self.avg*(self.delay + self.integration_time()))
+        timing.add('integrating', self.avg*self.integration_time())
         return self.ask('calc2:imm?')
     
     def single_point_setup(self, avg, delay):
@@ -121,22 +125,43 @@ class SinglePoint(instruments.K2182): #takes the gpib address as an argument
                 data[i] = get_meas()    
                 
             make sure to call get_meas() not either of the get_avg_
-            functions. """
+            functions. single reads or the buffer, whichever is faster
+            for this avg, see avg_crossover. """
         
-        if avg < 10: #this cutoff is pretty accurate, based on a quick test
-            self.trig_setup('imm', 'inf')
-            self.avg = int(avg)
-            self.delay = delay
-            self.get_meas = self.get_avg_single
-            
-        elif avg > 1024:
+        if avg > 1024:
             print 'don\'t be ridiculous.'
             raise RuntimeError('buffer is not that big!')
-        
+
+        self.avg_setup(avg, delay, avg >= self.avg_crossover(delay))
+
+    def avg_setup(self, avg, delay, buffered):
+
+        """ set up get_meas() to average avg single reads, or avg readings
+            in the buffer with buffered = True. use single_point_setup
+            unless you want to force one of them. """
+
+        self.avg = int(avg)
+        self.delay = delay
+        if not buffered:
+            self.trig_setup('imm', 'inf')
+            self.get_meas = self.get_avg_single
         else:
             self.trig_setup('imm', 'inf', delay)
             self.buffer_setup(avg)
-            self.write(':calc2:form mean')
-            self.write(':calc2:stat on')
+            self.configure(':calc2:form', 'mean')
+            self.configure(':calc2:stat', 'on')
             self.get_meas = self.get_avg_buffer
         self.write('init:imm')
+
+    def avg_crossover(self, delay, recalibrate = False):
+
+        """ the smallest avg for which averaging in the buffer is faster than
+            averaging single reads, for the settings from channel_setup and
+            this delay. it is timed the first time (a few seconds) and kept
+            in calibration.calibration_file after that. """
+
+        key = '{0} {1} delay={2:.3f} {3}'.format(type(self).__name__, self.resource_name,
+                                                 delay, self.channel_settings)
+        measure = lambda: calibration.avg_crossover(lambda avg, buffered: self.avg_setup(avg, delay, buffered),
+                                                    lambda: self.get_meas())
+        return calibration.lookup(key, measure, recalibrate)
@@ -0,0 +1,172 @@
+""" A pool of open instrument sessions and DAQ tasks that lasts as long as the
+    python session. Experiments run one after the other get the instruments
+    the last one left behind instead of opening and checking them again.
+
+    from instruments import pool
+
+    source = pool.acquire(keithleypair.FixedBias, "GPIB::22", timeout = 60.0)
+    gate = pool.acquire(nidaqmx.AnalogOutputTask, 'Dev1/ao0', min_val = -10.0, max_val = 10.0)
+    ...
+    pool.release(source, gate)
+
+    or
+
+    with pool.lease(keithleypair.IVmax1024, "GPIB::22") as source:
+        ...
+
+    Only one handle per address (GPIB resource or DAQ channel) is leased out
+    at a time. The keyword arguments are only used when a new session has to
+    be opened, a pooled one comes back the way it was left. """
+
+import threading, time
+from contextlib import contextmanager
+from backend import visa
+
+class SessionPool(object):
+
+    """ open sessions by (class, address), handed out one at a time per
+        address. an idle session is checked with its healthy() function, if
+        it has one, before it goes out again. a session that fails the check
+        is closed and a new one is opened in its place. """
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.idle = {} #(class, address) -> session
+        self.leases = {} #address -> (session, thread)
+
+    def acquire(self, cls, address, wait = 0.0, **keyw):
+
+        """ lease the session of type cls at address, opening it if needed.
+            waits up to wait seconds if another experiment has the address.
+            a lease held by the calling thread or a thread that has finished
+            is taken back, that run ended without releasing it. """
+
+        start_time = time.time()
+        with self.lock:
+            while address in self.leases:
+                session, thread = self.leases[address]
+                if thread is threading.current_thread() or not thread.is_alive():
+                    del self.leases[address]
+                    if session is not None:
+                        self.idle[(type(session), address)] = session
+                    break
+                remaining = wait - (time.time() - start_time)
+                if remaining <= 0:
+                    raise RuntimeError('{} is in use'.format(address))
+                self.lock.wait(remaining)
+            session = self.idle.pop((cls, address), None)
+            self.leases[address] = (session, threading.current_thread()) #hold the address while opening
+        try:
+            if session is not None and not healthy(session):
+                print '{} failed its check, reopening.'.format(address)
+                close(session)
+                session = None
+            if session is None:
+                session = open_session(cls, address, keyw)
+        except Exception:
+            with self.lock:
+                del self.leases[address]
+                self.lock.notify_all()
+            raise
+        with self.lock:
+            self.leases[address] = (session, threading.current_thread())
+        return session
+
+    def release(self, *sessions):
+
+        """ give sessions back to the pool, they stay open """
+
+        with self.lock:
+            for session in sessions:
+                for address, (leased, thread) in self.leases.items():
+                    if leased is session:
+                        del self.leases[address]
+                        self.idle[(type(session), address)] = session
+            self.lock.notify_all()
+
+    def discard(self, *sessions):
+
+        """ close sessions instead of giving them back, e.g. after an error
+            that leaves the instrument in an unknown state """
+
+        with self.lock:
+            for session in sessions:
+                for address, (leased, thread) in self.leases.items():
+                    if leased is session:
+                        del self.leases[address]
+                close(session)
+            self.lock.notify_all()
+
+    @contextmanager
+    def lease(self, cls, address, wait = 0.0, **keyw):
+
+        """ acquire() for a with block, released at the end of it """
+
+        session = self.acquire(cls, address, wait = wait, **keyw)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def is_open(self, cls, address):
+
+        """ is there an idle session of type cls at address, one acquire()
+            would hand out without opening it """
+
+        with self.lock:
+            return (cls, address) in self.idle
+
+    def peek(self, cls, address):
+
+        """ the idle session of type cls at address, or None. only for
+            looking at the state it was left in, it is not leased out and
+            nothing should be sent to it. """
+
+        with self.lock:
+            return self.idle.get((cls, address))
+
+    def close_all(self):
+
+        """ close every idle session. leased ones are left alone. """
+
+        with self.lock:
+            sessions, self.idle = self.idle.values(), {}
+        for session in sessions:
+            close(session)
+
+def open_session(cls, address, keyw):
+
+    """ GPIB instruments take the address, DAQ tasks get a voltage channel """
+
+    if hasattr(cls, 'create_voltage_channel'):
+        session = cls()
+        session.create_voltage_channel(address, **keyw)
+        return session
+    return cls(address, **keyw)
+
+def healthy(session):
+    check = getattr(session, 'healthy', None)
+    if check is None:
+        return True
+    try:
+        return check()
+    except (visa.VisaIOError, RuntimeError, ValueError):
+        return False
+
+def close(session):
+    try:
+        if hasattr(session, 'create_voltage_channel'):
+            session.clear() #DAQ task
+        else:
+            session.close()
+    except Exception, err:
+        print 'ERROR: could not close {0}: {1}'.format(session, err)
+
+sessions = SessionPool() #the one for the whole process
+acquire = sessions.acquire
+release = sessions.release
+discard = sessions.discard
+lease = sessions.lease
+close_all = sessions.close_all
+is_open = sessions.is_open
+peek = sessions.peek
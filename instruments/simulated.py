@@ -0,0 +1,1017 @@
+""" A simulated stand-in for PyVISA, pylibnidaqmx and msvcrt so that the
+    experiments can run (and be profiled) on a computer with no instruments
+    attached. Select it with the environment variable
+
+        MEASUREMENTS_BACKEND=sim
+
+    before anything from the instruments package is imported (see backend.py).
+
+    Each GPIB address is wired to a model of the instrument that lives there
+    in our lab. The models keep their state between sessions, just like the
+    real boxes, and every command costs about as much time as it does on the
+    real bus:
+
+    GPIB::22 -- Keithley 6220 current source with a 2182A nanovoltmeter on its
+                RS-232 port and trigger link (K6220_2182A, IVmax1024, FixedBias)
+    GPIB::7  -- Keithley 2182A connected directly through GPIB (K2182)
+    GPIB::20 -- Oxford IPS120-10 magnet power supply (oxford_magnet)
+    GPIB::24 -- Oxford ITC503 temperature controller (oxford_temp)
+
+    Timing is set by the latency dictionaries on the bus and on each model,
+    all in seconds (or baud). For example...
+
+        simulated.GPIB['write'] = 5e-3
+        simulated.device('GPIB::22').nvm.latency['baud'] = 9600
+
+    simulated.reset() throws away the state of every instrument. """
+
+import time, math, re, struct, threading, random, sys
+import numpy as np
+
+class VisaIOError(Exception):
+    pass
+
+# one GPIB transaction at a time, like the real bus
+bus_lock = threading.RLock()
+
+GPIB = {'write' : 1.5e-3,  # controller overhead for one write
+        'read'  : 1.5e-3,  # controller overhead for one read
+        'byte'  : 2e-6}    # transfer time per byte
+
+def _wait_until(t):
+    dt = t - time.time()
+    if dt > 0:
+        time.sleep(dt)
+
+def _split_message(message):
+
+    """ split a message at semicolons that are not inside quotes """
+
+    parts, quoted, start = [], False, 0
+    for i, c in enumerate(message):
+        if c == '"':
+            quoted = not quoted
+        elif c == ';' and not quoted:
+            parts.append(message[start:i])
+            start = i+1
+    parts.append(message[start:])
+    return parts
+
+def _short_node(node):
+
+    """ reduce a SCPI keyword to its short form: ':SENSe1:VOLTage' -> 'sens:volt' """
+
+    m = re.match(r'([a-z]+)(\d*)(\??)$', node.lower())
+    if not m:
+        return node.lower()
+    name, suffix, query = m.groups()
+    if len(name) > 4:
+        name = name[:3] if name[3] in 'aeiou' else name[:4]
+    if suffix == '1':
+        suffix = ''
+    return name+suffix+query
+
+def parse_scpi(message):
+
+    """ split a SCPI program message into a list of (header, argument) pairs
+        with the full short-form path of every header. commands after a ';'
+        that do not start with ':' belong to the same subsystem as the last
+        command, as in ':trac:feed sens1; poin 10' """
+
+    commands, path = [], []
+    for part in _split_message(message):
+        part = part.strip()
+        if not part:
+            continue
+        header, _, arg = part.partition(' ')
+        if header.startswith('*'):
+            commands.append((header.lower(), arg.strip()))
+            continue
+        nodes = [_short_node(n) for n in header.lstrip(':').split(':')]
+        if not header.startswith(':'):
+            nodes = path + nodes
+        path = nodes[:-1]
+        commands.append((':'.join(nodes), arg.strip()))
+    return commands
+
+def _bool(arg):
+    return arg.strip().lower() in ('1', 'on')
+
+def _bits(bits):
+    return sum(1 << b for b in bits)
+
+class Device(object):
+
+    """ base class for the instrument models. a model receives the messages
+        written to its address and queues up responses with the time at
+        which each one is ready to be read. """
+
+    latency = {'process' : 1e-3}
+
+    def __init__(self, **latency):
+        self.latency = dict(self.latency, **latency)
+        self.lock = threading.RLock()
+        self.output = []
+        self.reset()
+
+    def reset(self):
+        pass
+
+    def handle(self, message, now):
+
+        """ process one message, return a response string, a tuple of
+            (ready time, response) or None """
+
+        raise NotImplementedError
+
+    def receive(self, message, now):
+        with self.lock:
+            response = self.handle(message, now)
+            if response is None:
+                return
+            if isinstance(response, tuple):
+                ready, response = response
+            else:
+                ready = now + self.latency['process']
+            self.output.append((ready, response))
+
+    def respond(self, now):
+        with self.lock:
+            if not self.output:
+                return None
+            return self.output.pop(0)
+
+class SCPIDevice(Device):
+
+    """ a SCPI instrument. every header is dispatched to a method named after
+        it, e.g. ':trac:poin' -> self.scpi_trac_poin(arg, now). headers without
+        a method are remembered as plain settings and returned when queried. """
+
+    idn = 'SIMULATED,SCPI,0,0'
+
+    def reset(self):
+        self.settings = {}
+        self.event_status = 0
+        self.ese = 0
+        self.sre = 0
+
+    def handle(self, message, now):
+        self.update(now)
+        responses, ready = [], now + self.latency['process']
+        for header, arg in parse_scpi(message):
+            name = 'scpi_' + header.replace('*', 'star_').replace(':', '_').rstrip('?')
+            if header.endswith('?'):
+                name += '_query'
+            method = getattr(self, name, None)
+            if method is not None:
+                result = method(arg, now)
+            elif header.endswith('?'):
+                result = self.settings.get(header.rstrip('?'), '0')
+            else:
+                self.settings[header] = arg.lower()
+                result = None
+            if isinstance(result, tuple):
+                ready = max(ready, result[0])
+                result = result[1]
+            if result is not None:
+                responses.append(result)
+        if responses:
+            return ready, ';'.join(responses)
+
+    def update(self, now):
+
+        """ bring the model up to time now """
+
+        pass
+
+    def status_byte(self, now):
+        return 0
+
+    def scpi_star_rst(self, arg, now):
+        self.reset()
+
+    def scpi_star_cls(self, arg, now):
+        self.event_status = 0
+
+    def scpi_star_idn_query(self, arg, now):
+        return self.idn
+
+    def scpi_star_opc_query(self, arg, now):
+        return '1'
+
+    def scpi_star_sre(self, arg, now):
+        self.sre = int(float(arg))
+
+    def scpi_star_sre_query(self, arg, now):
+        return str(self.sre)
+
+    def scpi_star_stb_query(self, arg, now):
+        return str(self.status_byte(now))
+
+class K2182Model(SCPIDevice):
+
+    """ Keithley 2182A nanovoltmeter. it measures the voltage across a resistor
+        carrying the current given by self.source(t), plus some noise. """
+
+    idn = 'KEITHLEY INSTRUMENTS INC.,MODEL 2182A,0000000,C02 (simulated)'
+    latency = {'process' : 2e-3,    # command parser
+               'reading' : 2.5e-3,  # fixed overhead per reading
+               'baud'    : 19200}   # RS-232 rate when used through the 6220
+    line_frequency = 60.0
+    resistance = 1.0e3
+    noise = 20e-9
+    buffer_limit = 1024
+
+    def __init__(self, **latency):
+        self.source = lambda t: 0.0
+        super(K2182Model, self).__init__(**latency)
+
+    def reset(self):
+        super(K2182Model, self).reset()
+        self.nplc = 5.0
+        self.filter_count = 10
+        self.digital_filter = False
+        self.trig_source = 'imm'
+        self.trig_delay = 0.0
+        self.initiated = False
+        self.buffer = []
+        self.points = 2
+        self.feed = 'never'
+        self.data_format = 'asc'
+        self.byte_order = 'swap'
+        self.calc = False
+        self.meas_enable = 0
+        self.meas_event = 0
+        self.last = None
+        self._now = 0.0
+        self._run_start = None
+        self._taken = 0
+        self._scheduled = []
+        self.opc_pending = False
+
+    def reading_time(self):
+
+        """ time for one triggered reading with the current settings """
+
+        t = self.nplc/self.line_frequency + self.latency['reading'] + self.trig_delay
+        if self.digital_filter:
+            t *= self.filter_count
+        return t
+
+    def _measure(self, t, current = None):
+        if current is None:
+            current = self.source(t)
+        self.last = current*self.resistance + random.gauss(0.0, self.noise)
+
+    def _store(self, t, current = None):
+        self._measure(t, current)
+        if self.feed == 'next' and len(self.buffer) < self.points:
+            self.buffer.append(self.last)
+            if len(self.buffer) >= self.points:
+                self.feed = 'never'
+        self.meas_event |= self.condition()
+
+    def update(self, now):
+        if now <= self._now:
+            return
+        self._now = now
+        if self._scheduled:
+            due = [s for s in self._scheduled if s[0] <= now]
+            self._scheduled = [s for s in self._scheduled if s[0] > now]
+            for t, current in due:
+                if self.initiated:
+                    self._store(t, current)
+        if self.initiated and self.trig_source == 'imm' and self._run_start is not None:
+            period = self.reading_time()
+            total = int((now - self._run_start)/period)
+            if self.feed == 'next':
+                last = min(total, self._taken + self.points - len(self.buffer))
+                for k in range(self._taken, last):
+                    self._store(self._run_start + (k+1)*period)
+                self._taken = last
+            if total > self._taken:
+                self._measure(self._run_start + total*period) #not stored
+            self._taken = total
+
+    def schedule(self, times, currents):
+
+        """ readings triggered externally through the trigger link """
+
+        if self.initiated and self.trig_source in ('ext', 'tlin'):
+            self._scheduled.extend(zip(times, currents))
+            self._scheduled.sort()
+
+    def condition(self):
+        n = len(self.buffer)
+        bits = []
+        if self.last is not None: bits.append(5)
+        if n >= 2: bits.append(7)
+        if n >= self.points/2.0: bits.append(8)
+        if n >= self.points: bits.append(9)
+        return _bits(bits)
+
+    def status_byte(self, now):
+        self.update(now)
+        stb = 0
+        if self.meas_event & self.meas_enable:
+            stb |= 1
+        if stb & self.sre & ~64:
+            stb |= 64
+        return stb
+
+    def srq_time(self, now):
+
+        """ time at which the buffer full/half full SRQ will be asserted """
+
+        if not (self.sre & 1):
+            return None
+        self.update(now)
+        if self.meas_event & self.meas_enable: #latched, until read or *CLS
+            return now
+        if not self.initiated or self.feed != 'next':
+            return None
+        remaining = self.points - len(self.buffer)
+        if self.meas_enable & _bits([8]):
+            remaining = int(math.ceil(self.points/2.0)) - len(self.buffer)
+        elif not self.meas_enable & _bits([9]):
+            return None
+        if self.trig_source == 'imm' and self._run_start is not None:
+            return now + max(remaining, 0)*self.reading_time()
+        if self.trig_source in ('ext', 'tlin') and len(self._scheduled) >= remaining > 0:
+            return self._scheduled[remaining-1][0]
+        return None
+
+    def format_buffer(self):
+        values = self.buffer
+        if self.calc:
+            values = [sum(values)/len(values)] if values else []
+        if self.data_format == 'asc':
+            return ','.join('{:+.8E}'.format(v) for v in values)
+        code = '>' if self.byte_order == 'norm' else '<'
+        code += 'f' if self.data_format == 'sre' else 'd'
+        return b'#0' + b''.join(struct.pack(code, v) for v in values)
+
+    def start_run(self, now):
+        self._run_start = now
+        self._taken = 0
+
+    def armed(self):
+
+        """ initiated with an infinite trigger count, the operation never
+            completes """
+
+        return self.initiated and self.settings.get('trig:coun', '1').startswith('inf')
+
+    def complete(self):
+
+        """ the answer to a *OPC? held back while armed, once the trigger
+            layer is idle again """
+
+        pending, self.opc_pending = self.opc_pending, False
+        return '1' if pending else None
+
+    def scpi_star_rst(self, arg, now):
+        pending = self.complete()
+        self.reset()
+        self._now = now
+        return pending
+
+    def scpi_star_cls(self, arg, now):
+        self.event_status = 0
+        self.meas_event = 0
+
+    def scpi_star_opc_query(self, arg, now):
+        if self.armed():
+            self.opc_pending = True #no answer until :abor or *RST
+            return None
+        return '1'
+
+    def scpi_star_trg(self, arg, now):
+        if self.initiated and self.trig_source == 'bus':
+            self._scheduled.append((now + self.reading_time(), self.source(now)))
+
+    def scpi_abor(self, arg, now):
+        self.initiated = False
+        self._scheduled = []
+        return self.complete()
+
+    def scpi_init(self, arg, now):
+        self.initiated = True
+        self.start_run(now)
+
+    scpi_init_imm = scpi_init
+
+    def scpi_sens_volt_nplc(self, arg, now):
+        self.nplc = float(arg)
+        self.start_run(now)
+
+    def scpi_sens_volt_dfil(self, arg, now):
+        self.digital_filter = _bool(arg)
+
+    def scpi_sens_volt_dfil_coun(self, arg, now):
+        self.filter_count = int(float(arg))
+
+    def scpi_sens_data_query(self, arg, now):
+        if self.last is None:
+            return now + self.reading_time(), '{:+.8E}'.format(self.source(now)*self.resistance)
+        return '{:+.8E}'.format(self.last)
+
+    scpi_sens_data_fres_query = scpi_sens_data_query
+
+    def scpi_trig_sour(self, arg, now):
+        self.trig_source = arg.lower()[:3]
+        self.start_run(now)
+
+    def scpi_trig_del(self, arg, now):
+        self.trig_delay = float(arg)
+
+    def scpi_trig_del_auto(self, arg, now):
+        if _bool(arg):
+            self.trig_delay = 0.0
+
+    def scpi_trac_cle(self, arg, now):
+        self.buffer = []
+        self._taken = int((now - self._run_start)/self.reading_time()) \
+                      if self._run_start is not None else 0
+
+    def scpi_trac_feed(self, arg, now):
+        self.settings['trac:feed'] = arg.lower()
+
+    def scpi_trac_poin(self, arg, now):
+        self.points = max(2, min(self.buffer_limit, int(float(arg))))
+
+    def scpi_trac_poin_query(self, arg, now):
+        return str(self.points)
+
+    def scpi_trac_poin_act_query(self, arg, now):
+        return str(len(self.buffer))
+
+    def scpi_trac_feed_cont(self, arg, now):
+        self.feed = arg.lower()[:4]
+        if self.feed == 'next': #the event register stays as it is
+            self.buffer = []
+            if self._run_start is not None:
+                self._taken = int((now - self._run_start)/self.reading_time())
+
+    def scpi_trac_free_query(self, arg, now):
+        used = 18*len(self.buffer)
+        return '{0},{1}'.format(18*self.buffer_limit - used, used)
+
+    def scpi_trac_data_query(self, arg, now):
+        return self.format_buffer()
+
+    def scpi_stat_meas_cond_query(self, arg, now):
+        return str(self.condition())
+
+    def scpi_stat_meas_even_query(self, arg, now):
+        event, self.meas_event = self.meas_event, 0
+        return str(event)
+
+    def scpi_stat_meas_enab(self, arg, now):
+        self.meas_enable = int(float(arg))
+
+    def scpi_calc2_form(self, arg, now):
+        self.settings['calc2:form'] = arg.lower()
+
+    def scpi_calc2_stat(self, arg, now):
+        self.calc = _bool(arg)
+
+    def scpi_calc2_imm_query(self, arg, now):
+        if not self.buffer:
+            return '{:+.8E}'.format(0.0)
+        return '{:+.8E}'.format(sum(self.buffer)/len(self.buffer))
+
+    def scpi_form_data(self, arg, now):
+        self.data_format = arg.lower()[:3]
+
+    def scpi_form_bord(self, arg, now):
+        self.byte_order = arg.lower()[:4]
+
+class K6220Model(SCPIDevice):
+
+    """ Keithley 6220 current source with a 2182A (self.nvm) connected to
+        its RS-232 port and trigger link. """
+
+    idn = 'KEITHLEY INSTRUMENTS INC.,MODEL 6220,0000000,A03 (simulated)'
+    latency = {'process'     : 1e-3,   # command parser
+               'trigger'     : 1e-3,   # trigger link round trip per point
+               'ser_timeout' : 1.0,    # :syst:comm:ser:ent? gives up after this
+               'ser_chunk'   : 256}    # bytes returned by one :syst:comm:ser:ent?
+
+    def __init__(self, **latency):
+        self.nvm = K2182Model()
+        self.nvm.source = self.current_at
+        self._serial_tx = 0.0
+        self._serial_rx = []
+        super(K6220Model, self).__init__(**latency)
+
+    def reset(self):
+        super(K6220Model, self).reset()
+        self.output_on = False
+        self.level = 0.0
+        self.sweep = {'start' : 0.0, 'stop' : 0.0, 'step' : 0.0, 'coun' : 1,
+                      'del' : 1e-3}
+        self.armed = False
+        self.running = None
+        self.oper_event = 0
+        self.oper_enable = 0
+
+    def points(self):
+        s = self.sweep
+        if s['step'] == 0.0:
+            return 1
+        return int(math.floor(abs((s['stop'] - s['start'])/s['step']) + 1e-9)) + 1
+
+    def current_at(self, t):
+        if self.running is not None:
+            t0, period, n = self.running
+            k = int((t - t0)/period)
+            if 0 <= k < n:
+                return self.sweep['start'] + (k % self.points())*self.sweep['step']
+        return self.level if self.output_on else 0.0
+
+    def update(self, now):
+        if self.running is not None:
+            t0, period, n = self.running
+            if now >= t0 + n*period:
+                self.running = None
+                self.oper_event |= _bits([1])
+
+    def status_byte(self, now):
+        self.update(now)
+        stb = 0
+        if self.oper_event & self.oper_enable:
+            stb |= 128
+        if stb & self.sre:
+            stb |= 64
+        return stb
+
+    def srq_time(self, now):
+
+        """ time at which the sweep done SRQ will be asserted """
+
+        self.update(now)
+        if not (self.sre & 128) or not (self.oper_enable & _bits([1])):
+            return None
+        if self.oper_event & _bits([1]):
+            return now
+        if self.running is not None:
+            t0, period, n = self.running
+            return t0 + n*period
+        return None
+
+    def scpi_star_rst(self, arg, now):
+        self.reset()
+
+    def scpi_star_cls(self, arg, now):
+        self.event_status = 0
+        self.oper_event = 0
+
+    def scpi_outp(self, arg, now):
+        self.output_on = _bool(arg)
+
+    def scpi_outp_query(self, arg, now):
+        return '{0:d}'.format(self.output_on)
+
+    def scpi_sour_curr(self, arg, now):
+        self.level = float(arg)
+
+    def scpi_sour_curr_star(self, arg, now):
+        self.sweep['start'] = float(arg)
+
+    def scpi_sour_curr_stop(self, arg, now):
+        self.sweep['stop'] = float(arg)
+
+    def scpi_sour_curr_step(self, arg, now):
+        self.sweep['step'] = float(arg)
+
+    def scpi_sour_del(self, arg, now):
+        self.sweep['del'] = float(arg)
+
+    def scpi_sour_swe_coun(self, arg, now):
+        self.sweep['coun'] = int(float(arg))
+
+    def scpi_sour_swe_poin_query(self, arg, now):
+        return str(self.points())
+
+    def scpi_sour_swe_arm(self, arg, now):
+        self.armed = True
+        self.output_on = True
+
+    def scpi_sour_swe_abor(self, arg, now):
+        self.running = None
+        self.armed = False
+
+    def scpi_syst_key(self, arg, now):
+        if int(float(arg)) == 13 and self.armed:
+            self.start_sweep(now)
+
+    def start_sweep(self, now):
+        n = self.points()*self.sweep['coun']
+        period = self.sweep['del'] + self.latency['trigger']
+        if self.settings.get('trig:sour', '') == 'tlin':
+            period += self.nvm.reading_time()
+        self.running = (now, period, n)
+        self.oper_event |= _bits([3])
+        times = [now + k*period + self.sweep['del'] for k in range(n)]
+        currents = [self.sweep['start'] + (k % self.points())*self.sweep['step']
+                    for k in range(n)]
+        self.nvm.update(now)
+        self.nvm.schedule(times, currents)
+
+    def scpi_stat_oper_even_query(self, arg, now):
+        event, self.oper_event = self.oper_event, 0
+        if self.running is not None:
+            event |= _bits([3])
+        return str(event)
+
+    def scpi_stat_oper_enab(self, arg, now):
+        self.oper_enable = int(float(arg))
+
+    def scpi_sour_dcon_nvpr_query(self, arg, now):
+        return '1'
+
+    def scpi_syst_comm_ser_send(self, arg, now):
+
+        """ pass a message through to the 2182A at the serial baud rate """
+
+        message = arg.strip()
+        if message.startswith('"') and message.endswith('"'):
+            message = message[1:-1]
+        byte_time = 10.0/self.nvm.latency['baud']
+        start = max(now, self._serial_tx)
+        arrival = start + (len(message)+1)*byte_time
+        self._serial_tx = arrival
+        with self.nvm.lock:
+            self.nvm.receive(message, arrival)
+            while self.nvm.output:
+                ready, response = self.nvm.output.pop(0)
+                rx_start = max(ready, self._serial_rx[-1][1] if self._serial_rx else 0.0)
+                payload = response + b'\n'
+                self._serial_rx.append([rx_start, rx_start + len(payload)*byte_time, payload, 0])
+
+    def scpi_syst_comm_ser_ent_query(self, arg, now):
+
+        """ return the next chunk of data received from the 2182A. waits for
+            the rest of the chunk to come in over RS-232. """
+
+        if not self._serial_rx:
+            return now + self.latency['ser_timeout'], ''
+        rx_start, rx_end, payload, pos = self._serial_rx[0]
+        chunk = payload[pos:pos + self.latency['ser_chunk']]
+        byte_time = (rx_end - rx_start)/len(payload)
+        ready = rx_start + (pos + len(chunk))*byte_time
+        if pos + len(chunk) >= len(payload):
+            self._serial_rx.pop(0)
+        else:
+            self._serial_rx[0][3] = pos + len(chunk)
+        return max(ready, now + self.latency['process']), chunk
+
+    def update_nvm(self, now):
+        with self.nvm.lock:
+            self.nvm.update(now)
+
+    def handle(self, message, now):
+        self.update_nvm(now)
+        return super(K6220Model, self).handle(message, now)
+
+class OxfordDevice(Device):
+
+    """ the Oxford instruments answer every command with its first letter,
+        or '?' followed by the command if it was not understood """
+
+    latency = {'process' : 0.02}
+
+    def handle(self, message, now):
+        message = message.strip()
+        if not message:
+            return None
+        cmd, arg = message[0].upper(), message[1:]
+        method = getattr(self, 'cmd_' + cmd, None)
+        if method is None:
+            return '?' + message
+        response = method(arg, now)
+        if response is False:
+            return '?' + message
+        if cmd == 'Q':
+            return None
+        return cmd if response is None else response
+
+    def cmd_C(self, arg, now):
+        self.control = int(arg)
+
+    def cmd_Q(self, arg, now):
+        pass
+
+class IPS120Model(OxfordDevice):
+
+    """ Oxford IPS120-10 magnet power supply with a persistent switch. the
+        output field follows the set point at the sweep rate (T/min) """
+
+    latency = {'process' : 0.02,
+               'heater'  : 20.0}   # the switch heater really takes this long
+    err = 1e-5
+
+    def reset(self):
+        self.control = 2
+        self.rate = 0.2
+        self.target = 0.0
+        self.activity = 4 #clamped
+        self.heater = False
+        self.heater_changed = -1e9
+        self.persistent = 0.0
+        self._field = 0.0
+        self._now = time.time()
+
+    def update(self, now):
+        dt = now - self._now
+        if dt <= 0:
+            return
+        self._now = now
+        if self.activity in (1, 2):
+            goal = self.target if self.activity == 1 else 0.0
+            step = self.rate/60.0*dt
+            if abs(goal - self._field) <= step:
+                self._field = goal
+            else:
+                self._field += math.copysign(step, goal - self._field)
+        if self.heater and now - self.heater_changed >= self.latency['heater']:
+            self.persistent = self._field
+
+    def field(self, now):
+        self.update(now)
+        return self._field
+
+    def handle(self, message, now):
+        self.update(now)
+        return super(IPS120Model, self).handle(message, now)
+
+    def cmd_M(self, arg, now):
+        pass
+
+    def cmd_T(self, arg, now):
+        self.rate = float(arg)
+
+    def cmd_J(self, arg, now):
+        self.target = float(arg)
+
+    def cmd_A(self, arg, now):
+        self.activity = int(arg)
+
+    def cmd_H(self, arg, now):
+        if int(arg) == 1:
+            if abs(self._field - self.persistent) > self.err:
+                return False #won't open the switch with mismatched currents
+            self.heater, self.heater_changed = True, now
+        elif int(arg) == 2:
+            self.heater, self.heater_changed = True, now
+        else:
+            self.heater, self.heater_changed = False, now
+
+    def cmd_R(self, arg, now):
+        n = int(arg)
+        if n in (7, 8): #output field, set point
+            value = self._field if n == 7 else self.target
+        elif n == 18:
+            value = self.persistent
+        elif n == 9:
+            value = self.rate
+        else:
+            value = 0.0
+        return 'R{:+.5f}'.format(value)
+
+    def cmd_X(self, arg, now):
+        if self.heater:
+            h = 1
+        elif abs(self.persistent) > self.err:
+            h = 2
+        else:
+            h = 0
+        sweeping = self.activity in (1, 2) and \
+                   abs((self.target if self.activity == 1 else 0.0) - self._field) > 0.0
+        return 'X00A{0}C{1}H{2}M9{3}P03'.format(self.activity, self.control, h, int(sweeping))
+
+class ITC503Model(OxfordDevice):
+
+    """ Oxford ITC503 temperature controller with three sensors that relax
+        towards the set point """
+
+    latency = {'process' : 0.03}
+    tau = 60.0
+
+    def reset(self):
+        self.control = 2
+        self.setpoint = 4.2
+        self.temps = [4.2, 4.2, 4.2]
+        self._now = time.time()
+
+    def update(self, now):
+        dt = now - self._now
+        if dt <= 0:
+            return
+        self._now = now
+        f = math.exp(-dt/self.tau)
+        self.temps = [self.setpoint + (t - self.setpoint)*f for t in self.temps]
+
+    def handle(self, message, now):
+        self.update(now)
+        return super(ITC503Model, self).handle(message, now)
+
+    def cmd_T(self, arg, now):
+        self.setpoint = float(arg)
+
+    def cmd_R(self, arg, now):
+        n = int(arg)
+        if n == 0:
+            return 'R{:.3f}'.format(self.setpoint)
+        if 1 <= n <= 3:
+            return 'R{:.3f}'.format(self.temps[n-1] + random.gauss(0.0, 1e-3))
+        return False
+
+# instruments wired to each address, built the first time they are used
+models = {'GPIB::22' : K6220Model,
+          'GPIB::7'  : K2182Model,
+          'GPIB::20' : IPS120Model,
+          'GPIB::24' : ITC503Model}
+devices = {}
+
+def device(resource_name):
+
+    """ the model connected to resource_name """
+
+    name = resource_name.upper()
+    if name not in devices:
+        if name not in models:
+            raise VisaIOError('no simulated instrument at {}'.format(resource_name))
+        devices[name] = models[name]()
+    return devices[name]
+
+def reset():
+
+    """ forget the state of every simulated instrument and the DAQ """
+
+    devices.clear()
+    daq.reset()
+
+class GpibInstrument(object):
+
+    """ replaces visa.GpibInstrument. messages go to the model connected to
+        resource_name after the usual bus delays. """
+
+    def __init__(self, resource_name, timeout = 5.0, term_chars = None, **keyw):
+        self.resource_name = resource_name
+        self.timeout = timeout
+        self.term_chars = term_chars
+        self.device = device(resource_name)
+
+    def write(self, message):
+        with bus_lock:
+            time.sleep(GPIB['write'] + GPIB['byte']*len(message))
+            self.device.receive(message, time.time())
+
+    def read_raw(self):
+        with bus_lock:
+            response = self.device.respond(time.time())
+            if response is None:
+                time.sleep(self.timeout)
+                raise VisaIOError('VI_ERROR_TMO: Timeout expired before operation completed.')
+            ready, payload = response
+            if ready - time.time() > self.timeout:
+                time.sleep(self.timeout)
+                raise VisaIOError('VI_ERROR_TMO: Timeout expired before operation completed.')
+            _wait_until(ready)
+            time.sleep(GPIB['read'] + GPIB['byte']*len(payload))
+            return payload + '\n' #terminated with LF and EOI
+
+    def read(self):
+        return self.read_raw().rstrip('\r\n')
+
+    def ask(self, message):
+        self.write(message)
+        return self.read()
+
+    def wait_for_srq(self, timeout = 25.0):
+
+        """ block until the device asserts SRQ. this doesn't hold the bus,
+            the other instruments can talk in the meantime. """
+
+        srq_time = getattr(self.device, 'srq_time', None)
+        with self.device.lock:
+            ready = srq_time(time.time()) if srq_time else None
+        if ready is None or ready - time.time() > timeout:
+            time.sleep(timeout)
+            raise VisaIOError('VI_ERROR_TMO: Timeout expired before operation completed.')
+        _wait_until(ready)
+        time.sleep(GPIB['read']) #serial poll
+
+    @property
+    def stb(self):
+        with bus_lock:
+            time.sleep(GPIB['read'])
+            with self.device.lock:
+                return self.device.status_byte(time.time())
+
+    def clear(self):
+        with self.device.lock:
+            self.device.output = []
+
+    def close(self):
+        pass
+
+# a PCI-6259 with the analog outputs looped back through the sample
+
+class DAQModel(object):
+
+    latency = {'ao_write' : 0.5e-3,  # one software timed write
+               'ai_start' : 2e-3}    # starting a finite acquisition
+    noise = 1e-4
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ao = {}
+
+    def ai_voltage(self, channel):
+
+        """ the amplified current through the sample: bias on ao0 divided
+            by 1000 through 1 MOhm into a 1e-6 A/V amplifier """
+
+        return self.ao.get('Dev1/ao0', 0.0)*1e-3 + random.gauss(0.0, self.noise)
+
+daq = DAQModel()
+
+class _Task(object):
+
+    def __init__(self):
+        self.channels = []
+
+    def create_voltage_channel(self, phys_channel, terminal = 'default',
+                               min_val = -10.0, max_val = 10.0, **keyw):
+        self.channels.append(phys_channel)
+        self.limits = (min_val, max_val)
+
+    def alter_state(self, state):
+        pass
+
+    def clear(self):
+        pass
+
+class AnalogOutputTask(_Task):
+
+    """ replaces nidaqmx.AnalogOutputTask for software timed writes """
+
+    def write(self, data, auto_start = True, timeout = 10.0, layout = 'group_by_channel'):
+        values = np.ravel(np.asarray(data, dtype = float))
+        time.sleep(daq.latency['ao_write'])
+        for channel, value in zip(self.channels, values[-len(self.channels):]):
+            daq.ao[channel] = min(max(value, self.limits[0]), self.limits[1])
+        return len(values)
+
+class AnalogInputTask(_Task):
+
+    """ replaces nidaqmx.AnalogInputTask for finite, sample clock timed reads """
+
+    def __init__(self):
+        super(AnalogInputTask, self).__init__()
+        self.rate = 1000.0
+        self.samples = 1
+        self.started = None
+
+    def configure_timing_sample_clock(self, source = 'OnboardClock', rate = 1000.0,
+                                      active_edge = 'rising', sample_mode = 'finite',
+                                      samples_per_channel = 1000):
+        self.rate = float(rate)
+        self.samples = int(samples_per_channel)
+
+    def start(self):
+        time.sleep(daq.latency['ai_start'])
+        self.started = time.time()
+
+    def wait_until_done(self, timeout = 10.0):
+        if self.started is not None:
+            _wait_until(self.started + self.samples/self.rate)
+
+    def read(self, samples_per_channel = None, timeout = 10.0):
+        if self.started is None:
+            self.start()
+        self.wait_until_done(timeout)
+        data = np.array([[daq.ai_voltage(c) for c in self.channels]
+                         for _ in range(samples_per_channel or self.samples)])
+        return data
+
+    def stop(self):
+        self.started = None
+
+# msvcrt only exists on windows. these two stand in for it so that 'q' still
+# ends an experiment from a linux terminal.
+
+def kbhit():
+    try:
+        import select
+        return bool(sys.stdin.isatty() and select.select([sys.stdin], [], [], 0)[0])
+    except Exception:
+        return False
+
+def getch():
+    return sys.stdin.read(1)
@@ -0,0 +1,318 @@
+""" Counts and times every message to the instruments and every DAQ read and
+    write, split up by the phase of the experiment they happen in, and
+    writes a summary at the end of each run.
+
+    from instruments import timing
+
+    timing.enable() #or set MEASUREMENTS_TIMING=1 before the import
+    timing.start(filename+'.timing') #the experiment is in the setup phase
+    ...
+    for gate in gates:
+        timing.set_phase('settle')
+        daqGate.write([gate/gateAmp])
+        time.sleep(gateDelay)
+        timing.set_phase('acquire')
+        data = source.get_meas()
+        timing.set_phase('save')
+        np.savetxt(...)
+    timing.finish() #writes the summary
+
+    The experiments use the phases setup, settle, acquire, readout and
+    save. The experiment is in one phase at a time, with phase() a few
+    lines of library code can be put in another one (the buffer reads
+    inside execute_sweep are readout). Whatever time a phase spends
+    outside of instrument calls (sleeps, saving, plotting) shows up as
+    'other' in the summary.
+
+    The phases are always kept track of, only the calls are timed just
+    while enabled. Every run ends with an efficiency report, see
+    efficiency(): how much of the run the instruments spent integrating,
+    and where the rest went. It is also added as one line to
+    history_file in the same directory as the summary, with the version
+    of the code, to compare runs. """
+
+import os, re, time, bisect, threading, subprocess
+from contextlib import contextmanager
+from backend import visa, nidaqmx
+
+buckets = (1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1.0) #histogram bin edges in seconds
+enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_phase = ['other', 0.0] #the phase the experiment is in, since when
+_run = [None, 0.0] #summary file, start time
+_calls = {} #(phase, command) -> [count, seconds, longest, histogram]
+_phases = {} #phase -> [times entered, seconds]
+_wrapped = [] #(class, name, original method or None if it was inherited)
+_totals = {} #integrating, plotting... -> seconds, see add
+history_file = 'efficiency_history.txt' #one line per run, in the directory of the summary
+
+_serial = re.compile(r'\s*:?syst\w*:comm\w*:ser\w*:send\s+"(.*)"\s*$', re.I)
+_number = re.compile(r'(?<=[\s,])[-+]?\d+\.?\d*(e[-+]?\d+)?|[-+]?\d*\.\d+(e[-+]?\d+)?', re.I)
+
+def command_key(message):
+
+    """ what calls are grouped by: the message with its numbers replaced by
+        '#'. messages passed on to the 2182A are marked 'serial'. """
+
+    match = _serial.match(message)
+    prefix = 'serial ' if match else ''
+    message = match.group(1) if match else message
+    return (prefix + _number.sub('#', message.strip().lower()))[:60]
+
+def record(command, seconds):
+
+    """ add one call of command that took seconds to the current phase """
+
+    with _lock:
+        call = _calls.get((_phase[0], command))
+        if call is None:
+            call = _calls[(_phase[0], command)] = [0, 0.0, 0.0, [0]*(len(buckets) + 1)]
+        call[0] += 1
+        call[1] += seconds
+        call[2] = max(call[2], seconds)
+        call[3][bisect.bisect(buckets, seconds)] += 1
+
+def _timed(method, name, messages):
+
+    """ method, timed. calls made inside another timed call (the read of an
+        ask) only count as part of the outer one. a read is named after the
+        message it answers. """
+
+    def timed(self, *args, **keyw):
+        if getattr(_local, 'busy', False):
+            return method(self, *args, **keyw)
+        if messages and name in ('write', 'ask'):
+            command = _local.last = command_key(args[0] if args else keyw['message'])
+        elif messages and name in ('read', 'read_raw'):
+            command = getattr(_local, 'last', '') + ' (read)'
+        else:
+            command = '{0} {1}'.format(type(self).__name__, name)
+        _local.busy = True
+        start_time = time.time()
+        try:
+            return method(self, *args, **keyw)
+        finally:
+            _local.busy = False
+            record(command, time.time() - start_time)
+    timed.__name__ = method.__name__
+    timed.__doc__ = method.__doc__
+    return timed
+
+def _targets():
+
+    # (class, methods, are they named after their message)
+    yield visa.GpibInstrument, ('write', 'read', 'read_raw', 'ask', 'wait_for_srq'), True
+    if nidaqmx is not None:
+        yield nidaqmx.AnalogOutputTask, ('write',), False
+        yield nidaqmx.AnalogInputTask, ('start', 'read', 'wait_until_done'), False
+
+def enable():
+
+    """ start timing the instrument and DAQ calls """
+
+    global enabled
+    if enabled:
+        return
+    for cls, names, messages in _targets():
+        for name in names:
+            method = getattr(cls, name, None) #often defined on a base class
+            if method is not None:
+                _wrapped.append((cls, name, cls.__dict__.get(name))) #None if inherited
+                setattr(cls, name, _timed(getattr(method, 'im_func', method), name, messages))
+    enabled = True
+
+def disable():
+
+    """ put the instrument and DAQ calls back the way they were """
+
+    global enabled
+    while _wrapped:
+        cls, name, method = _wrapped.pop()
+        if method is None: #was inherited, uncover it again
+            delattr(cls, name)
+        else:
+            setattr(cls, name, method)
+    enabled = False
+
+def reset():
+
+    """ forget everything recorded so far """
+
+    with _lock:
+        _calls.clear()
+        _phases.clear()
+        _totals.clear()
+        _phase[:] = ['other', time.time()]
+
+def set_phase(name, enter = True):
+
+    """ the calls from now on belong to phase name, None for no phase.
+        enter = False doesn't count it as entering the phase again. """
+
+    now = time.time()
+    with _lock:
+        last = _phases.setdefault(_phase[0], [0, 0.0])
+        last[1] += now - _phase[1]
+        if name is not None:
+            _phases.setdefault(name, [0, 0.0])[0] += enter
+        _phase[:] = [name or 'other', now]
+
+@contextmanager
+def phase(name):
+
+    """ put the with block in phase name, then go back to the last one """
+
+    last = _phase[0]
+    set_phase(name)
+    try:
+        yield
+    finally:
+        set_phase(last, enter = False)
+
+def start(filename):
+
+    """ forget everything recorded so far and start a run in the setup
+        phase. finish() writes the summary to filename. """
+
+    reset()
+    _run[:] = [filename, time.time()]
+    set_phase('setup')
+
+def finish():
+
+    """ end the run, write its summary and add it to history_file """
+
+    if _run[0] is None:
+        return
+    set_phase(None)
+    filename, start_time = _run
+    _run[:] = [None, 0.0]
+    wall_time = time.time() - start_time
+    write_summary(filename, wall_time)
+    history = os.path.join(os.path.dirname(filename), history_file) #next to the summary
+    new = not os.path.exists(history)
+    with open(history, 'a') as f:
+        report = efficiency(wall_time)
+        if new:
+            f.write('\t'.join(['date', 'run', 'version'] + [key for key, _ in report]) + '\n')
+        f.write('\t'.join([time.strftime('%Y-%m-%d %H:%M'), os.path.basename(filename), code_version()]
+                          + ['{0:.3f}'.format(value) for _, value in report]) + '\n')
+
+def add(name, seconds):
+
+    """ add seconds to a total kept for the run. the instrument classes add
+        the time they spend integrating ('integrating'), the live plots
+        the time spent drawing ('plotting'). """
+
+    with _lock:
+        _totals[name] = _totals.get(name, 0.0) + seconds
+
+def counts_as(name):
+
+    """ decorator, the time spent in the function is add()ed to name """
+
+    def decorator(function):
+        def counted(*args, **keyw):
+            start_time = time.time()
+            try:
+                return function(*args, **keyw)
+            finally:
+                add(name, time.time() - start_time)
+        counted.__name__ = function.__name__
+        counted.__doc__ = function.__doc__
+        return counted
+    return decorator
+
+def efficiency(wall_time):
+
+    """ [(name, value)] that add up to the wall time of the run:
+
+        integrating -- the instruments integrating (NPLC x points, DAQ samples/rate)
+        instrument -- the rest of acquire and readout: bus I/O, triggers, waiting
+        settling -- the settle phase, sleeps to let gates and fields settle,
+                    less any integrating that happens in it
+        disk -- the save phase
+        setup -- the setup phase, before and after the measurement
+        unaccounted -- not in any phase
+
+        then efficiency, integrating/wall time, and plotting, the time the
+        live plot spent drawing (in another thread, not part of the wall
+        time). """
+
+    with _lock:
+        phases = dict((key, entered[1]) for key, entered in _phases.items())
+        totals = dict(_totals)
+    integrating = totals.get('integrating', 0.0)
+    measuring = phases.get('acquire', 0.0) + phases.get('readout', 0.0)
+    report = [('wall', wall_time),
+              ('integrating', integrating),
+              ('instrument', max(measuring - integrating, 0.0)),
+              ('settling', max(phases.get('settle', 0.0) - max(integrating - measuring, 0.0), 0.0)),
+              ('disk', phases.get('save', 0.0)),
+              ('setup', phases.get('setup', 0.0))]
+    report.append(('unaccounted', max(wall_time - sum(value for _, value in report[1:]), 0.0)))
+    report.append(('efficiency', integrating/wall_time if wall_time else 0.0))
+    report.append(('plotting', totals.get('plotting', 0.0)))
+    return report
+
+def code_version():
+
+    """ git describe of this repository, 'unknown' without git """
+
+    try:
+        with open(os.devnull, 'w') as null:
+            return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr = null,
+                                           cwd = os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def summary(wall_time = None):
+
+    """ the table written by write_summary, as a string """
+
+    with _lock:
+        calls = dict((key, list(call)) for key, call in _calls.items())
+        phases = dict((key, list(entered)) for key, entered in _phases.items())
+    lines = []
+    if wall_time is not None:
+        lines.append('wall time: {0:.2f}s, code version {1}\n'.format(wall_time, code_version()))
+        for name, value in efficiency(wall_time):
+            if name == 'efficiency':
+                lines.append('{0:<14}{1:>10.1f}%'.format(name, 100*value))
+            elif name != 'wall':
+                lines.append('{0:<14}{1:>10.3f}s{2:>8.1f}%'.format(name, value, 100*value/wall_time))
+        lines.append('')
+    lines.append('{0:<10}{1:>8}{2:>12}{3:>12}{4:>12}'.format('phase', 'entered', 'time (s)',
+                                                             'calls (s)', 'other (s)'))
+    for name, (entered, seconds) in sorted(phases.items()):
+        if not entered:
+            continue
+        inside = sum(call[1] for (p, command), call in calls.items() if p == name)
+        lines.append('{0:<10}{1:>8d}{2:>12.3f}{3:>12.3f}{4:>12.3f}'.format(name, entered, seconds,
+                                                                        inside, seconds - inside))
+    if not enabled:
+        lines.append('\ninstrument calls are not timed, see enable()')
+        return '\n'.join(lines) + '\n'
+    edges = ['<{0:g}ms'.format(1e3*edge) for edge in buckets] + ['>{0:g}s'.format(buckets[-1])]
+    lines.append('')
+    lines.append('{0:<10}{1:<62}{2:>7}{3:>11}{4:>10}{5:>10}  '.format('phase', 'command', 'count',
+                                                                     'total (s)', 'mean (ms)', 'max (ms)')
+                 + ''.join('{0:>8}'.format(edge) for edge in edges))
+    for (name, command), (count, seconds, longest, histogram) in \
+            sorted(calls.items(), key = lambda item: -item[1][1]):
+        lines.append('{0:<10}{1:<62}{2:>7d}{3:>11.3f}{4:>10.2f}{5:>10.2f}  '.format(
+                         name, command, count, seconds, 1e3*seconds/count, 1e3*longest)
+                     + ''.join('{0:>8d}'.format(n) for n in histogram))
+    return '\n'.join(lines) + '\n'
+
+def write_summary(filename, wall_time = None):
+
+    """ write the efficiency report and the per phase and per command
+        tables (empty unless enabled) to filename """
+
+    with open(filename, 'w') as f:
+        f.write(summary(wall_time))
+
+if os.environ.get('MEASUREMENTS_TIMING', '') not in ('', '0'):
+    enable()
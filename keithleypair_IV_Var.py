@@ -14,16 +14,39 @@
                    NOTE: This is not yet tested. """
 
 from __future__ import division
-import time, os
-import msvcrt
+import time
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import nidaqmx
+from instruments.backend import nidaqmx
 import exptools.exptools as tools
+import exptools.datafile as datafile
+import exptools.liveplot as liveplot
+import exptools.sweep as sweep
 import instruments.instruments as instruments
 import instruments.keithleypair as keithleypair
-from threading import Thread
+from instruments import pool, timing, calibration
+
+iv_overhead = 'IV overhead per reading' #calibration key, see iv_timing
+magnet_rate = 0.2 #T/min, the rate the experiments set on the magnet
+
+def iv_timing(biasLim, ivAvg, cvResistor, srcDelay, nplc):
+
+    """ (readings, seconds per reading, seconds per reading without
+        overhead) for ivAvg IV curves. the overhead (buffer readout, status
+        polls...) is the one the last run measured, guessed from the serial
+        baud rate before there was one. """
+
+    source = keithleypair.IVmax1024
+    readings = ivAvg*tools.sweep_points(*[x/cvResistor for x in biasLim])
+    dwell = srcDelay + nplc/source.line_frequency + 0.003
+    return readings, dwell + calibration.value(iv_overhead, 4*10.0/source.serial_baud), dwell
+
+def store_iv_overhead(acquired, readings, dwell):
+
+    """ keep the overhead per reading measured in a run for iv_timing,
+        acquired is the time spent in execute_sweep for readings """
+
+    if readings:
+        calibration.store(iv_overhead, max(acquired/readings - dwell, 0.0))
     
 class IV_MagField():
 
@@ -42,37 +65,81 @@ class IV_MagField():
         To run:  measurement = keithleypair_IV_Var.IV_MagField()
                  measurement.run(biasLim, fieldLim, ...)
                  
-                 End early with 'q'. Do NOT close the plot before ending
-                 the sweep. """
+                 End early with 'q'. The plot is a separate process, see
+                 exptools.liveplot, closing it doesn't end the sweep. """
     
-    def __init__(self, filename = 'iv-DAQgate_{0:.0f}'.format(time.time())):
+    def __init__(self, filename = 'iv-magField_{0:.0f}'.format(time.time())):
     
-        """ opens a file for the experiment. this means you have to start a new instance
-            of the class each time you want a new file. strange. maybe ok? """
+        """ names the files for the experiment. the data goes in a
+            datafile.Map, filename.map, made once the sweep axes are known. """
 
         self.filename = filename
-        self.file = open(filename+'.dat','a')
+        self.map = None
+        self.live_plot = False #run() sets it, run_simple starts the plot
+
+    def estimate(self, biasLim, fieldLim, gate = 0.0, ivAvg = 1,
+                 cvResistor = 10.0, cvAmp = -1e-6, gateAmp = 9.1788,
+                 srcDelay = 0.01, fieldDelay = 2.0,
+                 nplc = 1, nvmRange = 0.1, pipelined = True):
+
+        """ (predicted run time, predicted time per field) in seconds for
+            run_simple with the same arguments, without touching the
+            instruments. the ramps are at magnet_rate. a magnet that isn't
+            in the pool has to be opened, which includes the switch heater
+            wait. a pooled one costs the heater wait only if the last run
+            left the heater off (its last known state) and the field has to
+            move, or left the magnet persistent. when pipelined, each ramp between fields hides up to the
+            serial transfer of one curve (4 bytes a reading). """
+
+        fieldBuffer = tools.get_buffer_size(fieldLim[0], fieldLim[1], fieldLim[2])
+        fields = np.linspace(fieldLim[0], fieldLim[1], fieldBuffer)
+        readings, per_reading, dwell = iv_timing(biasLim, ivAvg, cvResistor, srcDelay, nplc)
+        ramps = 60.0*np.abs(np.diff(np.concatenate([[0.0], fields, [0.0]])))/magnet_rate
+        if pipelined:
+            transfer = readings/ivAvg*4*10.0/keithleypair.IVmax1024.serial_baud
+            ramps[1:-1] = np.maximum(ramps[1:-1] - transfer, 0.0)
+        step = fieldDelay + readings*per_reading
+        setup = 4.25 + 2.0 #setup sleeps, end_at_zero
+        mag = pool.peek(instruments.oxford_magnet, "GPIB::20")
+        if mag is None:
+            setup += instruments.oxford_magnet.heater_wait + 2.5
+        elif mag.heater == 2 or (mag.heater != 1 and np.any(fields)): #persistent always needs it
+            setup += mag.heater_wait
+        total = setup + ramps.sum() + fieldBuffer*step
+        return total, (total - setup - ramps[0] - ramps[-1])/fieldBuffer
     
-    def run_simple(biasLim, fieldLim, gate = 0.0, ivAvg = 1,
+    def run_simple(self, biasLim, fieldLim, gate = 0.0, ivAvg = 1,
                     cvResistor = 10.0, cvAmp = -1e-6, gateAmp = 9.1788, 
                     srcDelay = 0.01, fieldDelay = 2.0, 
-                    nplc = 1, nvmRange = 0.1):
+                    nplc = 1, nvmRange = 0.1, pipelined = True, heater_off = True):
                     
         """ Runs the actual experiment. Can be called directly if plotting is
-            not needed. """
+            not needed.
+
+            pipelined starts the ramp to the next field as soon as the last
+            sweep at this one is done, the buffer is read and the data saved
+            while the magnet moves. the time that saves is printed at the
+            end. pipelined = False reads the buffer before the ramp.
+
+            the switch heater is turned off at the end. the magnet stays in
+            the pool either way, the next run turns the heater back on
+            before its first ramp. heater_off = False leaves it on, so that
+            run doesn't wait for it again. """
             
-        tools.write_log('iv_magField', locals(), filename+'.log')
+        tools.write_log('iv_magField', locals(), self.filename+'.log')
+        timing.start(self.filename+'.timing')
+        total, step = self.estimate(biasLim, fieldLim, gate, ivAvg, cvResistor, cvAmp, gateAmp,
+                                    srcDelay, fieldDelay, nplc, nvmRange, pipelined)
+        print 'estimated run time: {}'.format(tools.format_duration(total))
         
-        biasBuffer = tools.get_buffer_size(biasLim[0], biasLim[1], biasLim[2]) 
-        bias = np.linspace(biasLim[0], biasLim[1], biasBuffer)
-        np.savetxt(file, [np.insert(bias, 0, 0.0)], fmt = '%+.6e', delimiter = '\t')
         fieldBuffer = tools.get_buffer_size(fieldLim[0], fieldLim[1], fieldLim[2]) 
         fields = np.linspace(fieldLim[0], fieldLim[1], fieldBuffer) 
         
-        source = keithleypair.IVmax1024("GPIB::22", timeout = 60.0) #keithley object
-        mag = instruments.oxford_magnet("GPIB::20", rate = 0.2, timeout = 60.0)
-        daqGate = nidaqmx.AnalogOutputTask() #DAQ output object
-        daqGate.create_voltage_channel('Dev1/ao0', min_val = -10.0, max_val = 10.0)
+        source = pool.acquire(keithleypair.IVmax1024, "GPIB::22", timeout = 60.0) #keithley object
+        mag = pool.acquire(instruments.oxford_magnet, "GPIB::20", rate = magnet_rate, timeout = 60.0)
+        if mag.rate != magnet_rate:
+            mag.set_rate(magnet_rate)
+        daqGate = pool.acquire(nidaqmx.AnalogOutputTask, 'Dev1/ao0', min_val = -10.0, max_val = 10.0) #DAQ output object
         daqGate.write([gate/gateAmp])
         time.sleep(1.0)
             
@@ -83,11 +150,19 @@ class IV_MagField():
         source.source_arm_setup()
         source.source_trig_setup()
         source.voltmeter_channel_setup(nplc, nvmRange, digital_filter = False)
+        source.voltmeter_format_setup('sreal') #binary transfer of the buffer
         source.voltmeter_trig_setup() 
-        source.voltmeter_buffer_setup(biasBuffer)
+        source.voltmeter_buffer_setup(source.plan.points)
+        bias = source.plan.values()*cvResistor #the bias the 6220 actually sweeps
         realBuffer = int(source.ask(':sour:swe:poin?'))
-        if int(biasBuffer) != realBuffer:
-            raise RuntimeError('buffer sizes do not match: {0}, {1}'.format(int(biasBuffer), realBuffer))
+        if source.sweep_points != realBuffer:
+            raise RuntimeError('buffer sizes do not match: {0}, {1}'.format(source.sweep_points, realBuffer))
+        plan = sweep.Sweep([sweep.field(mag, fields, settle = fieldDelay)],
+                           sweep.iv_curves(source, ivAvg, bias, cvAmp, overlap = pipelined))
+        self.map = datafile.Map.create(self.filename+'.map', plan.map_axes())
+        if self.live_plot: #the newest curve and the whole map so far
+            liveplot.launch(self.map.filename, 'curve', title = self.filename, xlabel = 'bias', ylabel = 'measured')
+            liveplot.launch(self.map.filename, 'map', title = self.filename, xlabel = 'bias', ylabel = 'field')
         
         #check that everything is setup
         print 'source state    = {}'.format(source.source_chk_op_evnt_reg())
@@ -99,73 +174,33 @@ class IV_MagField():
         source.write(":sour:swe:arm")
         time.sleep(3.0)
         
-        mag.go_to_field(fieldLim[0], fieldDelay)
-        
-        for field in fields:
-            print 'running IV for field = {}T'.format(field)
-            mag.go_to_field(field, fieldDelay)
-            data = np.array(source.execute_sweep(ivAvg = ivAvg, timeout = 120.0), dtype = np.floating)
-            data = data*cvAmp #calculate current from voltage measurement
-            for i in range(ivAvg): #save all data before averaging
-                np.savetxt(file, [np.insert(data[i], 0, field)], fmt = '%+.6e', delimiter = '\t')
-                self.file.flush(); os.fsync(self.file)
-                print data[i][0], data[i][1], '...', data[i][-2], data[i][-1]
-            data = data.mean(axis = 0) #average over multiple IV curves for plot
-            
-            if msvcrt.kbhit():
-                if ord(msvcrt.getch()) == 113:
-                    print "Program ended by user.\n"
-                    break 
+        readings, _, dwell = iv_timing(biasLim, ivAvg, cvResistor, srcDelay, nplc)
+        plan.run(self.map, step) #prints the time pipelined saved
         print 'Cleaning up...'
+        timing.set_phase('setup')
+        store_iv_overhead(plan.acquired, plan.done*readings, dwell)
         source.write(":outp 0") #turn off current source
-        source.close()
-        mag.end_at_zero() #set field back to zero
-        mag.close()
+        mag.end_at_zero(heater_off) #set field back to zero
         daqGate.write([0.0]) #turn off gate
+        pool.release(mag, source, daqGate) #left open for the next run
         del mag, source, daqGate
-        self.file.close()
+        self.map.close()
+        timing.finish()
         
     def run(self, *args, **kwargs):
     
-        """ This will run the animation as the main thread and start a 
-            second thread for the measurement.
+        """ Runs self.run_simple with live plots of the newest IV curve and
+            of the map so far, in separate processes so drawing doesn't hold
+            up the measurement.
             
             Takes all of the arguments and keyword arguments and passes them
             to self.run_simple """
         
-        runArgs = args
-        runKwargs = kwargs
-        fileName = self.filename+'.dat'
-        
-        def update_iv_field(num, fileName, title_text, line, ax):
-            data = np.loadtxt(fileName, dtype = np.floating)
-            line.set_ydata(data[-1,1:])
-            ax.set_ylim(np.amin(data[-1,1:]), np.amax(data[-1,1:])) 
-            title_text.set_text('field = {}T'.format(data[-1,0]))
-            return line, title_text, ax
-    
-        t = Thread(target = self.run_simple, args = runArgs, kwargs = runKwargs)
-        t.start()
-        time.sleep(5.0)
-        
-        r = 0
-        while r <2:
-            data = np.loadtxt(fileName)
-            r = np.shape(data)[0]  #wait for at least two rows to plot
-            
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        ax.set_xlim(data[0,1], data[0,-1])
-        ax.set_ylim(data[1,1]*1.25, data[1,-1]*1.25)
-        title_text = plt.title('gate = {}'.format(data[1, 0]))
-        line, = ax.plot(data[0,1:], data[1,1:],'r-')
-        plt.xlabel('bias')
-        plt.ylabel('measured')
-
-        line_ani = animation.FuncAnimation(fig, update_iv_gate, fargs=(fileName, title_text, line, ax),
-            interval=1000, blit=False)
-
-        plt.show()
+        self.live_plot = True
+        try:
+            self.run_simple(*args, **kwargs)
+        finally:
+            self.live_plot = False
 
 class IV_DAQgate():
 
@@ -187,16 +222,30 @@ class IV_DAQgate():
         To run:  measurement = keithleypair_IV_Var.IV_DAQgate()
                  measurement.run(biasLim, gateLim, ...)
                  
-                 End early with 'q'. Do NOT close the plot before ending
-                 the sweep. """
+                 End early with 'q'. The plot is a separate process, see
+                 exptools.liveplot, closing it doesn't end the sweep. """
         
     def __init__(self, filename = 'iv-DAQgate_{0:.0f}'.format(time.time())):
     
-        """ opens a file for the experiment. this means you have to start a new instance
-            of the class each time you want a new file. strange. maybe ok? """
+        """ names the files for the experiment. the data goes in a
+            datafile.Map, filename.map, made once the sweep axes are known. """
 
         self.filename = filename
-        self.file = open(filename+'.dat','a')
+        self.map = None
+        self.live_plot = False #run() sets it, run_simple starts the plot
+    
+    def estimate(self, biasLim, gateLim, field = 0.0, ivAvg = 1,
+                 cvResistor = 10.0, cvAmp = -1e-6, gateAmp = 9.1788,
+                 srcDelay = 0.01, gateDelay = 1.0, nplc = 1, nvmRange = 0.1):
+
+        """ (predicted run time, predicted time per gate) in seconds for
+            run_simple with the same arguments, without touching the
+            instruments. """
+
+        gateBuffer = tools.get_buffer_size(gateLim[0], gateLim[1], gateLim[2])
+        readings, per_reading, dwell = iv_timing(biasLim, ivAvg, cvResistor, srcDelay, nplc)
+        step = gateDelay + readings*per_reading
+        return 3.25 + gateBuffer*step, step #setup sleeps
     
     def run_simple(self, biasLim, gateLim, field = 0.0, ivAvg = 1,
                cvResistor = 10.0, cvAmp = -1e-6, gateAmp = 9.1788, 
@@ -206,16 +255,16 @@ class IV_DAQgate():
             not needed. """
             
         tools.write_log('iv_DAQgate', locals(), self.filename+'.log') #save hacked log-file
+        timing.start(self.filename+'.timing')
+        total, step = self.estimate(biasLim, gateLim, field, ivAvg, cvResistor, cvAmp, gateAmp,
+                                    srcDelay, gateDelay, nplc, nvmRange)
+        print 'estimated run time: {}'.format(tools.format_duration(total))
     
-        biasBuffer = tools.get_buffer_size(biasLim[0], biasLim[1], biasLim[2]) 
-        bias = np.linspace(biasLim[0], biasLim[1], biasBuffer)
-        data = np.zeros(biasBuffer)
         gateBuffer = tools.get_buffer_size(gateLim[0], gateLim[1], gateLim[2]) 
         gates = np.linspace(gateLim[0], gateLim[1], gateBuffer) 
         
-        source = keithleypair.IVmax1024("GPIB::22", timeout = 30.0) #keithley object
-        daqGate = nidaqmx.AnalogOutputTask() #DAQ output object
-        daqGate.create_voltage_channel('Dev1/ao0', min_val = -10.0, max_val = 10.0)
+        source = pool.acquire(keithleypair.IVmax1024, "GPIB::22", timeout = 30.0) #keithley object
+        daqGate = pool.acquire(nidaqmx.AnalogOutputTask, 'Dev1/ao0', min_val = -10.0, max_val = 10.0) #DAQ output object
         
         #setup sweep and nanovoltmeter parameters
         source.general_setup(beep = True)
@@ -224,11 +273,19 @@ class IV_DAQgate():
         source.source_arm_setup()
         source.source_trig_setup()
         source.voltmeter_channel_setup(nplc, nvmRange, digital_filter = False)
+        source.voltmeter_format_setup('sreal') #binary transfer of the buffer
         source.voltmeter_trig_setup() 
-        source.voltmeter_buffer_setup(biasBuffer)
+        source.voltmeter_buffer_setup(source.plan.points)
+        bias = source.plan.values()*cvResistor #the bias the 6220 actually sweeps
         realBuffer = int(source.ask(':sour:swe:poin?'))
-        if int(biasBuffer) != realBuffer:
-            raise RuntimeError('buffer sizes do not match: {0}, {1}'.format(int(biasBuffer), realBuffer))
+        if source.sweep_points != realBuffer:
+            raise RuntimeError('buffer sizes do not match: {0}, {1}'.format(source.sweep_points, realBuffer))
+        plan = sweep.Sweep([sweep.gate(daqGate, gates, gateAmp, settle = gateDelay)],
+                           sweep.iv_curves(source, ivAvg, bias, cvAmp))
+        self.map = datafile.Map.create(self.filename+'.map', plan.map_axes())
+        if self.live_plot: #the newest curve and the whole map so far
+            liveplot.launch(self.map.filename, 'curve', title = self.filename, xlabel = 'bias', ylabel = 'measured')
+            liveplot.launch(self.map.filename, 'map', title = self.filename, xlabel = 'bias', ylabel = 'gate')
         
         #check that everything is setup
         print 'source state    = {}'.format(source.source_chk_op_evnt_reg())
@@ -240,72 +297,33 @@ class IV_DAQgate():
         source.write(":sour:swe:arm")
         time.sleep(3.0)
         
-        np.savetxt(self.file, [np.insert(bias, 0, 0.0)], fmt = '%+.6e', delimiter = '\t')
-        for gate in gates:
-            print 'running IV for gate = {}V'.format(gate)
-            daqGate.write([gate/gateAmp])
-            time.sleep(gateDelay)
-            data = np.array(source.execute_sweep(ivAvg = ivAvg, timeout = 120.0), dtype = np.floating)
-            data = data*cvAmp #calculate current from voltage measurement
-            for i in range(ivAvg): #save all data before averaging
-                np.savetxt(self.file, [np.insert(data[i], 0, gate)], fmt = '%+.6e', delimiter = '\t')
-                self.file.flush(); os.fsync(self.file)
-                print data[i][0], data[i][1], '...', data[i][-2], data[i][-1] 
-            data = data.mean(axis = 0) #average over multiple IV curves for plot
-            
-            if msvcrt.kbhit():
-                if ord(msvcrt.getch()) == 113: #press 'q' to exit anytime
-                    print "Program ended by user.\n"
-                    break 
+        readings, _, dwell = iv_timing(biasLim, ivAvg, cvResistor, srcDelay, nplc)
+        plan.run(self.map, step) #the next gate settles while the buffer is read and saved
 
         print('Cleaning up...')
+        timing.set_phase('setup')
+        store_iv_overhead(plan.acquired, plan.done*readings, dwell)
         source.write(":outp 0") #turn off current source
-        source.close()
         daqGate.write([0.0]) #turn off gate
-        del daqGate, source #delete DAQ object so it can be reused
-        self.file.close()
+        pool.release(daqGate, source) #left open for the next run
+        del daqGate, source
+        self.map.close()
+        timing.finish()
             
     def run(self, *args, **kwargs):
     
-        """ This will run the animation as the main thread and start a 
-            second thread for the measurement.
+        """ Runs self.run_simple with live plots of the newest IV curve and
+            of the map so far, in separate processes so drawing doesn't hold
+            up the measurement.
             
             Takes all of the arguments and keyword arguments and passes them
             to self.run_simple """
         
-        runArgs = args
-        runKwargs = kwargs
-        fileName = self.filename+'.dat'
-        
-        def update_iv_gate(num, fileName, title_text, line, ax):
-            data = np.loadtxt(fileName, dtype = np.floating)
-            line.set_ydata(data[-1,1:])
-            ax.set_ylim(np.amin(data[-1,1:]), np.amax(data[-1,1:])) 
-            title_text.set_text('gate = {}V'.format(data[-1,0]))
-            return line, title_text
-    
-        t = Thread(target = self.run_simple, args = runArgs, kwargs = runKwargs)
-        t.start()
-        time.sleep(5.0)
-        
-        l = 0
-        while l <2:
-            data = np.loadtxt(fileName)
-            l = len(np.shape(data))
-            
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        ax.set_xlim(np.amin(data[0,1:]), np.amax(data[0,1:]))
-        ax.set_ylim(np.amin(data[-1,1:]), np.amax(data[-1,1:]))
-        title_text = plt.title('gate = {}'.format(data[1, 0]))
-        line, = ax.plot(data[0,1:], data[1,1:],'r-')
-        plt.xlabel('bias')
-        plt.ylabel('measured')
-
-        line_ani = animation.FuncAnimation(fig, update_iv_gate, fargs=(fileName, title_text, line, ax),
-            interval=1000, blit=False)
-
-        plt.show()
+        self.live_plot = True
+        try:
+            self.run_simple(*args, **kwargs)
+        finally:
+            self.live_plot = False
         
 if __name__ == "__main__":
     print 'Call the functions, fool!'
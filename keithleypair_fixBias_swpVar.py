@@ -28,16 +28,19 @@
     
 
 from __future__ import division
-import time, os, math
-import msvcrt
+import time, math
 import numpy as np
 import matplotlib.pylab as plt
-import matplotlib.animation as animation
-import nidaqmx
-import exptools as tools
-import instruments
-import keithleypair
-from threading import Thread
+from instruments.backend import nidaqmx, msvcrt
+import exptools.exptools as tools
+import exptools.datafile as datafile
+import exptools.decimate as decimate
+import exptools.liveplot as liveplot
+import exptools.sweep as sweep
+import instruments.keithleypair as keithleypair
+from instruments import pool, timing, calibration
+
+point_overhead = 'FixedBias overhead per reading' #calibration key, see FixBias_SwpGate.estimate
 
 class FixBias_SwpGate():
 
@@ -61,12 +64,29 @@ class FixBias_SwpGate():
         Be sure to optimize the nanovoltmeter range. Setting it to 'auto' 
         is quite slow. """
         
-    def __init__(self):
+    def __init__(self, filename = 'fixBias_swpGate_{0:.0f}'.format(time.time())):
     
-        """ This doesn't do much other than create the end_run variable. """
+        """ opens a file for the experiment and creates the end_run variable. """
 
         self.end_run = False
         self.data = 0.0
+        self.filename = filename
+        self.file = datafile.DataFile(filename+'.npy')
+        
+    def estimate(self, bias, gateLim, avg = 6.0, field = 0.0, runs = 1,
+                 cvResistor = 1.0, cvAmp = 1.0, gateAmp = 9.1788,
+                 measDelay = 0.1, gateDelay = 1.0, nplc = 1, nvmRange = 0.1):
+
+        """ (predicted run time, predicted time per gate) in seconds for
+            run_simple with the same arguments, without touching the
+            instruments. the overhead per reading (serial round trips) is the
+            one the last run measured. """
+
+        gateBuffer = tools.get_buffer_size(gateLim[0], gateLim[1], gateLim[2])
+        source = keithleypair.FixedBias
+        dwell = measDelay + nplc/source.line_frequency + 0.003
+        step = gateDelay + int(avg)*(dwell + calibration.value(point_overhead, 0.02))
+        return 2.0 + runs*gateBuffer*step, step #setup sleep
         
     def run_simple(self, bias, gateLim, avg = 6.0, field = 0.0, runs = 1,
                    cvResistor = 1.0, cvAmp = 1.0, gateAmp = 9.1788, 
@@ -76,10 +96,13 @@ class FixBias_SwpGate():
             run() function. """
         
         tools.write_log('fixBias_swpGate', locals(), self.filename+'.log')
+        timing.start(self.filename+'.timing')
+        total, step = self.estimate(bias, gateLim, avg, field, runs, cvResistor, cvAmp, gateAmp,
+                                    measDelay, gateDelay, nplc, nvmRange)
+        print 'estimated run time: {}'.format(tools.format_duration(total))
         
-        source = keithleypair.FixedBias("GPIB::22", timeout = 60.0) #keithley object
-        daqGate = nidaqmx.AnalogOutputTask() #DAQ output object
-        daqGate.create_voltage_channel('Dev1/ao0', min_val = -10.0, max_val = 10.0)
+        source = pool.acquire(keithleypair.FixedBias, "GPIB::22", timeout = 60.0) #keithley object
+        daqGate = pool.acquire(nidaqmx.AnalogOutputTask, 'Dev1/ao0', min_val = -10.0, max_val = 10.0) #DAQ output object
         
         gateBuffer = tools.get_buffer_size(gateLim[0], gateLim[1], gateLim[2])
         gates = np.linspace(gateLim[0], gateLim[1], gateBuffer)
@@ -97,74 +120,36 @@ class FixBias_SwpGate():
         source.write(":outp 1")
         time.sleep(2.0)
         
-        data = np.zeros(gateBuffer)
-
-        for run in range(runs):
-            end = False
-            for i, gate in enumerate(gates):
-                daqGate.write([gate/gateAmp])
-                time.sleep(gateDelay)
-                data[i] = source.get_meas()
-                data[i] = data[i]*cvAmp
-                np.savetxt(self.file, [[gate, data[i], run+1]], fmt = '%+.6e', delimiter = '\t')
-                self.file.flush(); os.fsync(self.file)
-                if msvcrt.kbhit():
-                    if ord(msvcrt.getch()) == 113:
-                        end = True
-                        print "Program ended by user.\n"
-                        break
-            if end: break
-            gates = gates.reshape(-1)[::-1]     #sweep in the other direction
-            data.fill(0.0)
+        plan = sweep.Sweep([sweep.repeat(runs), #one way, then the other
+                            sweep.gate(daqGate, gates, gateAmp, settle = gateDelay, snake = True)],
+                           sweep.point(source, cvAmp))
+        plan.run(self.file, step, eta_every = 10) #rows of gate, measured, run
             
         print 'Cleaning up...'
+        timing.set_phase('setup')
+        if plan.done:
+            dwell = measDelay + nplc/source.line_frequency + 0.003 #as in estimate
+            calibration.store(point_overhead, max(plan.acquired/(plan.done*source.avg) - dwell, 0.0))
         source.write(":outp 0") #turn off current source
-        source.close()
         daqGate.write([0.0]) #turn off gate
-        del daqGate, source #delete DAQ object so it can be reused
+        pool.release(daqGate, source) #left open for the next run
+        del daqGate, source
         self.file.close()
+        timing.finish()
 
     def run(self, *args, **kwargs):
     
-        """ This will run the animation as the main thread and start a 
-            second thread for the measurement.
+        """ Runs self.run_simple with a live plot in a separate process, so
+            drawing doesn't hold up the measurement. Closing the plot
+            doesn't end the sweep.
             
             Takes all of the arguments and keyword arguments and passes them
             to self.run_simple """
         
-        runArgs = args
-        runKwargs = kwargs
-        fileName = self.filename+'.dat'
-        
-        def update_current_gate(num, fileName, line, ax):
-            data = np.loadtxt(fileName, dtype = np.floating)
-            line.set_data(data[:,0], data[:,1])
-            ax.set_xlim(np.amin(data[:,0]), np.amax(data[:,0]))
-            ax.set_ylim(np.amin(data[:,1]), np.amax(data[:,1])) 
-            return line, ax
-    
-        t = Thread(target = self.run_simple, args = runArgs, kwargs = runKwargs)
-        t.start()
-        time.sleep(3.0)
-        
-        p = 0
-        while p <6:
-            data = np.loadtxt(fileName, dtype = np.floating)
-            p = np.size(data)  #wait for at least two points to plot
-            
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        ax.set_xlim(data[0,0], data[-1,0])
-        ax.set_ylim(data[0,1]*0.9, data[-1,1]*1.1)
-        title_text = plt.title('bias = {}V'.format(args[0]))
-        line, = ax.plot(data[:,0], data[:,1],'r-o')
-        plt.xlabel('gate')
-        plt.ylabel('measured')
-
-        line_ani = animation.FuncAnimation(fig, update_current_gate, fargs=(fileName, line, ax),
-            interval=1000, blit=False)
-
-        plt.show()
+        bias = args[0] if args else kwargs['bias']
+        liveplot.launch(self.file.filename, 'points', title = 'bias = {}V'.format(bias),
+                        xlabel = 'gate', ylabel = 'measured')
+        self.run_simple(*args, **kwargs)
 
 class FixBias_gateTest():
 
@@ -179,8 +164,8 @@ class FixBias_gateTest():
     
         """ This doesn't do much other than create the end_run variable. """
 
-        self.start_run = False
         self.end_run = False
+        self.live_plot = False #run() sets it, run_simple starts the plot
         
     def run_simple(self, bias, avg = 1.0, field = 0.0, 
                    cvResistor = 10.0, cvAmp = -1e-7, gateAmp = 1.0, 
@@ -191,14 +176,18 @@ class FixBias_gateTest():
             run() function. """
         
         tools.write_log('gateTest_vBias_', locals(), filename+'.log.txt')
-        file = open(filename+'.dat.txt','a')
+        timing.start(filename+'.timing')
+        file = datafile.DataFile(filename+'.npy')
         
         self.end_run = False
-        self.start_run = False
+        watch = None
+        if self.live_plot: #closing it ends the run
+            viewer = liveplot.launch(file.filename, 'points', title = 'bias = {0:+.2e}V'.format(bias),
+                                     xlabel = 'gate (V)', ylabel = 'current (A)')
+            watch = liveplot.when_closed(viewer, self.stop)
         
-        source = keithleypair.FixedBias("GPIB::22", timeout = 60.0) #keithley object
-        daqGate = nidaqmx.AnalogOutputTask() #DAQ output object
-        daqGate.create_voltage_channel('Dev1/ao1', min_val = -10.0, max_val = 10.0)
+        source = pool.acquire(keithleypair.FixedBias, "GPIB::22", timeout = 60.0) #keithley object
+        daqGate = pool.acquire(nidaqmx.AnalogOutputTask, 'Dev1/ao1', min_val = -10.0, max_val = 10.0) #DAQ output object
         
         gat = np.arange(0,10.25,0.25)
         gates = np.append(gat, [gat[::-1], -gat, -gat[::-1]])
@@ -235,19 +224,24 @@ class FixBias_gateTest():
         exitGate = 0.0
         print 'GO!'
         for i, gate in enumerate(gates):
+            timing.set_phase('settle')
             daqGate.write(gate/gateAmp)
             time.sleep(gateDelay)
+            timing.set_phase('acquire')
             self.data[i,0] = gate
             self.data[i,1] = source.get_meas()*cvAmp
             self.data[i,2] = bias/self.data[i,1]
-            np.savetxt(file, [self.data[i]], fmt = '%+.6e', delimiter = '\t')
+            timing.set_phase('save')
+            file.write(self.data[i])
             if (msvcrt.kbhit() and ord(msvcrt.getch()) == 113) or self.end_run:
                     exitGate = gate
                     print "Program ended by user."
                     break
-            if i == 2: self.start_run = True
         
         #ramp down bias voltage
+        timing.set_phase('setup')
+        if watch is not None:
+            watch.cancel()
         print 'Turning off bias...'
         for i in range(0, 10):
             outp = c*2*math.pow(10,-i)
@@ -269,50 +263,33 @@ class FixBias_gateTest():
                 time.sleep(0.5)
                 
         source.write(":outp 0") #turn off current source
-        source.close() #close gpib instrument
         daqGate.write(0.0) #turn off gate, should already be at 0
-        daqGate.clear()
-        del daqGate, source #delete DAQ object so it can be reused
+        pool.release(daqGate, source) #left open for the next run
+        del daqGate, source
         file.close()
+        timing.finish()
         print 'Done.'
 
+    def stop(self):
+
+        """ end the run after the point being measured, from any thread """
+
+        self.end_run = True
+
     def run(self, *args, **kwargs):
     
-        """ This will run the animation as the main thread and start a 
-            second thread for the measurement.
+        """ Runs self.run_simple with a live plot of current against gate
+            in a separate process, see exptools.liveplot. Closing the plot
+            ends the run, like 'q'.
             
             Takes all of the arguments and keyword arguments and passes them
             to self.run_simple """
         
-        runArgs = args
-        runKwargs = kwargs
-        
-        def update_current_gate(num, line, ax):
-            poin = np.count_nonzero(self.data[:,1])
-            line.set_data(self.data[0:poin,0], self.data[0:poin,1])
-            ax.set_xlim(np.amin(self.data[0:poin,0]), np.amax(self.data[0:poin,0]))
-            ax.set_ylim(np.amin(self.data[0:poin,1]),np.amax(self.data[0:poin,1])) 
-            return line, ax
-    
-        t = Thread(target = self.run_simple, args = runArgs, kwargs = runKwargs)
-        t.start()
-        time.sleep(5.0)
-        
-        while self.start_run == False: time.sleep(0.2)
-            
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        ax.grid(True)
-        title_text = plt.title('bias = {0:+.2e}V'.format(args[0]))
-        line, = ax.plot([], [],'r-o')
-        plt.xlabel('gate (V)')
-        plt.ylabel('current (A)')
-
-        line_ani = animation.FuncAnimation(fig, update_current_gate, fargs=(line, ax),
-            interval=500, blit=False)
-
-        plt.show()
-        self.end_run = True
+        self.live_plot = True
+        try:
+            self.run_simple(*args, **kwargs)
+        finally:
+            self.live_plot = False
         
         
 class FixBias_stabilityTest():
@@ -337,12 +314,13 @@ class FixBias_stabilityTest():
             run() function. """
         
         tools.write_log('gateTest_vBias_', locals(), filename+'.log.txt')
-        file = open(filename+'.dat.txt','a')
+        timing.start(filename+'.timing')
+        file = datafile.DataFile(filename+'.npy')
         
         self.end_run = False
         self.start_run = False
         
-        source = keithleypair.FixedBias("GPIB::22", timeout = 60.0) #keithley object
+        source = pool.acquire(keithleypair.FixedBias, "GPIB::22", timeout = 60.0) #keithley object
 
         self.data = np.zeros((points, 4))
         
@@ -376,6 +354,7 @@ class FixBias_stabilityTest():
         #run experiment
         print 'GO!'
         start_time = time.time()
+        timing.set_phase('acquire')
         for i in range(points):
             time.sleep(gateDelay)
             source.write_serial('*TRG')
@@ -384,12 +363,16 @@ class FixBias_stabilityTest():
                     print "Program ended by user."
                     break
         
+        timing.set_phase('readout')
         self.data[:,1] = source.read_2182A_buffer()
+        timing.add('integrating', points*source.integration_time())
         self.data[:,2] = self.data[:,1]*cvAmp
         self.data[:,3] = bias/self.data[:,2]
-        np.savetxt(file, self.data, fmt = '%+.6e', delimiter = '\t')
+        timing.set_phase('save')
+        file.write(self.data)
         
         #ramp down bias voltage
+        timing.set_phase('setup')
         print 'Turning off bias...'
         for i in range(0, 10):
             outp = c*2*math.pow(10,-i)
@@ -399,16 +382,18 @@ class FixBias_stabilityTest():
                 time.sleep(1.0)
                 
         source.write(":outp 0") #turn off current source
-        source.close() #close gpib instrument
-        del source #delete DAQ object so it can be reused
+        pool.release(source) #left open for the next run
+        del source
         file.close()
+        timing.finish()
         print 'Done.'
             
         fig = plt.figure()
         ax = fig.add_subplot(111)
         ax.grid(True)
         title_text = plt.title('bias = {0:+.2e}V'.format(bias))
-        line, = ax.plot(self.data[:,0], self.data[:,2],'r-o')
+        t, current = decimate.lttb(self.data[:,0], self.data[:,2], 2000) #the shape of an overnight run
+        line, = ax.plot(t, current,'r-') #markers would hide the envelope
         plt.xlabel('time (s)')
         plt.ylabel('current (A)')
         plt.show()